@@ -88,6 +88,7 @@ def get_true_posterior_slope(
 #%%
 # Sanity Check
 np.random.seed(0)
+pr.set_rng(0)
 
 sigma = 2.
 
@@ -100,23 +101,40 @@ intercept_prior_mean, intercept_prior_sigma = (0,3)
 vectorized = True
 model = linear_regression_vectorized if vectorized else linear_regression
 
-samples = [
-    model(
+# batched execution draws all particles in a single model run
+# (the loop model is used, as its observe statements broadcast over particles)
+batched = True
+
+if batched:
+    retval, trace = pr.execute(
+        linear_regression, pr.Trace(batch_size=100_000),
         x, y,
         slope_prior_mean, slope_prior_sigma,
         intercept_prior_mean, intercept_prior_sigma,
         sigma
     )
-    for _ in tqdm(range(100_000))
-]
-traces = [trace.entries_by_address() for retval, trace in samples]
-lps = np.array([trace.log_likelihood for retval, trace in samples])
-p = np.exp(lps)
+    entries = trace.entries_by_address()
+    slope = entries["slope"]["value"]
+    intercept = entries["intercept"]["value"]
+    lps = trace.log_likelihood
+else:
+    samples = [
+        model(
+            x, y,
+            slope_prior_mean, slope_prior_sigma,
+            intercept_prior_mean, intercept_prior_sigma,
+            sigma
+        )
+        for _ in tqdm(range(100_000))
+    ]
+    traces = [trace.entries_by_address() for retval, trace in samples]
+    slope = np.array([trace["slope"]["value"] for trace in traces])
+    intercept = np.array([trace["intercept"]["value"] for trace in traces])
+    lps =np.array([trace.log_likelihood for retval, trace in samples])
+p = np.exp(lps - lps.max())
 p = p / p.sum()
 
 #%%
-slope = np.array([trace["slope"]["value"] for trace in traces])
-
 slope_posterior = get_true_posterior_slope(x, y,
     slope_prior_mean, slope_prior_sigma,
     intercept_prior_mean, intercept_prior_sigma,
@@ -131,7 +149,6 @@ plt.title("Slope Posterior")
 plt.show()
 
 #%%
-intercept = np.array([trace["intercept"]["value"] for trace in traces])
 intercept_posterior = get_true_posterior_intercept(x, y,
     slope_prior_mean, slope_prior_sigma,
     intercept_prior_mean, intercept_prior_sigma,
@@ -1,3 +1,15 @@
 # from .distributions import *
 from .scipy_distributions import *
-from .sample import *
\ No newline at end of file
+from .sample import *
+from .importance import *
+from .mcmc import *
+from .smc import *
+from .enumeration import *
+from .marginalize import *
+from .transforms import *
+from .hmc import *
+from .dual import *
+from .optimize import *
+from .variational import *
+from .subsample import *
+from .handlers import *
\ No newline at end of file
@@ -0,0 +1,74 @@
+import itertools
+import numpy as np
+import pytest
+from scipy.stats import norm
+
+import probros as pr
+from probros import Bernoulli, Dirac, observe, probabilistic_program, sample
+
+# Models shared by the tests of several engines, with their exact posteriors.
+
+@probabilistic_program
+def burglary_model(data):
+    earthquake = sample("earthquake", Bernoulli(0.02))
+    burglary = sample("burglary", Bernoulli(0.01))
+    if earthquake == 1:
+        phone_working = sample("phone_working", Bernoulli(0.8))
+    else:
+        phone_working = sample("phone_working", Bernoulli(0.9))
+    if earthquake == 1:
+        mary_wakes = sample("mary_wakes", Bernoulli(0.8))
+    elif burglary == 1:
+        mary_wakes = sample("mary_wakes", Bernoulli(0.7))
+    else:
+        mary_wakes = sample("mary_wakes", Bernoulli(0.1))
+    called = mary_wakes == 1 and phone_working == 1
+    observe(data, "observed", Dirac(called))
+
+# the model, log p(called) and p(burglary | called) by summing over all four choices
+@pytest.fixture
+def burglary():
+    evidence = p_burglary = 0.
+    for e, b, phone, mary in itertools.product([0, 1], repeat=4):
+        p = (0.02 if e else 0.98) * (0.01 if b else 0.99)
+        p_phone = 0.8 if e else 0.9
+        p_mary = 0.8 if e else 0.7 if b else 0.1
+        p *= (p_phone if phone else 1 - p_phone) * (p_mary if mary else 1 - p_mary)
+        if phone and mary:
+            evidence += p
+            p_burglary += p * b
+    return burglary_model, np.log(evidence), p_burglary / evidence
+
+# conjugate normal model
+@probabilistic_program
+def location_model(y):
+    mu = sample("mu", pr.Normal(0., 1.))
+    for i in range(len(y)):
+        observe(y[i], pr.IndexedAddress("y", i), pr.Normal(mu, 1.))
+
+# the model, data, log evidence, and posterior mean and variance of mu
+@pytest.fixture
+def location():
+    y = np.array([0.8, 1.2, 0.5])
+    n = len(y)
+    mean, variance = y.sum() / (n + 1), 1 / (n + 1)
+    log_evidence = norm.logpdf(y, 0., 1.).sum() + norm.logpdf(0., 0., 1.) - norm.logpdf(0., mean, np.sqrt(variance))
+    return location_model, y, log_evidence, mean, variance
+
+# linear regression with known noise, the posterior is Gaussian
+@probabilistic_program
+def regression_model(x, y):
+    slope = sample("slope", pr.Normal(0., 3.))
+    intercept = sample("intercept", pr.Normal(0., 3.))
+    for i in range(len(x)):
+        observe(y[i], pr.IndexedAddress("y", i), pr.Normal(slope * x[i] + intercept, 0.5))
+
+# the model, data, and posterior mean and standard deviations of (slope, intercept)
+@pytest.fixture
+def regression():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=20)
+    y = 2. * x - 1. + 0.5 * rng.normal(size=20)
+    X = np.stack([x, np.ones_like(x)], axis=1)
+    cov = np.linalg.inv(X.T @ X / 0.25 + np.eye(2) / 9.)
+    return regression_model, x, y, cov @ X.T @ y / 0.25, np.sqrt(np.diag(cov))
@@ -0,0 +1,155 @@
+import numpy as np
+import scipy.special as special
+
+# Forward-mode dual numbers for gradients of a model run.
+# A Dual holds a value (scalar or array) and its derivatives with respect to
+# d inputs at once, stored on the last axis of `tangent`, i.e. tangent has
+# shape value.shape + (d,) (or a shape that broadcasts to it).
+# Duals support arithmetic, comparisons (of the values), indexing, sum, and
+# the numpy and scipy ufuncs listed below, e.g. np.log(x) or special.gammaln(x).
+# Functions from `math` do not accept Duals.
+# e.g.
+#   x = Dual.variables(np.array([1., 2.]))
+#   y = x[0] * np.exp(x[1])
+#   y.value, y.tangent  # e^2, [e^2, e^2]
+class Dual:
+    __slots__ = ("value", "tangent")
+
+    def __init__(self, value, tangent) -> None:
+        self.value = value
+        self.tangent = tangent
+
+    # independent variables for the entries of a flat vector
+    @staticmethod
+    def variables(values) -> "Dual":
+        values = np.asarray(values, dtype=float)
+        return Dual(values, np.eye(len(values)))
+
+    @property
+    def shape(self) -> tuple:
+        return np.shape(self.value)
+
+    @property
+    def ndim(self) -> int:
+        return np.ndim(self.value)
+
+    def full_tangent(self) -> np.ndarray:
+        return np.broadcast_to(self.tangent, self.shape + self.tangent.shape[-1:])
+
+    def __len__(self) -> int:
+        return len(self.value)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    # the key indexes the value axes, the tangent axis is kept
+    def __getitem__(self, key) -> "Dual":
+        tangent_key = (key if isinstance(key, tuple) else (key,)) + (slice(None),)
+        return Dual(self.value[key], self.full_tangent()[tangent_key])
+
+    def reshape(self, *shape) -> "Dual":
+        if len(shape) == 1 and isinstance(shape[0], tuple):
+            shape = shape[0]
+        return Dual(np.reshape(self.value, shape), self.full_tangent().reshape(shape + self.tangent.shape[-1:]))
+
+    # also used by np.sum
+    def sum(self, axis=None, out=None, **kwargs) -> "Dual":
+        ndim = self.ndim
+        axes = tuple(range(ndim)) if axis is None else tuple(a % ndim for a in np.atleast_1d(axis))
+        return Dual(np.sum(self.value, axis=axes), self.full_tangent().sum(axis=axes))
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if method != "__call__" or kwargs:
+            return NotImplemented
+        if len(inputs) == 1 and ufunc in _UNARY:
+            x = self.value
+            y = ufunc(x)
+            return Dual(y, _expand(_UNARY[ufunc](x, y)) * self.tangent)
+        if len(inputs) == 2 and ufunc in _BINARY:
+            (a, da), (b, db) = _parts(inputs[0]), _parts(inputs[1])
+            y = ufunc(a, b)
+            tangent = 0.
+            if da is not None:
+                tangent = tangent + _expand(_BINARY[ufunc][0](a, b, y)) * da
+            if db is not None:
+                tangent = tangent + _expand(_BINARY[ufunc][1](a, b, y)) * db
+            return Dual(y, tangent)
+        return NotImplemented
+
+    def __add__(self, other): return np.add(self, other)
+    def __radd__(self, other): return np.add(other, self)
+    def __sub__(self, other): return np.subtract(self, other)
+    def __rsub__(self, other): return np.subtract(other, self)
+    def __mul__(self, other): return np.multiply(self, other)
+    def __rmul__(self, other): return np.multiply(other, self)
+    def __truediv__(self, other): return np.true_divide(self, other)
+    def __rtruediv__(self, other): return np.true_divide(other, self)
+    def __pow__(self, other): return np.power(self, other)
+    def __rpow__(self, other): return np.power(other, self)
+    def __neg__(self): return np.negative(self)
+    def __pos__(self): return self
+    def __abs__(self): return np.absolute(self)
+
+    def __lt__(self, other): return self.value < primal(other)
+    def __le__(self, other): return self.value <= primal(other)
+    def __gt__(self, other): return self.value > primal(other)
+    def __ge__(self, other): return self.value >= primal(other)
+    def __eq__(self, other): return self.value == primal(other)
+    def __ne__(self, other): return self.value != primal(other)
+    def __bool__(self): return bool(self.value)
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"Dual({self.value}, tangent={self.tangent})"
+
+# value of a Dual (or anything else)
+def primal(x):
+    return x.value if type(x) is Dual else x
+
+def _parts(x) -> tuple:
+    return (x.value, x.tangent) if type(x) is Dual else (x, None)
+
+def _expand(x):
+    return np.asarray(x)[..., None]
+
+# derivative f'(x), given x and y = f(x)
+_UNARY = {
+    np.negative: lambda x, y: -np.ones(np.shape(x)),
+    np.exp: lambda x, y: y,
+    np.expm1: lambda x, y: y + 1,
+    np.log: lambda x, y: 1 / x,
+    np.log1p: lambda x, y: 1 / (1 + x),
+    np.sqrt: lambda x, y: 0.5 / y,
+    np.square: lambda x, y: 2 * x,
+    np.reciprocal: lambda x, y: -y ** 2,
+    np.absolute: lambda x, y: np.sign(x),
+    np.sin: lambda x, y: np.cos(x),
+    np.cos: lambda x, y: -np.sin(x),
+    np.tanh: lambda x, y: 1 - y ** 2,
+    np.arctan: lambda x, y: 1 / (1 + x ** 2),
+    special.gammaln: lambda x, y: special.digamma(x),
+    special.expit: lambda x, y: y * (1 - y),
+    special.log_expit: lambda x, y: special.expit(-x),
+    special.logit: lambda x, y: 1 / (x * (1 - x)),
+}
+
+# partial derivatives (df/da, df/db), given a, b and y = f(a, b)
+_BINARY = {
+    np.add: (lambda a, b, y: np.ones(np.shape(y)), lambda a, b, y: np.ones(np.shape(y))),
+    np.subtract: (lambda a, b, y: np.ones(np.shape(y)), lambda a, b, y: -np.ones(np.shape(y))),
+    np.multiply: (lambda a, b, y: b, lambda a, b, y: a),
+    np.true_divide: (lambda a, b, y: 1 / b, lambda a, b, y: -y / b),
+    np.power: (lambda a, b, y: b * np.power(a, b - 1.), lambda a, b, y: y * np.log(a)),
+    special.xlogy: (lambda a, b, y: np.log(b), lambda a, b, y: a / b),
+    special.xlog1py: (lambda a, b, y: np.log1p(b), lambda a, b, y: a / (1 + b)),
+}
+
+# lp where cond holds, -inf (with zero derivatives) elsewhere
+def where_support(cond, lp):
+    if np.all(cond):
+        return lp
+    value, tangent = _parts(lp)
+    value = np.where(cond, value, -np.inf)
+    if tangent is None:
+        return value
+    return Dual(value, np.where(_expand(cond), tangent, 0.))
@@ -0,0 +1,127 @@
+from .sample import Trace, execute, SAMPLE
+from .importance import _stack
+import numpy as np
+from scipy.special import logsumexp
+
+def _hashable(value):
+    if isinstance(value, np.ndarray):
+        return tuple(value.tolist())
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(v) for v in value)
+    return value
+
+def _distribution(probabilities, values) -> dict:
+    result = {}
+    for p, value in zip(probabilities, values):
+        key = _hashable(value)
+        result[key] = result.get(key, 0.) + float(p)
+    return result
+
+# Exact posterior of a discrete program: one entry per execution path
+# with positive probability.
+# samples[address] has one row per path (object arrays with None for paths
+# that do not visit the address), as in WeightedSamples.
+class ExactPosterior:
+    def __init__(self, log_joint, samples: dict, retvals: list) -> None:
+        self.log_joint = np.asarray(log_joint, dtype=float)
+        self.samples = samples
+        self.retvals = retvals
+
+    def __len__(self) -> int:
+        return len(self.log_joint)
+
+    def __getitem__(self, address):
+        return self.samples[address]
+
+    # log p(Y=y)
+    @property
+    def log_evidence(self) -> float:
+        return float(logsumexp(self.log_joint)) if len(self) > 0 else -np.inf
+
+    # posterior probability of each path
+    @property
+    def probabilities(self) -> np.ndarray:
+        return np.exp(self.log_joint - self.log_evidence)
+
+    # value -> posterior probability of an address (None if the address is not visited)
+    def marginal(self, address) -> dict:
+        return _distribution(self.probabilities, self.samples[address])
+
+    # return value -> posterior probability
+    def retval_distribution(self) -> dict:
+        return _distribution(self.probabilities, self.retvals)
+
+    def mean(self, address):
+        values, p = self.samples[address], self.probabilities
+        if values.dtype == object:
+            mask = np.array([v is not None for v in values])
+            values, p = np.array(list(values[mask]), dtype=float), p[mask] / p[mask].sum()
+        return np.tensordot(p, values, axes=1)
+
+    def __repr__(self) -> str:
+        return f"ExactPosterior(paths={len(self)}, log_evidence={self.log_evidence}, addresses={list(self.samples)})"
+
+
+# Depth-first enumeration of the execution paths of run(trace), which executes
+# a model (or a part of it) into the given trace, e.g.
+#   lambda trace: execute(model, trace, *args)
+# Each run replays forced values for the addresses on the path to its subtree
+# and draws the remaining addresses, which yields one complete path. For every
+# address drawn in the run, the other values of its support are pushed as new
+# subtrees, with the path up to that address forced. So every path is executed
+# exactly once, and shared prefixes are not re-run for each branch point.
+# Runs stop early once the path has probability zero (see Trace(early_exit=True)).
+# The addresses in `fixed` are always replayed and not enumerated.
+# Yields (trace, result of run) for all paths with positive probability.
+def enumerate_paths(run, fixed: dict = None, max_paths: int = 100_000):
+    stack = [dict(fixed or {})]
+    n_runs = 0
+    while stack:
+        forced = stack.pop()
+        n_runs += 1
+        if n_runs > max_paths:
+            raise RuntimeError(f"More than {max_paths} execution paths, the execution tree may be infinite.")
+        trace = Trace(early_exit=True, replay=forced)
+        result = run(trace)
+
+        # branch on the addresses that were drawn in this run
+        prefix = dict(forced)
+        addresses = trace.addresses()
+        for i in np.flatnonzero(trace.kinds() == SAMPLE):
+            address = addresses[i]
+            if address in forced:
+                continue
+            distribution, value = trace[i]['distribution'], trace[i]['value']
+            for v in distribution.enumerate_support():
+                if not np.array_equal(v, value) and distribution.logprob(v) > -np.inf:
+                    stack.append({**prefix, address: v})
+            prefix[address] = value
+
+        if trace.log_joint > -np.inf:
+            yield trace, result
+
+
+# Exact inference for programs whose sample statements all have finite support
+# (see Distribution.enumerate_support), by depth-first exploration of the
+# execution tree with re-execution (see enumerate_paths).
+#   max_paths: bound on the number of executed paths, e.g. for programs with
+#              unbounded loops
+# e.g.
+#   posterior = Enumeration().run(burglary_model, True)
+#   posterior.marginal("burglary"), posterior.log_evidence
+class Enumeration:
+    def __init__(self, max_paths: int = 100_000) -> None:
+        self.max_paths = max_paths
+
+    def run(self, model, *args, **kwargs) -> ExactPosterior:
+        run = lambda trace: execute(model, trace, *args, **kwargs)
+        paths = [trace for trace, _ in enumerate_paths(run, max_paths=self.max_paths)]
+
+        blocks = {}
+        for j, trace in enumerate(paths):
+            for address, value in trace.choices().items():
+                blocks.setdefault(address, []).append((j, 1, np.asarray(value)[None]))
+        samples = {address: _stack(b, len(paths)) for address, b in blocks.items()}
+        return ExactPosterior([t.log_joint for t in paths], samples, [t.retval for t in paths])
@@ -0,0 +1,123 @@
+from .scipy_distributions import rng_scope
+from .sample import Trace, execute, probabilistic_program, _HANDLERS, _UNSET, SAMPLE, OBSERVE
+import contextvars
+
+# Effect handlers change how the sample, observe, and factor statements of a
+# model are executed, without editing the model. A handler is active in a
+# `with` block (for all model runs in it, including nested ones), or can be
+# applied to a model, which returns a new probabilistic program:
+#   with Condition({"slope": 2.}):
+#       execute(linear_regression, trace, x, y)
+#   conditioned = Condition({"slope": 2.})(linear_regression)
+# Nested handlers see a statement from the innermost outwards, so inner
+# handlers take precedence, e.g. an inner Replay over an outer one.
+# Values forced by Replay and Condition in batched execution are
+# per-particle, i.e. have a leading particle axis (see Trace(replay=...)).
+# Handlers keep no state of their `with` blocks, so one handler (or a handled
+# program) can be active in several threads or tasks at once.
+class Handler:
+    # called for every statement, see _Message in sample.py
+    def process(self, message):
+        pass
+
+    def __enter__(self):
+        _HANDLERS.set(_HANDLERS.get() + (self,))
+        return self
+
+    # `with` blocks are nested, so the handler is the innermost one of the context
+    def __exit__(self, *exc) -> None:
+        _HANDLERS.set(_HANDLERS.get()[:-1])
+
+    def __call__(self, model):
+        func = getattr(model, "__wrapped__", model)
+
+        def handled(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+
+        # not functools.wraps, as execute would run __wrapped__
+        handled.__name__ = handled.__qualname__ = func.__name__
+        return probabilistic_program(handled)
+
+# Sample statements at the given addresses reuse the given value (scored
+# under their distribution) instead of drawing a new one, the statements
+# stay sample statements. Takes a dict address -> value or a Trace.
+class Replay(Handler):
+    def __init__(self, choices) -> None:
+        super().__init__()
+        self.choices = choices.choices() if isinstance(choices, Trace) else choices
+
+    def process(self, message):
+        if message.kind == SAMPLE and message.value is _UNSET and message.address in self.choices:
+            message.value = self.choices[message.address]
+
+# Sample statements at the given addresses become observe statements of the
+# given value, i.e. they count towards the log likelihood.
+class Condition(Handler):
+    def __init__(self, data: dict) -> None:
+        super().__init__()
+        self.data = data
+
+    def process(self, message):
+        if message.kind == SAMPLE and message.value is _UNSET and message.address in self.data:
+            message.value = self.data[message.address]
+            message.kind = OBSERVE
+
+# Statements are executed, but not recorded in the trace (and not seen by
+# outer handlers): all of them, those at the addresses in `hide`, or all
+# except those at the addresses in `expose`.
+class Block(Handler):
+    def __init__(self, hide=None, expose=None) -> None:
+        super().__init__()
+        self.hide = None if hide is None else set(hide)
+        self.expose = None if expose is None else set(expose)
+
+    def process(self, message):
+        if self.expose is not None:
+            message.blocked = message.address not in self.expose
+        elif self.hide is not None:
+            message.blocked = message.address in self.hide
+        else:
+            message.blocked = True
+
+# Multiplies the log probabilities of all statements by a factor, e.g. to
+# temper the likelihood or to reweight a mini-batch (see subsample).
+class Scale(Handler):
+    def __init__(self, factor: float) -> None:
+        super().__init__()
+        self.factor = factor
+
+    def process(self, message):
+        message.scale = message.scale * self.factor
+
+# the random number scopes of the active Seed handlers in the current context
+_SCOPES = contextvars.ContextVar("probros_seed_scopes", default=())
+
+# All random draws use the given generator (or a new generator from the given
+# seed, so that runs in each `with Seed(0):` block draw the same values).
+class Seed(Handler):
+    def __init__(self, rng) -> None:
+        super().__init__()
+        self.rng = rng
+
+    def __enter__(self):
+        scope = rng_scope(self.rng)
+        scope.__enter__()
+        _SCOPES.set(_SCOPES.get() + (scope,))
+        return super().__enter__()
+
+    def __exit__(self, *exc) -> None:
+        super().__exit__(*exc)
+        scopes = _SCOPES.get()
+        _SCOPES.set(scopes[:-1])
+        scopes[-1].__exit__(*exc)
+
+
+# Runs a model with the addresses in `choices` forced (see Replay) and all other
+# addresses drawn from their priors, e.g. to score a partial choice map.
+# Returns the trace, i.e. trace.log_joint is the log joint of the run.
+def score(model, choices, *args, **kwargs) -> Trace:
+    trace = Trace()
+    with Replay(choices):
+        execute(model, trace, *args, **kwargs)
+    return trace
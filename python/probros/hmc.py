@@ -0,0 +1,186 @@
+from .scipy_distributions import _rng, rng_scope
+from .mcmc import MCMCSamples, _collect_chain
+from .transforms import ParameterSpace
+import numpy as np
+
+# Hamiltonian Monte Carlo for models whose sample addresses are all continuous.
+# The addresses are mapped to unconstrained reals (see ParameterSpace), and
+# gradients of the log joint are computed by central differences or by
+# forward-mode dual numbers, so no autodiff framework is needed.
+#   n_leapfrog: number of leapfrog steps per transition
+#   step_size:  leapfrog step size, if None it is adapted during burn-in by dual
+#               averaging to reach target_accept (Hoffman & Gelman, 2014)
+#   batched:    evaluate all points of a gradient in one batched model run
+#               (see Trace(batch_size=...)), the model has to support batched execution
+#   gradient:   "central" (central differences, 2 * d model runs per gradient) or
+#               "dual" (one model run with dual numbers, see ParameterSpace.value_and_gradient).
+#               Dual arithmetic is several times slower than float arithmetic, so
+#               "dual" only pays off for many addresses and vectorized models;
+#               for few addresses or scalar loops "central" is faster
+# e.g.
+#   chain = HMC(linear_regression, 1_000, burn_in=500).run(x, y, ...)
+#   chain.mean("slope")
+class HMC:
+    def __init__(self, model, n_samples: int, burn_in: int = 0, n_leapfrog: int = 10, step_size: float = None,
+                 target_accept: float = 0.8, batched: bool = False, seed=None, gradient: str = "central") -> None:
+        if gradient not in ("central", "dual"):
+            raise ValueError(f"Unknown gradient method {gradient}, expected 'central' or 'dual'.")
+        self.model = model
+        self.n_samples = n_samples
+        self.burn_in = burn_in
+        self.n_leapfrog = n_leapfrog
+        self.step_size = step_size
+        self.target_accept = target_accept
+        self.batched = batched
+        self.seed = seed
+        self.gradient = gradient
+
+    # log density and its gradient at the unconstrained point u
+    def _log_density(self, u) -> tuple:
+        if self.gradient == "dual":
+            return self.space.value_and_gradient(self.model, u, self.args, self.kwargs)
+        lp = self.space.log_density(self.model, u, self.args, self.kwargs)
+        if lp == -np.inf:
+            return lp, np.zeros_like(u)
+        return lp, self.space.gradient(self.model, u, self.args, self.kwargs, self.batched)
+
+    def _leapfrog(self, u, r, grad, step_size: float) -> tuple:
+        r = r + 0.5 * step_size * grad
+        u = u + step_size * r
+        lp, grad = self._log_density(u)
+        r = r + 0.5 * step_size * grad
+        return u, r, lp, grad
+
+    # Step size whose single leapfrog step has acceptance probability
+    # crossing 1/2 (Hoffman & Gelman, 2014, Algorithm 4).
+    def _initial_step_size(self, u, lp, grad) -> float:
+        rng = _rng()
+        step_size = 1.
+        r = rng.standard_normal(len(u))
+        _, r1, lp1, _ = self._leapfrog(u, r, grad, step_size)
+        log_ratio = lp1 - 0.5 * r1 @ r1 - lp + 0.5 * r @ r
+        a = 1 if log_ratio > np.log(0.5) else -1
+        while a * log_ratio > -a * np.log(2) and 1e-8 < step_size < 1e8:
+            step_size *= 2. ** a
+            _, r1, lp1, _ = self._leapfrog(u, r, grad, step_size)
+            log_ratio = lp1 - 0.5 * r1 @ r1 - lp + 0.5 * r @ r
+            if np.isnan(log_ratio):
+                log_ratio = -np.inf
+        return step_size
+
+    # one transition, returns (u, lp, grad, acceptance statistic)
+    def transition(self, u, lp, grad, step_size: float) -> tuple:
+        rng = _rng()
+        r = rng.standard_normal(len(u))
+        h0 = lp - 0.5 * r @ r
+        u1, r1, lp1, grad1 = u, r, lp, grad
+        for _ in range(self.n_leapfrog):
+            u1, r1, lp1, grad1 = self._leapfrog(u1, r1, grad1, step_size)
+            if lp1 == -np.inf:
+                break
+        accept = float(np.exp(min(0., lp1 - 0.5 * r1 @ r1 - h0))) if lp1 > -np.inf else 0.
+        if rng.random() < accept:
+            return u1, lp1, grad1, accept
+        return u, lp, grad, accept
+
+    def run(self, *args, **kwargs) -> MCMCSamples:
+        self.args, self.kwargs = args, kwargs
+        with rng_scope(self.seed):
+            self.space = ParameterSpace.from_model(self.model, args, kwargs)
+            u = self.space.initial
+            lp, grad = self._log_density(u)
+
+            step_size = self.step_size
+            adapt = step_size is None
+            if adapt:
+                step_size = self._initial_step_size(u, lp, grad)
+                # dual averaging
+                mu, log_step_bar, h_bar = np.log(10 * step_size), 0., 0.
+                gamma, t0, kappa = 0.05, 10, 0.75
+
+            choices, log_joint, accepts = [], [], []
+            for i in range(self.burn_in + self.n_samples):
+                u, lp, grad, accept = self.transition(u, lp, grad, step_size)
+                if i < self.burn_in:
+                    if adapt:
+                        m = i + 1
+                        h_bar = (1 - 1 / (m + t0)) * h_bar + (self.target_accept - accept) / (m + t0)
+                        log_step = mu - np.sqrt(m) / gamma * h_bar
+                        log_step_bar = m ** -kappa * log_step + (1 - m ** -kappa) * log_step_bar
+                        step_size = np.exp(log_step) if i < self.burn_in - 1 else np.exp(log_step_bar)
+                    continue
+                values, log_det = self.space.constrained(u)
+                choices.append(values)
+                log_joint.append(lp - log_det)
+                accepts.append(accept)
+        self.adapted_step_size = step_size
+        return _collect_chain(choices, log_joint, float(np.mean(accepts)) if accepts else 0.)
+
+
+# No-U-Turn sampler (Hoffman & Gelman, 2014, Algorithm 3 with slice sampling),
+# which chooses the number of leapfrog steps per transition by doubling the
+# trajectory until it turns back on itself.
+#   max_depth: maximal tree depth, i.e. at most 2^max_depth - 1 leapfrog steps
+# e.g.
+#   chain = NUTS(linear_regression, 1_000, burn_in=500).run(x, y, ...)
+class NUTS(HMC):
+    def __init__(self, model, n_samples: int, burn_in: int = 0, max_depth: int = 10, step_size: float = None,
+                 target_accept: float = 0.8, batched: bool = False, seed=None, gradient: str = "central") -> None:
+        super().__init__(model, n_samples, burn_in, None, step_size, target_accept, batched, seed, gradient)
+        self.max_depth = max_depth
+
+    # returns (minus, plus, proposal, n, s, sum of acceptance statistics, number of leapfrog steps)
+    # where minus, plus are (u, r, grad) of the ends and proposal is (u, lp, grad)
+    def _build_tree(self, state, log_slice, direction, depth, step_size, h0):
+        if depth == 0:
+            u, r, grad = state
+            u1, r1, lp1, grad1 = self._leapfrog(u, r, grad, direction * step_size)
+            h = lp1 - 0.5 * r1 @ r1 if lp1 > -np.inf else -np.inf
+            n = int(log_slice <= h)
+            s = int(log_slice < h + 1000.)
+            accept = float(np.exp(min(0., h - h0))) if h > -np.inf else 0.
+            end = (u1, r1, grad1)
+            return end, end, (u1, lp1, grad1), n, s, accept, 1
+
+        minus, plus, proposal, n, s, accept, n_steps = self._build_tree(state, log_slice, direction, depth - 1, step_size, h0)
+        if s:
+            if direction == -1:
+                minus, _, proposal2, n2, s2, accept2, n_steps2 = self._build_tree(minus, log_slice, direction, depth - 1, step_size, h0)
+            else:
+                _, plus, proposal2, n2, s2, accept2, n_steps2 = self._build_tree(plus, log_slice, direction, depth - 1, step_size, h0)
+            if n + n2 > 0 and _rng().random() < n2 / (n + n2):
+                proposal = proposal2
+            accept += accept2
+            n_steps += n_steps2
+            s = s2 and self._no_u_turn(minus, plus)
+            n += n2
+        return minus, plus, proposal, n, s, accept, n_steps
+
+    @staticmethod
+    def _no_u_turn(minus, plus) -> bool:
+        du = plus[0] - minus[0]
+        return du @ minus[1] >= 0 and du @ plus[1] >= 0
+
+    def transition(self, u, lp, grad, step_size: float) -> tuple:
+        rng = _rng()
+        r = rng.standard_normal(len(u))
+        h0 = lp - 0.5 * r @ r
+        log_slice = h0 - rng.exponential()
+        minus = plus = (u, r, grad)
+        proposal = (u, lp, grad)
+        n, s, depth = 1, 1, 0
+        accept, n_steps = 0., 0
+        while s and depth < self.max_depth:
+            direction = 1 if rng.random() < 0.5 else -1
+            if direction == -1:
+                minus, _, proposal1, n1, s1, a1, k1 = self._build_tree(minus, log_slice, direction, depth, step_size, h0)
+            else:
+                _, plus, proposal1, n1, s1, a1, k1 = self._build_tree(plus, log_slice, direction, depth, step_size, h0)
+            if s1 and rng.random() < n1 / n:
+                proposal = proposal1
+            n += n1
+            s = s1 and self._no_u_turn(minus, plus)
+            accept += a1
+            n_steps += k1
+            depth += 1
+        return proposal[0], proposal[1], proposal[2], accept / max(n_steps, 1)
@@ -0,0 +1,191 @@
+from .scipy_distributions import _rng, rng_scope, split_rng
+from .sample import Trace, execute
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.special import logsumexp
+
+# Resampling: all functions take (normalised or unnormalised) weights and
+# return n ancestor indices.
+
+def _inverse_cdf(weights, positions) -> np.ndarray:
+    cdf = np.cumsum(weights)
+    cdf /= cdf[-1]
+    return np.minimum(np.searchsorted(cdf, positions, side="right"), len(cdf) - 1)
+
+# one uniform offset for n evenly spaced positions
+def systematic_resample(weights, n: int = None, rng=None) -> np.ndarray:
+    n = len(weights) if n is None else n
+    rng = _rng() if rng is None else rng
+    return _inverse_cdf(weights, (rng.random() + np.arange(n)) / n)
+
+# one uniform position in each of n strata
+def stratified_resample(weights, n: int = None, rng=None) -> np.ndarray:
+    n = len(weights) if n is None else n
+    rng = _rng() if rng is None else rng
+    return _inverse_cdf(weights, (rng.random(n) + np.arange(n)) / n)
+
+def multinomial_resample(weights, n: int = None, rng=None) -> np.ndarray:
+    n = len(weights) if n is None else n
+    rng = _rng() if rng is None else rng
+    return _inverse_cdf(weights, np.sort(rng.random(n)))
+
+RESAMPLING = {
+    "systematic": systematic_resample,
+    "stratified": stratified_resample,
+    "multinomial": multinomial_resample,
+}
+
+def effective_sample_size(log_weights) -> float:
+    log_weights = np.asarray(log_weights)
+    if np.all(log_weights == -np.inf):
+        return 0.
+    return float(np.exp(2 * logsumexp(log_weights) - logsumexp(2 * log_weights)))
+
+
+# Weighted posterior approximation.
+# samples[address] has one row per particle, i.e. shape (n, ...). Addresses
+# that do not occur in every particle (or with varying shapes) are stored as
+# object arrays with None for particles where they are missing.
+# traces optionally holds the (unbatched or batched) traces of the particles.
+class WeightedSamples:
+    def __init__(self, log_weights, samples: dict, traces: list = None) -> None:
+        self.log_weights = np.asarray(log_weights, dtype=float)
+        self.samples = samples
+        self.traces = traces
+
+    def __len__(self) -> int:
+        return len(self.log_weights)
+
+    def __getitem__(self, address):
+        return self.samples[address]
+
+    @property
+    def weights(self) -> np.ndarray:
+        if np.all(self.log_weights == -np.inf):
+            return np.full(len(self), np.nan)
+        return np.exp(self.log_weights - logsumexp(self.log_weights))
+
+    # estimate of log p(Y=y)
+    @property
+    def log_marginal_likelihood(self) -> float:
+        return float(logsumexp(self.log_weights) - np.log(len(self)))
+
+    @property
+    def ess(self) -> float:
+        return effective_sample_size(self.log_weights)
+
+    def _present(self, address):
+        values, weights = self.samples[address], self.weights
+        if values.dtype == object:
+            mask = np.array([v is not None for v in values])
+            values, weights = np.array(list(values[mask]), dtype=float), weights[mask]
+        return values, weights / weights.sum()
+
+    def mean(self, address):
+        values, weights = self._present(address)
+        return np.tensordot(weights, values, axes=1)
+
+    def variance(self, address):
+        values, weights = self._present(address)
+        mean = np.tensordot(weights, values, axes=1)
+        return np.tensordot(weights, (values - mean) ** 2, axes=1)
+
+    # Equally weighted posterior of n particles. The log weights are all set
+    # to the log marginal likelihood, so that it is preserved.
+    def resample(self, n: int = None, method: str = "systematic", rng=None) -> "WeightedSamples":
+        n = len(self) if n is None else n
+        index = RESAMPLING[method](self.weights, n, rng)
+        log_weights = np.full(n, self.log_marginal_likelihood)
+        return WeightedSamples(log_weights, {address: values[index] for address, values in self.samples.items()})
+
+    # concatenates the particles of several WeightedSamples
+    @staticmethod
+    def concatenate(parts: list) -> "WeightedSamples":
+        sizes = [len(p) for p in parts]
+        blocks = {}
+        offset = 0
+        for p in parts:
+            for address, values in p.samples.items():
+                blocks.setdefault(address, []).append((offset, len(p), values))
+            offset += len(p)
+        log_weights = np.concatenate([p.log_weights for p in parts])
+        return WeightedSamples(log_weights, {address: _stack(b, sum(sizes)) for address, b in blocks.items()})
+
+    def __repr__(self) -> str:
+        return f"WeightedSamples(n={len(self)}, ess={self.ess:.1f}, log_marginal_likelihood={self.log_marginal_likelihood}, addresses={list(self.samples)})"
+
+# Stacks blocks (offset, size, values with a leading axis of length size)
+# into one array with n rows.
+def _stack(blocks: list, n: int) -> np.ndarray:
+    shapes = {np.shape(values)[1:] for _, _, values in blocks}
+    dense = sum(size for _, size, _ in blocks) == n and len(shapes) == 1
+    if dense and all(isinstance(values, np.ndarray) and values.dtype != object for _, _, values in blocks):
+        return np.concatenate([values for _, _, values in blocks])
+    stacked = np.full(n, None, dtype=object)
+    for offset, size, values in blocks:
+        for j in range(size):
+            stacked[offset + j] = values[j]
+    return stacked
+
+# Collects the sampled values of (unbatched or batched) traces.
+def _collect(traces: list) -> WeightedSamples:
+    blocks = {}
+    log_weights = []
+    offset = 0
+    for trace in traces:
+        size = 1 if trace.batch_size is None else trace.batch_size
+        for address, entry in trace.entries_by_address().items():
+            if entry['kind'] != 'sample':
+                continue
+            value = entry['value']
+            values = np.asarray(value)[None] if trace.batch_size is None else np.asarray(value)
+            blocks.setdefault(address, []).append((offset, size, values))
+        log_weights.append(np.broadcast_to(trace.log_likelihood, (size,)))
+        offset += size
+    samples = {address: _stack(b, offset) for address, b in blocks.items()}
+    return WeightedSamples(np.concatenate(log_weights), samples)
+
+def _run_shard(model, n: int, batch_size: int, rng, args, kwargs) -> WeightedSamples:
+    traces = []
+    with rng_scope(rng):
+        while n > 0:
+            if batch_size is None:
+                trace = Trace(keep_distributions=False)
+                n -= 1
+            else:
+                trace = Trace(batch_size=min(batch_size, n), keep_distributions=False)
+                n -= trace.batch_size
+            execute(model, trace, *args, **kwargs)
+            traces.append(trace)
+    return _collect(traces)
+
+
+# Self-normalised importance sampling with the prior as proposal, i.e. each
+# particle is a model run weighted by its likelihood.
+#   batch_size: run particles in batches of this size (see Trace(batch_size=...)),
+#               the model has to support batched execution
+#   n_workers:  split the particles across this many processes (the model has
+#               to be picklable, i.e. defined at the top level of a module)
+#   seed:       seed (or Generator) for reproducible runs, each worker gets an
+#               independent child stream
+# e.g.
+#   posterior = ImportanceSampler(model, 10_000).run(x, y)
+#   posterior.mean("slope"), posterior.ess, posterior.resample()
+class ImportanceSampler:
+    def __init__(self, model, n_particles: int, batch_size: int = None, n_workers: int = 1, seed=None) -> None:
+        self.model = model
+        self.n_particles = n_particles
+        self.batch_size = batch_size
+        self.n_workers = n_workers
+        self.seed = seed
+
+    def run(self, *args, **kwargs) -> WeightedSamples:
+        rngs = split_rng(_rng() if self.seed is None else self.seed, self.n_workers)
+        shards = [self.n_particles // self.n_workers + (i < self.n_particles % self.n_workers) for i in range(self.n_workers)]
+        jobs = [(self.model, shards[i], self.batch_size, rngs[i], args, kwargs) for i in range(self.n_workers)]
+
+        if self.n_workers == 1:
+            return _run_shard(*jobs[0])
+        with ProcessPoolExecutor(self.n_workers) as executor:
+            parts = list(executor.map(_run_shard, *zip(*jobs)))
+        return WeightedSamples.concatenate(parts)
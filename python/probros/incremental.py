@@ -0,0 +1,396 @@
+from .scipy_distributions import _rng
+from .sample import Trace, execute
+from .handlers import Scale
+import ast
+import builtins
+import contextvars
+import functools
+import inspect
+import sys
+import textwrap
+import types
+import numpy as np
+
+# Incremental re-execution of probabilistic programs.
+#
+# A static analysis of the model source finds top-level loops
+#   for i in range(...):
+#       z[i] = sample(IndexedAddress("z", i), ...)
+#       observe(data[i], IndexedAddress("data", i), Normal(mu[z[i]], 1))
+# whose iterations are independent of each other: the body only assigns
+# temporaries and per-iteration entries `x[i]`, these are not read anywhere
+# else, and the variables the body reads are not changed after the loop.
+# The body must not mutate other objects either, so attribute assignments and
+# method calls on variables (e.g. xs.append(...)) are rejected, only methods
+# of modules (e.g. np.log(...)) may be called. Variables of the model (or
+# global ones) may only be passed to functions known not to mutate their
+# arguments: pure builtins (len, sum, ...), functions of `math`, numpy ufuncs
+# without out=, and the statements and distributions of probros, i.e. calls
+# like push(xs, x) or np.copyto(xs[i:i+1], x) are rejected.
+# Such loop bodies are compiled into closures, and every iteration is recorded
+# in a separate trace segment. An iteration can then be re-executed on its own
+# (e.g. after changing z[i]), which rescores only the statements of that
+# iteration instead of the whole model.
+
+# collects the trace segments of eligible loop iterations of the current run
+_SEGMENTS = contextvars.ContextVar("probros_segments", default=None)
+
+# With skip=True the loop bodies are not run, only the closures and the
+# loop indices are recorded.
+class _Segments:
+    def __init__(self, replay: dict, skip: bool = False) -> None:
+        self.replay = replay
+        self.skip = skip
+        self.traces = {}
+        self.bodies = {}
+        self.iterations = {}
+
+# mini-batch execution of the eligible loops in the current run, see subsample
+_SUBSAMPLE = contextvars.ContextVar("probros_subsample", default=None)
+
+class _Subsample:
+    def __init__(self, batch_size: int) -> None:
+        self.batch_size = batch_size
+        # loop -> scale of the log probabilities in its iterations
+        self.scales = {}
+
+# called by the transformed program with the range of every eligible loop
+def _range(loop: int, iterations):
+    subsample = _SUBSAMPLE.get()
+    if subsample is None:
+        return iterations
+    n = len(iterations)
+    if n <= subsample.batch_size:
+        subsample.scales.pop(loop, None)
+        return iterations
+    # uniformly without replacement, i.e. inclusion probability batch_size / n
+    chosen = np.sort(_rng().choice(n, subsample.batch_size, replace=False))
+    subsample.scales[loop] = n / subsample.batch_size
+    return [iterations[j] for j in chosen]
+
+# called by the transformed program for every iteration of an eligible loop
+def _iteration(loop: int, i, body):
+    segments = _SEGMENTS.get()
+    if segments is None:
+        subsample = _SUBSAMPLE.get()
+        if subsample is None or loop not in subsample.scales:
+            body(i)
+            return
+        with Scale(subsample.scales[loop]):
+            body(i)
+        return
+    if segments.skip:
+        segments.bodies[loop] = body
+        segments.iterations.setdefault(loop, []).append(i)
+        return
+    trace = Trace(keep_distributions=False, replay=segments.replay)
+    execute(body, trace, i)
+    segments.traces[(loop, i)] = trace
+    segments.bodies[loop] = body
+
+def _nodes(statements) -> list:
+    return [n for s in statements for n in ast.walk(s)]
+
+def _names(nodes, ctx) -> set:
+    return {n.id for n in nodes if isinstance(n, ast.Name) and isinstance(n.ctx, ctx)}
+
+def _is_index(node, name: str) -> bool:
+    return isinstance(node, ast.Name) and node.id == name
+
+# i - 1
+def _is_previous(node, name: str) -> bool:
+    return (isinstance(node, ast.BinOp) and isinstance(node.op, ast.Sub) and _is_index(node.left, name)
+            and isinstance(node.right, ast.Constant) and node.right.value == 1)
+
+# builtins which do not mutate their arguments
+_PURE_BUILTINS = frozenset(getattr(builtins, name) for name in (
+    "abs", "all", "any", "bool", "dict", "divmod", "enumerate", "float", "int", "isinstance", "len", "list",
+    "max", "min", "pow", "range", "reversed", "round", "set", "sorted", "str", "sum", "tuple", "zip",
+))
+
+# the object called by `node` in the model's global namespace, None if unknown
+def _callee(node, namespace: dict):
+    if isinstance(node, ast.Name):
+        if node.id in namespace:
+            return namespace[node.id]
+        return getattr(builtins, node.id, None)
+    if isinstance(node, ast.Attribute):
+        value = _callee(node.value, namespace)
+        if isinstance(value, types.ModuleType):
+            return getattr(value, node.attr, None)
+    return None
+
+def _is_pure(call: ast.Call, namespace: dict) -> bool:
+    callee = _callee(call.func, namespace)
+    if callee is None:
+        return False
+    if isinstance(callee, np.ufunc):
+        return not any(k.arg == "out" for k in call.keywords)
+    try:
+        if callee in _PURE_BUILTINS:
+            return True
+    except TypeError:
+        pass
+    # functions of math, and statements and distributions exported by probros
+    if getattr(callee, "__module__", None) == "math":
+        return True
+    name = getattr(callee, "__name__", None)
+    return isinstance(name, str) and getattr(sys.modules.get("probros"), name, None) is callee
+
+# variables whose objects (or parts of them) an expression may evaluate to
+def _exposed(node) -> set:
+    if isinstance(node, ast.Name):
+        return {node.id}
+    if isinstance(node, (ast.Subscript, ast.Attribute, ast.Starred)):
+        return _exposed(node.value)
+    if isinstance(node, (ast.Tuple, ast.List, ast.Set)):
+        return set().union(*map(_exposed, node.elts))
+    if isinstance(node, ast.Dict):
+        return set().union(*map(_exposed, [k for k in node.keys if k is not None] + node.values))
+    if isinstance(node, ast.IfExp):
+        return _exposed(node.body) | _exposed(node.orelse)
+    return set()
+
+def _range_start(loop: ast.For):
+    args = loop.iter.args
+    if len(args) == 1:
+        return 0
+    if isinstance(args[0], ast.Constant) and type(args[0].value) is int:
+        return args[0].value
+    return None
+
+# Checks whether the iterations of a top-level loop of fn are independent,
+# or with markov=True, whether they only depend on the previous iteration
+# through reads of x[i - 1]. `namespace` are the globals of the model.
+def _eligible(fn: ast.FunctionDef, position: int, markov: bool = False, namespace=None) -> bool:
+    namespace = namespace or {}
+    modules = {name for name, value in namespace.items() if isinstance(value, types.ModuleType)}
+    loop = fn.body[position]
+    if not (isinstance(loop, ast.For) and isinstance(loop.target, ast.Name) and not loop.orelse):
+        return False
+    if not (isinstance(loop.iter, ast.Call) and _is_index(loop.iter.func, "range") and not loop.iter.keywords):
+        return False
+    i = loop.target.id
+    body = _nodes(loop.body)
+    forbidden = (
+        ast.Return, ast.Break, ast.Continue, ast.Yield, ast.YieldFrom, ast.Await,
+        ast.Global, ast.Nonlocal, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.NamedExpr,
+    )
+    if any(isinstance(n, forbidden) for n in body):
+        return False
+
+    # per-iteration arrays, only written as x[i]
+    arrays = set()
+    for n in body:
+        if isinstance(n, ast.Subscript) and isinstance(n.ctx, (ast.Store, ast.Del)):
+            if not (isinstance(n.value, ast.Name) and _is_index(n.slice, i)):
+                return False
+            arrays.add(n.value.id)
+
+    # temporaries of the body must not be used anywhere else
+    local = _names(body, (ast.Store, ast.Del))
+
+    # no mutation of other objects: attribute stores, or method calls on
+    # anything but modules and temporaries
+    for n in body:
+        if isinstance(n, ast.Attribute) and isinstance(n.ctx, (ast.Store, ast.Del)):
+            return False
+        if isinstance(n, ast.Call) and isinstance(n.func, ast.Attribute):
+            root = n.func.value
+            while isinstance(root, (ast.Subscript, ast.Attribute)):
+                root = root.value
+            if not (isinstance(root, ast.Name) and (root.id in local or root.id in modules)):
+                return False
+        # variables of the model or globals passed to a function which may mutate them
+        if isinstance(n, ast.Call) and not _is_pure(n, namespace):
+            arguments = n.args + [k.value for k in n.keywords]
+            if set().union(*map(_exposed, arguments)) - local - {i}:
+                return False
+    outside = _nodes(fn.body[:position] + fn.body[position + 1:]) + _nodes([loop.iter])
+    arguments = {a.arg for a in fn.args.posonlyargs + fn.args.args + fn.args.kwonlyargs}
+    arguments |= {a.arg for a in (fn.args.vararg, fn.args.kwarg) if a is not None}
+    if i in local or local & (_names(outside, ast.AST) | arguments):
+        return False
+
+    # temporaries have to be assigned before they are read in an iteration,
+    # temporaries of compound statements are not visible to other statements
+    defined = set()
+    for s in loop.body:
+        nodes = _nodes([s])
+        loads, stores = _names(nodes, ast.Load) & local, _names(nodes, ast.Store) & local
+        if isinstance(s, (ast.Assign, ast.AnnAssign, ast.Expr)):
+            if loads - defined:
+                return False
+            defined |= stores
+        else:
+            others = _nodes([t for t in loop.body if t is not s])
+            if stores & _names(others, ast.Load):
+                return False
+
+    # per-iteration arrays are only read as x[i] (or x[i - 1]) in the body, and outside only
+    # at constant indices before the start of the range (or returned, which
+    # does not affect the density)
+    parents = {child: n for n in ast.walk(fn) for child in ast.iter_child_nodes(n)}
+    start = _range_start(loop)
+    for n in body:
+        if isinstance(n, ast.Name) and n.id in arrays and isinstance(n.ctx, ast.Load):
+            parent = parents.get(n)
+            if not (isinstance(parent, ast.Subscript) and (_is_index(parent.slice, i) or markov and _is_previous(parent.slice, i))):
+                return False
+    returns = [s for s in fn.body if isinstance(s, ast.Return)]
+    outside = [n for n in outside if n not in set(_nodes(returns))]
+    for n in outside:
+        if isinstance(n, ast.Name) and n.id in arrays and isinstance(n.ctx, ast.Load):
+            parent = parents.get(n)
+            if not (isinstance(parent, ast.Subscript) and isinstance(parent.slice, ast.Constant)
+                    and type(parent.slice.value) is int and start is not None and parent.slice.value < start):
+                return False
+    # x[i] has to be assigned before it is read
+    assigned = set()
+    for s in loop.body:
+        for n in _nodes([s]):
+            parent = parents.get(n)
+            if (isinstance(n, ast.Name) and n.id in arrays and n.id not in assigned and isinstance(parent, ast.Subscript)
+                    and isinstance(parent.ctx, ast.Load) and _is_index(parent.slice, i)):
+                return False
+        if isinstance(s, ast.Assign):
+            assigned |= {t.value.id for t in s.targets if isinstance(t, ast.Subscript) and _is_index(t.slice, i)}
+
+    # variables read by the body must not change after the loop
+    reads = _names(body, ast.Load) - local - {i}
+    for n in _nodes(fn.body[position + 1:]):
+        if isinstance(n, ast.Name) and isinstance(n.ctx, (ast.Store, ast.Del)) and n.id in reads:
+            return False
+        if isinstance(n, ast.Subscript) and isinstance(n.ctx, (ast.Store, ast.Del)):
+            root = n.value
+            while isinstance(root, (ast.Subscript, ast.Attribute)):
+                root = root.value
+            if isinstance(root, ast.Name) and root.id in reads:
+                return False
+    return True
+
+# Rewrites eligible loops
+#   for i in range(...): BODY
+# into
+#   def _probros_body_k(i): BODY
+#   for i in _probros_range(k, range(...)): _probros_iteration(k, i, _probros_body_k)
+# Returns the transformed loops and those of them which read x[i - 1].
+def _transform(fn: ast.FunctionDef, markov: bool = False, namespace=None) -> tuple:
+    independent = {k for k in range(len(fn.body)) if _eligible(fn, k, namespace=namespace)}
+    loops = {k for k in range(len(fn.body)) if k in independent or markov and _eligible(fn, k, True, namespace)}
+    body = []
+    for k, s in enumerate(fn.body):
+        if k not in loops:
+            body.append(s)
+            continue
+        name = f"_probros_body_{k}"
+        body.append(ast.FunctionDef(
+            name=name,
+            args=ast.arguments(posonlyargs=[], args=[ast.arg(arg=s.target.id)], kwonlyargs=[], kw_defaults=[], defaults=[]),
+            body=s.body, decorator_list=[], returns=None, type_params=[],
+        ))
+        call = ast.Call(
+            func=ast.Name(id="_probros_iteration", ctx=ast.Load()),
+            args=[ast.Constant(value=k), ast.Name(id=s.target.id, ctx=ast.Load()), ast.Name(id=name, ctx=ast.Load())],
+            keywords=[],
+        )
+        iterations = ast.Call(func=ast.Name(id="_probros_range", ctx=ast.Load()), args=[ast.Constant(value=k), s.iter], keywords=[])
+        body.append(ast.For(target=s.target, iter=iterations, body=[ast.Expr(value=call)], orelse=[]))
+    fn.body = body
+    fn.decorator_list = []
+    return loops, loops - independent
+
+# The program of a model with eligible loops transformed, or None if the
+# source is not available or the model has no eligible loops.
+# With markov=True, loops whose iterations read x[i - 1] are transformed
+# as well, their indices are stored in program.markov_loops.
+@functools.lru_cache(maxsize=None)
+def incremental_program(model, markov: bool = False):
+    func = getattr(model, "__wrapped__", model)
+    if func.__code__.co_freevars:
+        return None
+    try:
+        source = textwrap.dedent(inspect.getsource(func))
+        filename = inspect.getsourcefile(func)
+    except (OSError, TypeError):
+        return None
+    tree = ast.parse(source)
+    fn = tree.body[0]
+    if not isinstance(fn, ast.FunctionDef):
+        return None
+    ast.increment_lineno(tree, func.__code__.co_firstlineno - 1)
+    loops, markov_loops = _transform(fn, markov, func.__globals__)
+    if not loops:
+        return None
+
+    # the hooks are passed as closure variables, so that the module globals are untouched
+    factory = ast.FunctionDef(
+        name="_probros_factory",
+        args=ast.arguments(posonlyargs=[], args=[ast.arg(arg="_probros_iteration"), ast.arg(arg="_probros_range")], kwonlyargs=[], kw_defaults=[], defaults=[]),
+        body=[fn, ast.Return(value=ast.Name(id=fn.name, ctx=ast.Load()))],
+        decorator_list=[], returns=None, type_params=[],
+    )
+    module = ast.fix_missing_locations(ast.Module(body=[factory], type_ignores=[]))
+    namespace = {}
+    exec(compile(module, filename, "exec"), func.__globals__, namespace)
+    program = namespace["_probros_factory"](_iteration, _range)
+    program.markov_loops = markov_loops
+    return program
+
+
+# State of a model run split into the trace of the statements outside of
+# eligible loops (top) and one trace segment per loop iteration.
+class ExecutionState:
+    def __init__(self, top: Trace, segments: dict, bodies: dict) -> None:
+        self.top = top
+        self.segments = segments
+        self.bodies = bodies
+        self.log_joint = top.log_joint + sum(s.log_joint for s in segments.values())
+        self._index_sites()
+
+    def _index_sites(self):
+        # address -> segment key (None for top), and address -> value
+        self.sites = {address: None for address in self.top.sample_sites()}
+        self.values = self.top.choices()
+        for key, segment in self.segments.items():
+            self.sites.update((address, key) for address in segment.sample_sites())
+            self.values.update(segment.choices())
+        self.addresses = list(self.sites)
+
+    def choices(self) -> dict:
+        return dict(self.values)
+
+    # address -> log probability of all sample statements
+    def site_logprobs(self) -> dict:
+        logprobs = {}
+        for trace in [self.top, *self.segments.values()]:
+            lp = trace.logprobs()
+            logprobs.update((address, lp[i]) for address, i in trace.sample_sites().items())
+        return logprobs
+
+    # runs the segment of a loop iteration again, with the given replayed choices
+    def rerun_segment(self, key, replay: dict) -> Trace:
+        loop, i = key
+        trace = Trace(keep_distributions=False, replay=replay)
+        execute(self.bodies[loop], trace, i)
+        return trace
+
+    def replace_segment(self, key, trace: Trace):
+        old = self.segments[key]
+        self.segments[key] = trace
+        self.log_joint += trace.log_joint - old.log_joint
+        if old.sample_sites().keys() != trace.sample_sites().keys():
+            self._index_sites()
+        else:
+            self.values.update(trace.choices())
+
+# Runs a program (incremental or not) and returns its ExecutionState.
+def run_state(program, replay: dict, args, kwargs) -> ExecutionState:
+    segments = _Segments(replay)
+    token = _SEGMENTS.set(segments)
+    try:
+        top = Trace(keep_distributions=False, replay=replay)
+        execute(program, top, *args, **kwargs)
+    finally:
+        _SEGMENTS.reset(token)
+    return ExecutionState(top, segments.traces, segments.bodies)
@@ -0,0 +1,114 @@
+from .sample import Trace, execute, probabilistic_program, _current_trace, factor, SAMPLE
+from .incremental import _SEGMENTS, _Segments, incremental_program
+from .enumeration import enumerate_paths, _hashable
+import numpy as np
+from scipy.special import logsumexp
+
+def _finite(distribution) -> bool:
+    try:
+        distribution.enumerate_support()
+    except ValueError:
+        return False
+    return True
+
+# Runs the top level of a transformed program into the trace, loop bodies are
+# only recorded (see _Segments(skip=True)).
+def _run_top(program, trace: Trace, args, kwargs) -> _Segments:
+    segments = _Segments(trace.replay, skip=True)
+    token = _SEGMENTS.set(segments)
+    try:
+        execute(program, trace, *args, **kwargs)
+    finally:
+        _SEGMENTS.reset(token)
+    return segments
+
+# Forward algorithm over the iterations of a loop: the discrete addresses of
+# each iteration are enumerated, and the paths of an iteration are the states
+# passed on to the next one. For loops without reads of x[i - 1] there is a
+# single state, i.e. the iterations are summed out independently.
+def _forward(body, iterations: list, fixed: dict, markov: bool, max_paths: int) -> float:
+    # key -> (log alpha, (index, choices) of the previous iteration)
+    states = {None: (0., None)}
+    for i in iterations:
+        new = {}
+        for alpha, previous in states.values():
+            if previous is not None:
+                # restore x[i - 1] of the previous iteration in the closure
+                execute(body, Trace(keep_distributions=False, replay=previous[1]), previous[0])
+            run = lambda trace: execute(body, trace, i)
+            for trace, _ in enumerate_paths(run, fixed, max_paths):
+                choices = trace.choices()
+                key = _hashable(tuple(choices.items())) if markov else None
+                lp = alpha + trace.log_joint
+                if key in new:
+                    lp = np.logaddexp(new[key][0], lp)
+                new[key] = (lp, (i, choices) if markov else None)
+        if not new:
+            return -np.inf
+        states = new
+    return float(logsumexp([alpha for alpha, _ in states.values()]))
+
+# log p(values, observations) of a (transformed) program, where all sample
+# statements with finite support that are not in values are summed out:
+# discrete addresses at the top level are enumerated, and the iterations of
+# eligible loops are summed out with the forward algorithm.
+def log_marginal(program, values: dict, args, kwargs, max_paths: int = 100_000) -> float:
+    markov_loops = getattr(program, "markov_loops", set())
+    run = lambda trace: _run_top(program, trace, args, kwargs)
+    terms = []
+    for trace, segments in enumerate_paths(run, values, max_paths):
+        lp = trace.log_joint
+        for loop, body in segments.bodies.items():
+            lp += _forward(body, segments.iterations[loop], values, loop in markov_loops, max_paths)
+        terms.append(lp)
+    return float(logsumexp(terms)) if terms else -np.inf
+
+
+# Returns a program in which the sample statements with finite support are
+# summed out (variable elimination), e.g. the states s[i] of a hidden Markov
+# model or the assignments z[i] of a mixture model. Only the remaining
+# (continuous) addresses are sampled, and a factor "marginal" adds the exact
+# log likelihood with the discrete addresses summed out. The program can be
+# used with any inference engine for the continuous addresses, e.g.
+#   MetropolisHastings(marginalize(hmm), 1_000).run(y)
+# Loops are summed out iteration by iteration if their iterations are
+# independent or only depend on the previous iteration through x[i - 1]
+# (see incremental_program), otherwise the whole program is enumerated.
+# Continuous addresses in loops are drawn by running every iteration once,
+# and are then fixed while the discrete ones of the iteration are summed out.
+# The distributions of the continuous addresses must not depend on the
+# discrete addresses. Batched execution is not supported.
+def marginalize(model, max_paths: int = 100_000):
+    program = incremental_program(model, markov=True) or model
+    func = getattr(model, "__wrapped__", model)
+
+    def marginalized(*args, **kwargs):
+        outer = _current_trace()
+        if outer.batch_size is not None:
+            raise ValueError("marginalize does not support batched execution.")
+
+        # draw (or replay) the continuous addresses at the top level, and
+        # those of the loop iterations by running each iteration once
+        top = Trace(replay=outer.replay)
+        segments = _run_top(program, top, args, kwargs)
+        traces = [top]
+        for loop in sorted(segments.bodies):
+            for i in segments.iterations[loop]:
+                traces.append(Trace(replay=outer.replay))
+                execute(segments.bodies[loop], traces[-1], i)
+        values = {}
+        log_prior = 0.
+        for trace in traces:
+            for i in np.flatnonzero(trace.kinds() == SAMPLE):
+                entry = trace[i]
+                if not _finite(entry['distribution']):
+                    values[entry['address']] = entry['value']
+                    log_prior += entry['logprob']
+                    outer.append(entry['address'], SAMPLE, entry['value'], entry['logprob'], entry['distribution'])
+
+        factor(log_marginal(program, values, args, kwargs, max_paths) - log_prior, "marginal")
+        return top.retval
+
+    # not functools.wraps, as execute would run __wrapped__
+    marginalized.__name__ = marginalized.__qualname__ = func.__name__
+    return probabilistic_program(marginalized)
@@ -0,0 +1,134 @@
+from .scipy_distributions import _rng, rng_scope
+from .importance import _stack
+from .incremental import ExecutionState, incremental_program, run_state
+import numpy as np
+
+# Samples of a Markov chain.
+# samples[address] has one row per sample, i.e. shape (n, ...). Addresses
+# that do not occur in every sample are stored as object arrays with None.
+class MCMCSamples:
+    def __init__(self, samples: dict, log_joint, acceptance_rate: float) -> None:
+        self.samples = samples
+        self.log_joint = np.asarray(log_joint, dtype=float)
+        self.acceptance_rate = acceptance_rate
+
+    def __len__(self) -> int:
+        return len(self.log_joint)
+
+    def __getitem__(self, address):
+        return self.samples[address]
+
+    def _present(self, address):
+        values = self.samples[address]
+        if values.dtype == object:
+            values = np.array([v for v in values if v is not None], dtype=float)
+        return values
+
+    def mean(self, address):
+        return np.mean(self._present(address), axis=0)
+
+    def variance(self, address):
+        return np.var(self._present(address), axis=0)
+
+    def __repr__(self) -> str:
+        return f"MCMCSamples(n={len(self)}, acceptance_rate={self.acceptance_rate:.3f}, addresses={list(self.samples)})"
+
+def _collect_chain(choices: list, log_joint: list, acceptance_rate: float) -> MCMCSamples:
+    blocks = {}
+    for j, c in enumerate(choices):
+        for address, value in c.items():
+            blocks.setdefault(address, []).append((j, 1, np.asarray(value)[None]))
+    samples = {address: _stack(b, len(choices)) for address, b in blocks.items()}
+    return MCMCSamples(samples, log_joint, acceptance_rate)
+
+# Runs the program with the prior until it has positive probability.
+def _initial_state(program, args, kwargs, max_tries: int = 10_000) -> ExecutionState:
+    for _ in range(max_tries):
+        state = run_state(program, None, args, kwargs)
+        if state.log_joint > -np.inf:
+            return state
+    raise RuntimeError(f"Could not find a trace with positive probability in {max_tries} tries.")
+
+
+# Lightweight single-site Metropolis-Hastings (Wingate et al., 2011).
+# Each step picks one sample address of the current trace uniformly, draws a
+# new value for it from its prior, and re-executes the model, reusing the
+# values of all other addresses (see Trace(replay=...)). Addresses that are
+# only visited by the new run are drawn from their priors. The proposal is
+# accepted with the usual Metropolis-Hastings probability, which accounts for
+# the change in the number of addresses and for fresh and stale draws.
+#   incremental: if the address lies in an iteration of a loop whose
+#                iterations are independent (see incremental_program), only
+#                this iteration is re-executed, e.g. a proposal to z[i] of a
+#                mixture model rescores only data[i]
+# e.g.
+#   chain = MetropolisHastings(model, 10_000, burn_in=1_000).run(data)
+#   chain.mean("p"), chain.acceptance_rate
+class MetropolisHastings:
+    def __init__(self, model, n_samples: int, burn_in: int = 0, thin: int = 1, seed=None, incremental: bool = True) -> None:
+        self.model = model
+        self.n_samples = n_samples
+        self.burn_in = burn_in
+        self.thin = thin
+        self.seed = seed
+        self.incremental = incremental
+        program = incremental_program(model) if incremental else None
+        self.program = model if program is None else program
+
+    # one MH step, returns (state, accepted)
+    def step(self, state: ExecutionState, args, kwargs) -> tuple:
+        if len(state.addresses) == 0:
+            return state, True
+        rng = _rng()
+        proposed = state.addresses[rng.integers(len(state.addresses))]
+        key = state.sites[proposed]
+
+        if key is None:
+            old_logprobs = state.site_logprobs()
+            replay = state.choices()
+            del replay[proposed]
+            new = run_state(self.program, replay, args, kwargs)
+            new_logprobs, new_log_joint, n_new = new.site_logprobs(), new.log_joint, len(new.addresses)
+            log_joint_change = new_log_joint - state.log_joint
+        else:
+            # only the loop iteration containing the address is re-executed
+            segment = state.segments[key]
+            old_logprobs = {address: segment.logprobs()[i] for address, i in segment.sample_sites().items()}
+            replay = segment.choices()
+            del replay[proposed]
+            new = state.rerun_segment(key, replay)
+            new_logprobs = {address: new.logprobs()[i] for address, i in new.sample_sites().items()}
+            new_log_joint = new.log_joint
+            n_new = len(state.addresses) - len(old_logprobs) + len(new_logprobs)
+            log_joint_change = new.log_joint - segment.log_joint
+        if new_log_joint == -np.inf:
+            return state, False
+
+        # fresh: drawn by the new run, stale: values of the old run that were not reused
+        fresh = sum(lp for address, lp in new_logprobs.items() if address not in replay)
+        stale = sum(lp for address, lp in old_logprobs.items() if address == proposed or address not in new_logprobs)
+        log_alpha = (
+            log_joint_change
+            + np.log(len(state.addresses)) - np.log(n_new)
+            + stale - fresh
+        )
+        if np.log(rng.random()) < log_alpha:
+            if key is None:
+                return new, True
+            state.replace_segment(key, new)
+            return state, True
+        return state, False
+
+    def run(self, *args, **kwargs) -> MCMCSamples:
+        with rng_scope(self.seed):
+            state = _initial_state(self.program, args, kwargs)
+            choices, log_joint = [], []
+            accepted = 0
+            n_steps = self.burn_in + self.n_samples * self.thin
+            for i in range(n_steps):
+                state, a = self.step(state, args, kwargs)
+                accepted += a
+                if i >= self.burn_in and (i - self.burn_in) % self.thin == self.thin - 1:
+                    choices.append(state.choices())
+                    log_joint.append(state.log_joint)
+        return _collect_chain(choices, log_joint, accepted / max(n_steps, 1))
@@ -1,31 +1,270 @@
-from .scipy_distributions import Distribution, Dirac
+from .scipy_distributions import Batched, Distribution, Dirac, Dual, _as_array, _batched_index, rng_scope, split_rng
+import contextvars
+import functools
+import math
+import os
+import sys
 import numpy as np
 from tqdm import tqdm
-from collections import defaultdict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 
-# global variables are ugly, but simple (pyro uses a similar method)
-_TRACE = None
+# The active trace is stored in a context variable (instead of a global), so
+# that models can run concurrently in threads and asyncio tasks, and nested
+# model runs restore the outer trace when they finish.
+_TRACE = contextvars.ContextVar("probros_trace", default=None)
+
+def _current_trace():
+    trace = _TRACE.get()
+    if trace is None:
+        raise RuntimeError("sample, observe, and factor can only be used inside a probabilistic program.")
+    return trace
+
+# kind codes stored in the trace
+SAMPLE, OBSERVE, FACTOR = 0, 1, 2
+_KIND_NAMES = ("sample", "observe", "factor")
+
+# The trace is stored column-wise: addresses are interned strings (indexed
+# addresses are cached Address instances, see IndexedAddress), kinds are
+# uint8 codes, and scalar float values and log probabilities live in
+# preallocated float arrays which grow geometrically. Values that are not
+# float scalars (ints, bools, arrays, ...) are kept in a side table.
+# Entries are exposed as lazy dict-like views, e.g. trace[0]["value"].
 class Trace:
-    def __init__(self) -> None:
-        self.trace = []
-        self.log_prior = 0.
-        self.log_likelihood = 0.
-        self.log_joint = 0.
+    __slots__ = (
+        "batch_size", "keep_distributions", "early_exit", "rng", "replay",
+        "checkpoint", "log_prior", "log_likelihood", "log_joint", "input", "retval",
+        "_n", "_addresses", "_kinds", "_values", "_logprobs",
+        "_boxed", "_distributions", "_n_observes",
+    )
+
+    # With `batch_size=N` the model is run for N particles at once:
+    # sampled values have a leading particle axis of length N (and are marked
+    # as Batched, see scipy_distributions) and all log probabilities are
+    # arrays of shape (N,). Observed values are scored per particle if they
+    # (or the parameters of their distribution) are Batched, e.g. computed from
+    # sampled values, and are shared by all particles otherwise. Indexing a
+    # sampled value indexes the value of each particle, and Python control
+    # flow on sampled values (if, while, and, or) is not supported.
+    # With `keep_distributions=False` distribution objects are not retained.
+    # With `early_exit=True` the model run is stopped as soon as the log joint
+    # is -inf (for all particles), the return value is then None.
+    # With `rng` (a numpy.random.Generator or a seed) all random draws of the
+    # model run use this generator instead of the current one.
+    # With `replay={address: value}` sample statements at these addresses
+    # reuse the given value (scored under the current distribution) instead of
+    # drawing a new one. In batched execution the replayed values are
+    # per-particle, i.e. have a leading particle axis.
+    # With `checkpoint=k` the model run is stopped after the k-th observe
+    # statement, the return value is then None.
+    def __init__(self, batch_size: int = None, keep_distributions: bool = True, early_exit: bool = False, rng=None, replay: dict = None, checkpoint: int = None, capacity: int = 16) -> None:
+        self.batch_size = batch_size
+        self.keep_distributions = keep_distributions
+        self.early_exit = early_exit
+        self.rng = rng
+        self.replay = replay
+        self.checkpoint = checkpoint
+        # log probabilities are accumulated while the model runs
+        if batch_size is None:
+            self.log_prior = 0.
+            self.log_likelihood = 0.
+            self.log_joint = 0.
+        else:
+            self.log_prior = np.zeros(batch_size)
+            self.log_likelihood = np.zeros(batch_size)
+            self.log_joint = np.zeros(batch_size)
         self.input = None
         self.retval = None
+
+        capacity = max(capacity, 1)
+        self._n = 0
+        self._addresses = []
+        self._kinds = np.empty(capacity, dtype=np.uint8)
+        self._values = np.empty(capacity)
+        if batch_size is None:
+            self._logprobs = np.empty(capacity)
+        else:
+            self._logprobs = np.empty((capacity, batch_size))
+        self._boxed = {}
+        self._distributions = [] if keep_distributions else None
+        self._n_observes = 0
+
+    def _grow(self):
+        capacity = 2 * len(self._kinds)
+        self._kinds = np.resize(self._kinds, capacity)
+        self._values = np.resize(self._values, capacity)
+        self._logprobs = np.resize(self._logprobs, (capacity,) + self._logprobs.shape[1:])
+
+    def append(self, address: str, kind: int, value, logprob, distribution: Distribution = None):
+        i = self._n
+        if i == len(self._kinds):
+            self._grow()
+        self._addresses.append(sys.intern(address) if type(address) is str else address)
+        self._kinds[i] = kind
+        if type(value) is float or type(value) is np.float64:
+            self._values[i] = value
+        elif kind != FACTOR:
+            self._boxed[i] = value
+        # the columns hold plain floats, the log joint keeps the derivatives of Duals
+        self._logprobs[i] = logprob.value if type(logprob) is Dual else logprob
+        if self._distributions is not None:
+            self._distributions.append(distribution)
+        self._n = i + 1
+
+        if kind == SAMPLE:
+            self.log_prior += logprob
+        else:
+            self.log_likelihood += logprob
+        self.log_joint += logprob
+        if self.early_exit and np.all(self.log_joint == -np.inf):
+            raise _ZeroProbability()
+        if kind == OBSERVE:
+            self._n_observes += 1
+            if self._n_observes == self.checkpoint:
+                raise _Checkpoint()
+
+    # number of observe statements
+    @property
+    def n_observes(self) -> int:
+        return self._n_observes
+
+    # columns (views, valid until the next append)
+    def kinds(self) -> np.ndarray:
+        return self._kinds[:self._n]
+
+    def logprobs(self) -> np.ndarray:
+        return self._logprobs[:self._n]
+
+    def addresses(self) -> list:
+        return self._addresses
+
+    # address -> index of the (last) sample statement with that address
+    def sample_sites(self) -> dict:
+        return {self._addresses[i]: i for i in np.flatnonzero(self.kinds() == SAMPLE)}
+
+    # address -> value of all sample statements, e.g. to replay the trace
+    def choices(self) -> dict:
+        return {address: self._get(i, 'value') for address, i in self.sample_sites().items()}
+
+    def _get(self, i: int, key: str):
+        kind = self._kinds[i]
+        if key == 'address':
+            return self._addresses[i]
+        if key == 'kind':
+            return _KIND_NAMES[kind]
+        if key == 'logprob':
+            return self._logprobs[i]
+        if key == 'value' and kind != FACTOR:
+            return self._boxed[i] if i in self._boxed else self._values[i]
+        if key == 'distribution' and kind != FACTOR and self._distributions is not None:
+            return self._distributions[i]
+        raise KeyError(key)
+
+    def _keys(self, i: int):
+        if self._kinds[i] == FACTOR:
+            return ('address', 'kind', 'logprob')
+        if self._distributions is None:
+            return ('address', 'kind', 'value', 'logprob')
+        return ('address', 'kind', 'value', 'logprob', 'distribution')
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __iter__(self):
+        return (TraceEntry(self, i) for i in range(self._n))
+
+    @property
+    def trace(self):
+        return list(self)
+
     def __repr__(self) -> str:
-        s = f"Trace(input={self.input})\n"
-        for i, entry in enumerate(self.trace):
+        s = f"Trace(input={self.input}"
+        if self.batch_size is not None:
+            s += f", batch_size={self.batch_size}"
+        s += ")\n"
+        for i, entry in enumerate(self):
             s += f"{i}.: {entry}\n"
         s += f"retval={self.retval}\n"
         s += f"log prior: {self.log_prior}\n"
         s += f"log likelihood: {self.log_likelihood}\n"
         s += f"log joint: {self.log_joint}"
         return s
+
     def __getitem__(self, i):
-        return self.trace[i]
+        if isinstance(i, slice):
+            return [TraceEntry(self, j) for j in range(*i.indices(self._n))]
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError("trace index out of range")
+        return TraceEntry(self, i)
+
     def entries_by_address(self):
-        return {entry['address']: entry for entry in self.trace}
+        return AddressView(self)
+
+    # The entries at the indexed addresses base[...] (see IndexedAddress) as one
+    # array-backed site: their indices (shape (k,), or (k, d) for d indices per
+    # address) and the given key of the entries, stacked on the first axis,
+    # e.g. index, values = trace.indexed("y")
+    def indexed(self, base: str, key: str = 'value') -> tuple:
+        rows = [i for i, address in enumerate(self._addresses) if type(address) is Address and address.base == base]
+        index = np.array([self._addresses[i].index for i in rows]).reshape(len(rows), -1)
+        if index.shape[1] == 1:
+            index = index[:, 0]
+        if key == 'logprob':
+            return index, self._logprobs[rows]
+        if key == 'value' and not any(i in self._boxed for i in rows):
+            return index, self._values[rows]
+        return index, np.array([self._get(i, key) for i in rows])
+
+# raised to stop a model run early, see Trace(early_exit=True)
+class _ZeroProbability(Exception):
+    pass
+
+# raised to stop a model run at a checkpoint, see Trace(checkpoint=k)
+class _Checkpoint(Exception):
+    pass
+
+# Lazy view of a single trace entry, behaves like the dict
+# {'address': ..., 'kind': ..., 'value': ..., 'logprob': ..., 'distribution': ...}
+class TraceEntry(Mapping):
+    __slots__ = ("_trace", "_i")
+
+    def __init__(self, trace: Trace, i: int) -> None:
+        self._trace = trace
+        self._i = i
+
+    def __getitem__(self, key):
+        return self._trace._get(self._i, key)
+
+    def __iter__(self):
+        return iter(self._trace._keys(self._i))
+
+    def __len__(self) -> int:
+        return len(self._trace._keys(self._i))
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+# Lazy mapping from address to (the last) trace entry with that address.
+class AddressView(Mapping):
+    __slots__ = ("_trace", "_index")
+
+    def __init__(self, trace: Trace) -> None:
+        self._trace = trace
+        self._index = {address: i for i, address in enumerate(trace.addresses())}
+
+    def __getitem__(self, address):
+        return TraceEntry(self._trace, self._index[address])
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
 
 
 # We define a decorator
@@ -34,31 +273,38 @@ class Trace:
 #     ...
 # which traces all sample, observe, and factor statements
 def probabilistic_program(func):
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        global _TRACE
-        
-        # reset trace
-        _TRACE = Trace()
-
-        # run model function
-        retval = func(*args, **kwargs)
-
-        # sum up log probabilities, i.e. lp_jiont is joint probability of model p(X,Y=y)
-        lp_prior = sum(entry['logprob'] for entry in _TRACE.trace if entry["kind"] == "sample")
-        lp_lik = sum(entry['logprob'] for entry in _TRACE.trace if entry["kind"] != "sample")
-        lp_joint = lp_prior + lp_lik
-
-        # store some more information
-        _TRACE.input = (args, kwargs)
-        _TRACE.retval = retval
-        _TRACE.log_prior = lp_prior
-        _TRACE.log_likelihood = lp_lik
-        _TRACE.log_joint = lp_joint
-
-        return retval, _TRACE
-    
+        return execute(func, Trace(), *args, **kwargs)
+
     return wrapper
 
+# Runs a model (decorated or not) and records into the given trace.
+# This lets callers configure the trace, e.g. batched execution
+#   execute(model, Trace(batch_size=10_000), *args)
+def execute(model, trace: Trace, *args, **kwargs):
+    # run undecorated function, so that the trace is not reset
+    func = getattr(model, "__wrapped__", model)
+
+    # activate trace for this context
+    token = _TRACE.set(trace)
+
+    # run model function, log probabilities are summed up by the trace,
+    # i.e. log_joint is joint probability of model p(X,Y=y)
+    try:
+        with rng_scope(trace.rng):
+            retval = func(*args, **kwargs)
+    except (_ZeroProbability, _Checkpoint):
+        retval = None
+    finally:
+        _TRACE.reset(token)
+
+    # store some more information
+    trace.input = (args, kwargs)
+    trace.retval = retval
+
+    return retval, trace
+
 # sample statements have an address, because sometimes you may want to
 # have multiple statements corresponding to the same variable, but storing it
 # in different program identifiers. We require an explicit address (variable name)
@@ -71,118 +317,535 @@ def probabilistic_program(func):
 # Random value draws are logged in the trace at `address`.
 
 def sample(address: str, distribution: Distribution):
+    trace = _current_trace()
+
     if address is None:
         # we provide default (unique) addresses
-        address = f"sample_{len(_TRACE.trace)}"
-
-    # draw random variable according to distribution
-    value = distribution.sample()
-
-    # compute log probability of sampled value
-    logprob = distribution.logprob(value)
-
-    # store result in global trace
-    _TRACE.trace.append({
-        'address': address,
-        'kind': 'sample',
-        'value': value,
-        'logprob': logprob,
-        'distribution': distribution
-    })
+        address = f"sample_{len(trace)}"
+
+    # effect handlers may force the value, e.g. Replay and Condition
+    handlers = _HANDLERS.get()
+    message = _handle(handlers, SAMPLE, address, distribution, _UNSET) if handlers else None
+
+    if message is not None and message.value is not _UNSET:
+        value = message.value
+        if trace.batch_size is None:
+            logprob = distribution.logprob(value)
+        else:
+            value = np.asarray(value).view(Batched)
+            logprob = distribution.batch_logprob(value, trace.batch_size)
+    elif trace.replay is not None and address in trace.replay:
+        # reuse value, e.g. from a previous trace
+        value = trace.replay[address]
+        if trace.batch_size is None:
+            logprob = distribution.logprob(value)
+        else:
+            value = np.asarray(value).view(Batched)
+            logprob = distribution.batch_logprob(value, trace.batch_size)
+    elif trace.batch_size is None:
+        # draw random variable according to distribution
+        value = distribution.sample()
+
+        # compute log probability of sampled value
+        logprob = distribution.logprob(value)
+    else:
+        # draw one value per particle
+        value = np.asarray(distribution.batch_sample(trace.batch_size)).view(Batched)
+        logprob = distribution.batch_logprob(value, trace.batch_size)
+
+    # store result in trace
+    if message is None:
+        trace.append(address, SAMPLE, value, logprob, distribution)
+    elif not message.blocked:
+        trace.append(address, message.kind, value, logprob * message.scale, distribution)
     # return sampled value
     return value
 
 def observe(value, address: str = None, distribution: Distribution = Dirac(True)):
+    trace = _current_trace()
+
     if address is None:
         # we provide default (unique) addresses
-        address = f"observe_{len(_TRACE.trace)}"
+        address = f"observe_{len(trace)}"
 
     # compute log probability of observed value
-    logprob = distribution.logprob(value)
+    if trace.batch_size is None:
+        logprob = distribution.logprob(value)
+    else:
+        logprob = distribution.batch_logprob(value, trace.batch_size)
 
-    # store result in global trace
-    _TRACE.trace.append({
-        'address': address,
-        'kind': 'observe',
-        'value': value,
-        'logprob': logprob,
-        'distribution': distribution
-    })
+    # store result in trace
+    handlers = _HANDLERS.get()
+    if not handlers:
+        trace.append(address, OBSERVE, value, logprob, distribution)
+    else:
+        message = _handle(handlers, OBSERVE, address, distribution, value)
+        if not message.blocked:
+            trace.append(address, OBSERVE, value, logprob * message.scale, distribution)
 
     # return observed value
     return value
 
 def factor(logfactor, address: str = None):
+    trace = _current_trace()
+
     if address is None:
-        address = f"factor:{len(_TRACE.trace)}"
+        address = f"factor:{len(trace)}"
 
-    # store result in global trace
-    _TRACE.trace.append({
-        'address': address,
-        'kind': 'factor',
-        'logprob': logfactor
-    })
+    if trace.batch_size is not None:
+        logfactor = np.broadcast_to(logfactor, (trace.batch_size,)).astype(float)
 
+    # store result in trace
+    handlers = _HANDLERS.get()
+    if not handlers:
+        trace.append(address, FACTOR, None, logfactor)
+    else:
+        message = _handle(handlers, FACTOR, address, None, None)
+        if not message.blocked:
+            trace.append(address, FACTOR, None, logfactor * message.scale)
+
+
+# Effect handlers (see handlers.py) active in the current context, innermost last.
+_HANDLERS = contextvars.ContextVar("probros_handlers", default=())
+_UNSET = object()
+
+# A statement as seen by the effect handlers: handlers may set the value of a
+# sample statement (value is _UNSET otherwise), change its kind to OBSERVE,
+# scale its log probability, or block it from being recorded in the trace.
+class _Message:
+    __slots__ = ("kind", "address", "distribution", "value", "scale", "blocked")
+
+    def __init__(self, kind: int, address, distribution, value) -> None:
+        self.kind = kind
+        self.address = address
+        self.distribution = distribution
+        self.value = value
+        self.scale = 1.
+        self.blocked = False
+
+# passes the statement through the handlers from the innermost outwards, a
+# blocked statement is not seen by the handlers further out
+def _handle(handlers: tuple, kind: int, address, distribution, value) -> _Message:
+    message = _Message(kind, address, distribution, value)
+    for handler in reversed(handlers):
+        handler.process(message)
+        if message.blocked:
+            break
+    return message
+
+# Estimates E[X] and the central moments E[(X - mu)^k], k = 2..K, of all
+# sampled addresses, using the prior as proposal and the likelihood as weight.
+# Runs are processed in a streaming fashion, memory does not depend on n_iter.
 def estimate_moments(n_iter: int, K: int, model, *args, **kwargs):
-    collected_trace = defaultdict(list)
-    lps = np.zeros(n_iter)
+    moments = _StreamingMoments(K)
     for i in tqdm(range(n_iter)):
         retval, trace = model(*args, **kwargs)
-        lps[i] = trace.log_likelihood
-        #collected_trace['__RETVAL__'].append(retval)
-        for entry in trace.trace:
-            if entry['kind'] == 'sample':
-                collected_trace[entry['address']].append(entry["value"])
-
-    # normalise
-    m = np.max(lps)
-    lps = lps - (m + np.log(np.sum(np.exp(lps - m))))
-    p = np.exp(lps)
-
-    for (address, values) in collected_trace.items():
-        first = np.shape(values[0])
-        all_equal_shape = all(first == np.shape(x) for x in values)
-        assert all_equal_shape, f"Values for address {address} have varying shapes."
-        values = np.array(values) # (n_iter, *first)
-        print(address + ":")
-        sample_moment = p.dot(values)
-        for moment in range(1,K+1):
-            if moment == 1:
-                print(f"  E[X] ≈", sample_moment)
+        moments.add(trace.log_likelihood, trace)
+
+    result = moments.result()
+    print(result)
+    return result
+
+# Merges weighted statistics (W, mean, M) of two sets of values, where
+# M[p] = sum_i w_i (x_i - mean)^p for p = 2..K and M[0] = W, M[1] = 0
+# (pairwise update formulas of Pébay, 2008).
+def _merge_moments(K: int, a: tuple, b: tuple) -> tuple:
+    Wa, mua, Ma = a
+    Wb, mub, Mb = b
+    W = Wa + Wb
+    delta = mub - mua
+    mu = mua + delta * (Wb / W)
+    da, db = -delta * (Wb / W), delta * (Wa / W)
+    M = np.zeros(np.broadcast_shapes(Ma.shape, Mb.shape))
+    M[0] = W
+    for p in range(2, K + 1):
+        M[p] = sum(math.comb(p, k) * (Ma[p - k] * da ** k + Mb[p - k] * db ** k) for k in range(p + 1))
+    return W, mu, M
+
+# weighted statistics (W, mean, M) of values x with weights w > 0 on the leading axis
+def _block_moments(K: int, w: np.ndarray, x: np.ndarray) -> tuple:
+    W = w.sum()
+    wx = w.reshape((-1,) + (1,) * (x.ndim - 1))
+    mu = (wx * x).sum(axis=0) / W
+    M = np.zeros((K + 1,) + x.shape[1:])
+    M[0] = W
+    d = x - mu
+    dp = d
+    for p in range(2, K + 1):
+        dp = dp * d
+        M[p] = (wx * dp).sum(axis=0)
+    return W, mu, M
+
+# Streaming estimate of weighted moments per address with O(K) memory per
+# address. Weights are stored relative to exp(log_scale), the largest log
+# weight seen so far (online log-sum-exp), and partial estimates of
+# several workers can be merged.
+# Values of single runs are buffered per address and merged in blocks of
+# BLOCK_SIZE runs, as merging each run separately is slow.
+class _StreamingMoments:
+    BLOCK_SIZE = 1024
+
+    def __init__(self, K: int) -> None:
+        self.K = K
+        self.n = 0
+        self.log_scale = -np.inf
+        self.total_weight = 0.
+        self.stats = {}
+        # address -> ([log weight], [value]) of buffered runs
+        self.pending = {}
+        self.n_pending = 0
+
+    def _rescale(self, log_scale: float):
+        if log_scale > self.log_scale:
+            c = np.exp(self.log_scale - log_scale)
+            self.total_weight *= c
+            self.stats = {address: (W * c, mu, M * c) for address, (W, mu, M) in self.stats.items()}
+            self.log_scale = log_scale
+
+    def _update(self, address, stats: tuple):
+        if address not in self.stats:
+            self.stats[address] = stats
+        else:
+            assert np.shape(self.stats[address][1]) == np.shape(stats[1]), f"Values for address {address} have varying shapes."
+            self.stats[address] = _merge_moments(self.K, self.stats[address], stats)
+
+    def _update_block(self, address, w: np.ndarray, x: np.ndarray):
+        if np.any(w > 0):
+            self._update(address, _block_moments(self.K, w, x))
+
+    # merges the buffered runs into the statistics
+    def _flush(self):
+        for address, (logweights, values) in self.pending.items():
+            assert len({np.shape(x) for x in values}) == 1, f"Values for address {address} have varying shapes."
+            w = np.exp(np.array(logweights) - self.log_scale)
+            self._update_block(address, w, np.array(values, dtype=float))
+        self.pending = {}
+        self.n_pending = 0
+
+    # adds a model run (or all particles of a batched run) with log weight(s)
+    def add(self, logweight, trace: Trace):
+        logweight = np.asarray(logweight, dtype=float)
+        self.n += logweight.size
+        if np.all(logweight == -np.inf):
+            return
+        self._rescale(np.max(logweight))
+        w = np.exp(logweight - self.log_scale)
+        self.total_weight += w.sum()
+
+        addresses = trace.addresses()
+        for i in np.flatnonzero(trace.kinds() == SAMPLE):
+            if w.ndim == 0:
+                logweights, values = self.pending.setdefault(addresses[i], ([], []))
+                logweights.append(float(logweight))
+                values.append(trace[i]['value'])
             else:
-                print(f"  E[(X - mu)^{moment}] ≈", p.dot((values - sample_moment) ** moment))
+                # particles are on the leading axis
+                self._update_block(addresses[i], w, np.asarray(trace[i]['value'], dtype=float))
+
+        if w.ndim == 0:
+            self.n_pending += 1
+            if self.n_pending >= self.BLOCK_SIZE:
+                self._flush()
+
+    def merge(self, other: "_StreamingMoments"):
+        self._flush()
+        other._flush()
+        self.n += other.n
+        if other.log_scale == -np.inf:
+            return
+        self._rescale(other.log_scale)
+        c = np.exp(other.log_scale - self.log_scale)
+        self.total_weight += c * other.total_weight
+        for address, (W, mu, M) in other.stats.items():
+            self._update(address, (W * c, mu, M * c))
+
+    def result(self) -> "Moments":
+        self._flush()
+        moments = {
+            address: [mu] + [M[p] / W for p in range(2, self.K + 1)]
+            for address, (W, mu, M) in self.stats.items()
+        }
+        log_evidence = self.log_scale + np.log(self.total_weight) - np.log(self.n) if self.n > 0 else -np.inf
+        return Moments(moments, self.n, log_evidence)
+
+# Result of estimate_moments:
+# moments[address] = [E[X], E[(X - mu)^2], ..., E[(X - mu)^K]]
+# log_evidence is the estimate of the log marginal likelihood log p(Y=y).
+class Moments:
+    def __init__(self, moments: dict, n_iter: int, log_evidence: float) -> None:
+        self.moments = moments
+        self.n_iter = n_iter
+        self.log_evidence = log_evidence
+
+    def __getitem__(self, address):
+        return self.moments[address]
+
+    def __iter__(self):
+        return iter(self.moments)
+
+    def mean(self, address):
+        return self.moments[address][0]
+
+    def variance(self, address):
+        return self.moments[address][1]
+
+    def __repr__(self) -> str:
+        return f"Moments(addresses={list(self.moments)}, n_iter={self.n_iter}, log_evidence={self.log_evidence})"
+
+    def __str__(self) -> str:
+        lines = []
+        for address, values in self.moments.items():
+            lines.append(f"{address}:")
+            for moment, value in enumerate(values, 1):
+                if moment == 1:
+                    lines.append(f"  E[X] ≈ {value}")
+                else:
+                    lines.append(f"  E[(X - mu)^{moment}] ≈ {value}")
+        return "\n".join(lines)
+
+# runs one shard of estimate_moments_parallel in a worker process
+def _estimate_moment_sums(rng: np.random.Generator, n_iter: int, K: int, model, args, kwargs):
+    moments = _StreamingMoments(K)
+    with rng_scope(rng):
+        for i in range(n_iter):
+            retval, trace = model(*args, **kwargs)
+            moments.add(trace.log_likelihood, trace)
+    return moments
+
+# Parallel version of estimate_moments. The n_iter runs are split across
+# n_workers processes, each with its own random stream spawned from `seed`.
+# Workers return streaming moment estimates which are merged in order, so
+# results are reproducible for a given seed and number of workers.
+# The model has to be picklable, i.e. defined at the top level of a module.
+def estimate_moments_parallel(n_workers: int, seed: int, n_iter: int, K: int, model, *args, **kwargs):
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    rngs = split_rng(seed, n_workers)
+    shards = [n_iter // n_workers + (i < n_iter % n_workers) for i in range(n_workers)]
+    jobs = [(rngs[i], shards[i], K, model, args, kwargs) for i in range(n_workers)]
+
+    if n_workers == 1:
+        partial = [_estimate_moment_sums(*jobs[0])]
+    else:
+        with ProcessPoolExecutor(n_workers) as executor:
+            partial = list(executor.map(_estimate_moment_sums, *zip(*jobs)))
+
+    moments = _StreamingMoments(K)
+    for p in partial:
+        moments.merge(p)
+
+    result = moments.result()
+    print(result)
+    return result
+
+
+# Address of an indexed statement, e.g. IndexedAddress("y", 17). It is the
+# string "y[17]" (so it compares and hashes equal to it, and works as a key
+# wherever plain string addresses do), and keeps its structure as `base` and
+# `index`, e.g. to group all y[i] of a trace without parsing strings (see
+# Trace.indexed).
+class Address(str):
+    __slots__ = ("base", "index")
+
+    def __new__(cls, base: str, index: tuple):
+        address = super().__new__(cls, f"{base}[{','.join(map(str, index))}]")
+        address.base = base
+        address.index = index
+        return address
+
+    # (base, *index)
+    @property
+    def key(self) -> tuple:
+        return (self.base,) + self.index
 
+    def __reduce__(self):
+        return (IndexedAddress, self.key)
+
+# IndexedAddress(base, *index) -> Address, cached so that the string is
+# formatted once and not on every iteration of a loop. The cache holds a dict
+# per base, keyed by the index itself if it is an int (or a pair of ints),
+# and otherwise by the index and its types, as 1, 1.0, and True are equal but
+# format differently. Once the cache holds _MAX_ADDRESSES addresses, new ones
+# are created without caching them, so that it does not grow without bound in
+# long-running processes, and loops over more addresses than that do not
+# evict the cached ones on every pass.
+_ADDRESSES = {}
+_MAX_ADDRESSES = 2 ** 17
+_n_addresses = 0
 
 def IndexedAddress(base: str, *index):
+    global _n_addresses
     if len(index) == 1:
-        return f"{base}[{index[0]}]"
-    i = ",".join(map(str, index))
-    return f"{base}[{i}]"
+        i = index[0]
+        key = i if type(i) is int else (i, type(i))
+    elif len(index) == 2 and type(index[0]) is int and type(index[1]) is int:
+        key = index
+    else:
+        key = (index, tuple(map(type, index)))
+    cache = _ADDRESSES.get(base)
+    if cache is not None:
+        address = cache.get(key)
+        if address is not None:
+            return address
+    address = Address(base, index)
+    if _n_addresses < _MAX_ADDRESSES:
+        if cache is None:
+            cache = _ADDRESSES[base] = {}
+        cache[key] = address
+        _n_addresses += 1
+    return address
+
+
+# numpy dtypes of the element types t of Vector, and the default fill per dtype kind
+_DTYPES = {float: np.float64, int: np.int64, bool: np.bool_}
+_FILLS = {"f": np.nan, "i": 0, "b": False, "O": None}
+
+def _dtype(t, fill) -> np.dtype:
+    if t is not None:
+        if t in _DTYPES or isinstance(t, np.dtype) or isinstance(t, type) and issubclass(t, np.generic):
+            return np.dtype(_DTYPES.get(t, t))
+        return np.dtype(object)
+    if fill is None:
+        return np.dtype(np.float64)
+    return np.asarray(fill).dtype
 
+# element types that are stored in a buffer of the given dtype without
+# widening it (None: all types), with t given they are converted to t
+_FLOATS = {float, np.float64, np.float32}
+_INTS = {int, np.int64, np.int32}
+_BOOLS = {bool, np.bool_}
+
+def _storable(dtype: np.dtype, typed: bool):
+    if dtype.kind == "f":
+        return _FLOATS | _INTS | (_BOOLS if typed else set())
+    if dtype.kind == "i":
+        # floats are checked to be integral (see _Buffer._widen)
+        return _INTS | (_BOOLS if typed else set())
+    if dtype.kind == "b":
+        return _BOOLS | (_INTS | _FLOATS if typed else set())
+    return None
+
+# Typed numpy buffer of Vector and Array. Its dtype is given by t (float,
+# int, or bool), or without t taken from fill (float if there is no fill), and
+# the buffer is widened if a value of a wider type is assigned, e.g. a float
+# into Vector(n, fill=0). With t, numbers are converted to t, except that
+# fractional values are rejected by int buffers (as fractional indices are,
+# e.g. Vector(n, t=int)[0] = 2.7 raises a ValueError). Values that are
+# not numbers (e.g. strings, Duals, or per-particle arrays in batched
+# execution) switch the buffer to dtype object, and so do bools assigned to a
+# numeric buffer (or numbers to a bool buffer) without t, which keeps them as
+# they are.
+# The buffer is passed to observe and logprob without copying (see __array__),
+# and exposes the buffer protocol (memoryview(x), for numeric dtypes) on
+# Python 3.12 or later, which calls __buffer__ (PEP 688).
+class _Buffer:
+    __slots__ = ("array", "_typed", "_storable")
+
+    def __init__(self, shape, t, fill):
+        dtype = _dtype(t, fill)
+        if fill is None:
+            fill = _FILLS.get(dtype.kind)
+        self.array = np.full(shape, fill, dtype)
+        self._typed = t is not None
+        self._storable = _storable(self.array.dtype, self._typed)
+
+    def _widen(self, key, value):
+        if type(value) is Dual:
+            dtype = np.dtype(object)
+        else:
+            value = np.asarray(value)
+            if value.dtype.kind not in "biuf" or value.ndim > np.ndim(self.array[key]):
+                dtype = np.dtype(object)
+            elif self._typed:
+                if self.array.dtype.kind == "i" and value.dtype.kind == "f" and not np.all(np.mod(value, 1) == 0):
+                    raise ValueError(f"{type(self).__name__} of type int cannot hold the fractional value {value}.")
+                return
+            elif (value.dtype.kind == "b") != (self.array.dtype.kind == "b"):
+                dtype = np.dtype(object)
+            else:
+                dtype = np.result_type(self.array.dtype, value.dtype)
+        if dtype != self.array.dtype:
+            self.array = self.array.astype(dtype)
+            self._storable = _storable(dtype, self._typed)
+
+    # per-particle values of shape (n, ...) + the shape of the elements at
+    # key, each element holds its n values, e.g. a batched Dirichlet draw as a row
+    def _set_elements(self, key, value):
+        shape = np.broadcast_to(False, self.array.shape)[key].shape
+        if len(shape) == 0 or value.ndim <= len(shape):
+            self.array[key] = value
+            return
+        elements = np.empty(shape, object)
+        for index in np.ndindex(shape):
+            elements[index] = value[(Ellipsis,) + index]
+        self.array[key] = elements
+
+    def __getitem__(self, key):
+        # discrete draws stored in a float Vector index other Vectors, e.g. mu[z[i]]
+        if type(key) is float or type(key) is np.float64:
+            if not key.is_integer():
+                raise IndexError(f"{type(self).__name__} index {key} is not an integer.")
+            key = int(key)
+        elif isinstance(key, Batched) or type(key) is tuple and any(isinstance(k, Batched) for k in key):
+            return self._select(key)
+        return self.array[key]
+
+    # per-particle indices in batched execution, e.g. mu[z[i]] with a Batched z[i]
+    def _select(self, key):
+        values = _as_array(self.array, batched=True)
+        if values is None:
+            raise TypeError(f"{type(self).__name__} elements cannot be selected per particle.")
+        if isinstance(values, Batched):
+            return values[key]
+        key = key if type(key) is tuple else (key,)
+        key = tuple(_batched_index(k) if isinstance(k, Batched) else k for k in key)
+        return values[key].view(Batched)
+
+    def __setitem__(self, key, value):
+        if self._storable is not None and type(value) not in self._storable:
+            self._widen(key, value)
+        if isinstance(value, np.ndarray) and self.array.dtype == object:
+            self._set_elements(key, value)
+        else:
+            self.array[key] = value
+
+    def __iter__(self):
+        return iter(self.array)
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is not None and dtype != self.array.dtype:
+            return self.array.astype(dtype)
+        return self.array.copy() if copy else self.array
+
+    def __buffer__(self, flags):
+        return memoryview(self.array)
+
+# Vector of n elements of type t, e.g. Vector(len(y), t=float), see _Buffer
+class Vector(_Buffer):
+    __slots__ = ("n",)
 
-class Vector:
     def __init__(self, n: int, t=None, fill=None):
         self.n = n
-        self.list = [fill] * n
+        super().__init__(n, t, fill)
+
     def __len__(self):
         return self.n
-    def __getitem__(self, key):
-        return self.list[key]
-    def __setitem__(self, key, value):
-        self.list[key] = value
     def __repr__(self) -> str:
-        return "Vector(" + repr(self.list) + ")"
+        return "Vector(" + repr(self.array.tolist()) + ")"
 
+# Array of the given shape with elements of type t, see _Buffer. Rows (or any
+# other slices) are assigned at once, e.g. T[i] = sample(..., Dirichlet(...)).
+class Array(_Buffer):
+    __slots__ = ()
 
-class Array:
     def __init__(self, shape: tuple[int], t=None, fill=None):
-        self.shape = shape
-        self.array = np.full(shape, fill)
+        super().__init__(shape, t, fill)
+
+    @property
+    def shape(self) -> tuple:
+        return self.array.shape
+
     def __len__(self):
-        return self.n
-    def __getitem__(self, key):
-        return self.array[key]
-    def __setitem__(self, key, value):
-        self.array[key] = value
+        return self.array.shape[0]
     def __repr__(self) -> str:
         return "Array(" + repr(self.array) + ")"
\ No newline at end of file
@@ -1,54 +1,330 @@
 # This is an auto-generated file. Do not modify.
 
+import contextlib
+import contextvars
+import itertools
+import math
+import operator
 import numpy as np
+import scipy.linalg as linalg
+import scipy.special as special
 import scipy.stats as stats
+from .dual import Dual, primal as _primal, where_support as _where_support
+
+# Random number generator used by all distributions (including the scipy
+# fallback). `set_rng(seed)` sets the process-wide default, `rng_scope(rng)`
+# overrides it for the current context (thread, asyncio task, or model run),
+# and all `sample` methods accept an explicit `rng` as well.
+_DEFAULT_RNG = np.random.default_rng()
+_RNG = contextvars.ContextVar("probros_rng", default=None)
+
+def _as_rng(rng) -> np.random.Generator:
+    return rng if isinstance(rng, np.random.Generator) else np.random.default_rng(rng)
+
+def set_rng(rng):
+    global _DEFAULT_RNG
+    _DEFAULT_RNG = _as_rng(rng)
+
+def _rng() -> np.random.Generator:
+    rng = _RNG.get()
+    return _DEFAULT_RNG if rng is None else rng
+
+# with rng_scope(seed): ... (rng=None keeps the current generator)
+@contextlib.contextmanager
+def rng_scope(rng):
+    if rng is None:
+        yield _rng()
+        return
+    token = _RNG.set(_as_rng(rng))
+    try:
+        yield _RNG.get()
+    finally:
+        _RNG.reset(token)
+
+# independent child streams, e.g. for parallel chains or particles
+def split_rng(rng, n: int) -> list:
+    return _as_rng(rng).spawn(n)
+
+# Parameter and value types for which the generated distributions take the
+# fast path (numpy sampling and closed-form log probabilities with `math`)
+# instead of going through scipy.stats.
+_REAL_TYPES = (float, int, np.float64, np.int64)
+_INT_TYPES = (int, bool, np.int64, np.bool_)
+
+def _log_binom(n, k):
+    return math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1)
+
+# all rows (last axis) of value lie on the simplex
+def _on_simplex(value) -> bool:
+    value = np.asarray(value)
+    return bool(np.all(value > 0)) and bool(np.all(np.abs(value.sum(axis=-1) - 1) < 1e-9))
+
+# lower Cholesky factor of a covariance given as scalar, diagonal, or matrix,
+# None if it is not positive definite
+def _cholesky(cov, d: int):
+    cov = np.asarray(cov, dtype=float)
+    if cov.ndim == 0:
+        cov = cov * np.eye(d)
+    elif cov.ndim == 1:
+        cov = np.diag(cov)
+    if cov.shape != (d, d):
+        return None
+    try:
+        return np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        return None
+
+# normalising constant -1/2 log det(2 pi cov) of a multivariate normal
+def _mvn_lnorm(chol):
+    if chol is None:
+        return None
+    return -np.log(np.diag(chol)).sum() - 0.5 * len(chol) * math.log(2 * math.pi)
+
+# squared Mahalanobis norm of x (..., d) with respect to cov = chol chol^T
+def _mahalanobis(chol, x):
+    x = np.asarray(x)
+    z = linalg.solve_triangular(chol, x.reshape(-1, len(chol)).T, lower=True)
+    return np.sum(z ** 2, axis=0).reshape(x.shape[:-1])
+
+# L^-1 x along the last axis of x, for Duals as well (as it is linear in x)
+def _solve_lower(chol, x):
+    if type(x) is Dual:
+        tangent = np.swapaxes(x.full_tangent(), -1, -2)
+        return Dual(_solve_lower(chol, x.value), np.swapaxes(_solve_lower(chol, tangent), -1, -2))
+    x = np.asarray(x)
+    return linalg.solve_triangular(chol, x.reshape(-1, len(chol)).T, lower=True).T.reshape(x.shape)
+
+# multivariate normal log density for a Dual value or mean (constant cov)
+def _mvn_logprob(mean, cov, value):
+    chol = _cholesky(cov, np.shape(mean)[-1])
+    if chol is None:
+        return -np.inf
+    return _mvn_lnorm(chol) - 0.5 * np.sum(_solve_lower(chol, value - mean) ** 2, axis=-1)
+
+# Per-particle values in batched execution (see Trace(batch_size=...)), i.e.
+# an ndarray whose leading axis is the particle axis. The draws of sample
+# statements are Batched, and so are the results of numpy operations on them,
+# e.g. mu + phi * y[t]. Values and parameters which are not Batched are shared
+# by all particles, e.g. observed data, whatever its shape.
+# Indexing selects from the value of each particle, i.e. the particle axis is
+# kept, e.g. beta[k] of a draw of IID(Normal(0, 1), K) is the k-th entry of
+# each particle. Batched integer indices select per particle, e.g. mu[z] with
+# mu of shape (n, K) and z of shape (n,), and so do Vectors and Arrays.
+# Numpy operations and functions take the whole arrays, i.e. broadcast with
+# the particle axis first.
+# Python control flow on per-particle values (if, while, and, or) and
+# indexing lists with them is not supported and raises a TypeError, e.g. use
+# np.where or a Vector instead.
+class Batched(np.ndarray):
+    def __getitem__(self, key):
+        if self.ndim == 0 or key is Ellipsis:
+            return super().__getitem__(key)
+        key = key if type(key) is tuple else (key,)
+        if self.ndim == 1 and key:
+            raise IndexError("A per-particle scalar value cannot be indexed.")
+        if not any(_is_batched(k) for k in key):
+            return super().__getitem__((slice(None),) + key)
+        key = tuple(_batched_index(k) if _is_batched(k) else k for k in key)
+        ndim = max(np.ndim(k) for k in key)
+        particles = np.arange(len(self)).reshape((-1,) + (1,) * (ndim - 1))
+        return super().__getitem__((particles,) + key)
+
+    # numpy functions, e.g. np.stack or np.where, take the whole arrays
+    def __array_function__(self, func, types, args, kwargs):
+        return _rewrap(func(*_unwrap(args), **_unwrap(kwargs)))
+
+    def __bool__(self):
+        if self.ndim == 0:
+            return bool(self.item())
+        raise TypeError("Python control flow on per-particle values is not supported in batched execution, e.g. use np.where.")
+
+    def __index__(self):
+        if self.ndim == 0:
+            return operator.index(self.item())
+        raise TypeError("Per-particle values can only index Vectors, Arrays, and arrays in batched execution.")
 
+    def __repr__(self) -> str:
+        return "Batched(" + np.array2string(self.view(np.ndarray), separator=", ") + ")"
+
+    def __str__(self) -> str:
+        return str(self.view(np.ndarray))
+
+def _is_batched(x) -> bool:
+    return isinstance(x, Batched) and x.ndim > 0
+
+def _unwrap(x):
+    if isinstance(x, Batched):
+        return x.view(np.ndarray)
+    if type(x) in (list, tuple):
+        return type(x)(_unwrap(v) for v in x)
+    if type(x) is dict:
+        return {k: _unwrap(v) for k, v in x.items()}
+    return x
+
+def _rewrap(x):
+    if type(x) is np.ndarray:
+        return x.view(Batched)
+    if type(x) in (list, tuple):
+        return type(x)(_rewrap(v) for v in x)
+    return x
+
+# per-particle index as an integer array, e.g. discrete draws stored in a float Vector
+def _batched_index(key) -> np.ndarray:
+    key = key.view(np.ndarray)
+    if key.dtype.kind == "f":
+        if not np.all(key == np.floor(key)):
+            raise IndexError("Per-particle indices are not integers.")
+        return key.astype(np.intp)
+    return key
+
+# lists, tuples, and other array-likes (e.g. Vector) as one ndarray, None if
+# they do not convert to a numeric array (e.g. ragged lists or lists of Duals).
+# With batched=True, entries which are Batched are stacked with the particle
+# axis first, i.e. into a Batched array of shape (n,) + shape of value + event
+# shape, shared entries are broadcast to all particles.
+def _as_array(value, batched: bool = False):
+    if batched and isinstance(value, (list, tuple)) and any(_is_batched(v) for v in value):
+        array = np.empty(len(value), object)
+        for i, v in enumerate(value):
+            array[i] = v
+    else:
+        array = np.asarray(value)
+    if array.dtype != object:
+        return array
+    try:
+        entries = array.ravel()
+        if batched and any(_is_batched(v) for v in entries):
+            shape = np.broadcast_shapes(*(np.shape(v) for v in entries))
+            stacked = np.stack([np.broadcast_to(v, shape) for v in entries], axis=1)
+            return stacked.reshape(shape[:1] + array.shape + shape[1:]).view(Batched)
+        # e.g. a Vector of Dirichlet draws
+        array = np.asarray(array.tolist())
+    except (ValueError, TypeError):
+        return None
+    return None if array.dtype == object else array
+
+# Shapes: the last `event_dim` axes of a value form one draw (e.g. the
+# k entries of a Dirichlet draw), all axes before are batch axes, which are
+# scored independently and broadcast against the parameters.
 class Distribution:
-    def sample(self, size=None):
+    event_dim = 0
+
+    def sample(self, size=None, rng=None):
         raise NotImplementedError
-    
+
+    # log probabilities of shape value.shape[:ndim - event_dim]
     def _logprob(self, value):
         raise NotImplementedError
 
+    # total log probability, lists and array-likes are converted once and
+    # scored in one vectorized call
     def logprob(self, value):
-        if isinstance(value, list):
-            return sum(self._logprob(v) for v in value)
-        elif isinstance(value, np.ndarray):
+        if isinstance(value, np.ndarray) or type(value) is Dual:
             return self._logprob(value).sum()
+        if isinstance(value, (list, tuple)) or hasattr(value, "__array__") and not np.isscalar(value):
+            array = _as_array(value)
+            if array is not None:
+                return self._logprob(array).sum()
+            return sum(self._logprob(v) for v in value)
+        return self._logprob(value)
+
+    # Batched execution: draws one value per particle, i.e. shape (n, ...)
+    def batch_sample(self, n: int, rng=None):
+        return self.sample(size=n, rng=rng)
+
+    # Per-particle log probabilities of shape (n,). If the value or a parameter
+    # is Batched, the leading axis of the log probabilities is the particle
+    # axis and all remaining axes are summed out. Otherwise the value is
+    # shared by all particles (e.g. an observed data set of any length).
+    def batch_logprob(self, value, n: int):
+        if isinstance(value, Batched):
+            batched = value.ndim > 0
+            value = value.view(np.ndarray)
         else:
-            return self._logprob(value)
+            if isinstance(value, (list, tuple)) or hasattr(value, "__array__") and not np.isscalar(value):
+                array = _as_array(value, batched=True)
+                value = np.asarray(value) if array is None else array
+            batched = _is_batched(value)
+            if batched:
+                value = value.view(np.ndarray)
+        batched = batched or self._batched()
+        lp = np.asarray(self._logprob(value))
+        if batched:
+            return lp.reshape(n, -1).sum(axis=1)
+        return np.full(n, lp.sum())
+
+    # some parameter is per-particle (see Batched)
+    def _batched(self) -> bool:
+        return any(_is_batched(v) or isinstance(v, Distribution) and v._batched() for v in vars(self).values())
+
+    # all values of a distribution with finite support, e.g. for enumeration
+    def enumerate_support(self) -> list:
+        raise ValueError(f"{self} does not have a finite support.")
         
+# n independent draws of base, stacked on the first axis of the value,
+# i.e. of shape (n, ...) + the event shape of base (see sample)
 class IID(Distribution):
     def __init__(self, base: Distribution, n: int) -> None:
         self.base = base
         self.n = n
+        self.event_dim = base.event_dim + 1
 
-    def sample(self, size=None):
+    def sample(self, size=None, rng=None):
         if size is not None:
             if isinstance(size, int):
-                return self.base.sample(size=(self.n,size))
+                return self.base.sample(size=(self.n,size), rng=rng)
             else:
                 assert isinstance(size, tuple)
-                return self.base.sample(size=(self.n,) + size)
+                return self.base.sample(size=(self.n,) + size, rng=rng)
         else:
-            return self.base.sample(size=self.n)
+            return self.base.sample(size=self.n, rng=rng)
     
+    def _logprob(self, value):
+        return self.base._logprob(value).sum(axis=0)
+
     def logprob(self, value) -> float:
-        if isinstance(value, np.ndarray):
-            return self.base.logprob(value).sum()
+        if not isinstance(value, np.ndarray) and type(value) is not Dual:
+            array = _as_array(value)
+            if array is None:
+                assert len(value) == self.n
+                return sum(self.base.logprob(value[i]) for i in range(self.n))
+            value = array
+        if len(value) != self.n:
+            raise ValueError(f"{self} expects {self.n} values, got {len(value)}.")
+        return self.base._logprob(value).sum()
+
+    def batch_sample(self, n: int, rng=None):
+        # base draws have shape (self.n, n, ...), particles go first
+        return np.swapaxes(self.base.sample(size=(self.n, n), rng=rng), 0, 1)
+
+    def batch_logprob(self, value, n: int):
+        # the iid axis goes first, then the particle axis (of length 1 if the
+        # value is shared), so that it broadcasts against per-particle
+        # parameters of the base distribution
+        if not isinstance(value, Batched):
+            array = _as_array(value, batched=True)
+            value = np.asarray(value) if array is None else array
+        if _is_batched(value):
+            value = np.swapaxes(value.view(np.ndarray), 0, 1)
         else:
-            assert isinstance(value, list) and len(value) == self.n
-            return sum(self.base.logprob(value[i]) for i in range(self.n))
+            value = np.asarray(value)[:, None]
+        lp = np.asarray(self.base._logprob(value)).sum(axis=0)
+        return np.broadcast_to(lp, (n,)).astype(float)
+
+    def enumerate_support(self) -> list:
+        return [np.array(v) for v in itertools.product(self.base.enumerate_support(), repeat=self.n)]
     
     def __repr__(self) -> str:
         return f"IID({self.base}, {self.n})"
     
+# base with array parameters, scored against a value of the broadcast shape
 class Broadcasted(Distribution):
     def __init__(self, base: Distribution) -> None:
         self.base = base
+        self.event_dim = base.event_dim
 
-    def sample(self, size=None):
-        return self.base.sample(size=size)
+    def sample(self, size=None, rng=None):
+        return self.base.sample(size=size, rng=rng)
     
     def _logprob(self, value):
         return self.base._logprob(value)
@@ -60,21 +336,22 @@ class Dirac(Distribution):
     def __init__(self, value):
         self.value = value
 
-    def sample(self, size=None):
+    def sample(self, size=None, rng=None):
         if size is None:
             return self.value
         return np.full(size, self.value)
 
     def _logprob(self, value):
-        if isinstance(value, np.ndarray):
-            lp = np.zeros(value.shape)
-            lp[value != self.value] = -np.inf
-            return lp
+        if isinstance(value, np.ndarray) or isinstance(self.value, np.ndarray):
+            return np.where(value == self.value, 0., -np.inf)
 
         if value == self.value:
             return 0.
         else:
             return -np.inf
+
+    def enumerate_support(self) -> list:
+        return [self.value]
         
     def __repr__(self):
         return f"Dirac(value={self.value})"
@@ -83,11 +360,24 @@ class Beta(Distribution):
     def __init__(self, a, b):
         self.a = a
         self.b = b
-
-    def sample(self, size=None):
-        return stats.beta.rvs(a=self.a, b=self.b, size=size)
+        self._fast = type(self.a) in _REAL_TYPES and type(self.b) in _REAL_TYPES and self.a > 0 and self.b > 0
+        if self._fast:
+            self._lnorm = math.lgamma(self.a + self.b) - math.lgamma(self.a) - math.lgamma(self.b)
+        self._dual = type(self.a) is Dual or type(self.b) is Dual
+
+    def sample(self, size=None, rng=None):
+        if rng is None:
+            rng = _rng()
+        if self._fast:
+            return rng.beta(self.a, self.b, size)
+        return stats.beta.rvs(a=self.a, b=self.b, size=size, random_state=rng)
 
     def _logprob(self, value):
+        if self._fast and type(value) in _REAL_TYPES and (0 < value < 1):
+            return (self.a - 1) * math.log(value) + (self.b - 1) * math.log1p(-value) + self._lnorm
+        if self._dual or type(value) is Dual or self._fast and type(value) is np.ndarray:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return _where_support((value >= 0) & (value <= 1), special.xlogy(self.a - 1, value) + special.xlog1py(self.b - 1, -value) + special.gammaln(self.a + self.b) - special.gammaln(self.a) - special.gammaln(self.b))
         return stats.beta.logpdf(value, a=self.a, b=self.b)
 
     def __repr__(self):
@@ -97,11 +387,23 @@ class Cauchy(Distribution):
     def __init__(self, loc, scale):
         self.loc = loc
         self.scale = scale
-
-    def sample(self, size=None):
-        return stats.cauchy.rvs(loc=self.loc, scale=self.scale, size=size)
+        self._fast = type(self.loc) in _REAL_TYPES and type(self.scale) in _REAL_TYPES and self.scale > 0
+        if self._fast:
+            self._lnorm = -math.log(math.pi * self.scale)
+        self._dual = type(self.loc) is Dual or type(self.scale) is Dual
+
+    def sample(self, size=None, rng=None):
+        if rng is None:
+            rng = _rng()
+        if self._fast:
+            return self.loc + self.scale * rng.standard_cauchy(size)
+        return stats.cauchy.rvs(loc=self.loc, scale=self.scale, size=size, random_state=rng)
 
     def _logprob(self, value):
+        if self._fast and type(value) in _REAL_TYPES:
+            return self._lnorm - math.log1p(((value - self.loc) / self.scale) ** 2)
+        if self._dual or type(value) is Dual or self._fast and type(value) is np.ndarray:
+            return -np.log(np.pi * self.scale) - np.log1p(((value - self.loc) / self.scale) ** 2)
         return stats.cauchy.logpdf(value, loc=self.loc, scale=self.scale)
 
     def __repr__(self):
@@ -110,11 +412,24 @@ class Cauchy(Distribution):
 class Exponential(Distribution):
     def __init__(self, rate):
         self.scale = 1 / rate
-
-    def sample(self, size=None):
-        return stats.expon.rvs(scale=self.scale, size=size)
+        self._fast = type(self.scale) in _REAL_TYPES and self.scale > 0
+        if self._fast:
+            self._lnorm = -math.log(self.scale)
+        self._dual = type(self.scale) is Dual
+
+    def sample(self, size=None, rng=None):
+        if rng is None:
+            rng = _rng()
+        if self._fast:
+            return rng.exponential(self.scale, size)
+        return stats.expon.rvs(scale=self.scale, size=size, random_state=rng)
 
     def _logprob(self, value):
+        if self._fast and type(value) in _REAL_TYPES and (value >= 0):
+            return self._lnorm - value / self.scale
+        if self._dual or type(value) is Dual or self._fast and type(value) is np.ndarray:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return _where_support(value >= 0, -np.log(self.scale) - value / self.scale)
         return stats.expon.logpdf(value, scale=self.scale)
 
     def __repr__(self):
@@ -124,11 +439,24 @@ class Gamma(Distribution):
     def __init__(self, alpha, beta):
         self.a = alpha
         self.scale = 1 / beta
-
-    def sample(self, size=None):
-        return stats.gamma.rvs(a=self.a, scale=self.scale, size=size)
+        self._fast = type(self.a) in _REAL_TYPES and type(self.scale) in _REAL_TYPES and self.a > 0 and self.scale > 0
+        if self._fast:
+            self._lnorm = -math.lgamma(self.a) - self.a * math.log(self.scale)
+        self._dual = type(self.a) is Dual or type(self.scale) is Dual
+
+    def sample(self, size=None, rng=None):
+        if rng is None:
+            rng = _rng()
+        if self._fast:
+            return rng.gamma(self.a, self.scale, size)
+        return stats.gamma.rvs(a=self.a, scale=self.scale, size=size, random_state=rng)
 
     def _logprob(self, value):
+        if self._fast and type(value) in _REAL_TYPES and (value > 0):
+            return (self.a - 1) * math.log(value) - value / self.scale + self._lnorm
+        if self._dual or type(value) is Dual or self._fast and type(value) is np.ndarray:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return _where_support(value >= 0, special.xlogy(self.a - 1, value) - value / self.scale - special.gammaln(self.a) - self.a * np.log(self.scale))
         return stats.gamma.logpdf(value, a=self.a, scale=self.scale)
 
     def __repr__(self):
@@ -138,11 +466,24 @@ class HalfCauchy(Distribution):
     def __init__(self, loc, scale):
         self.loc = loc
         self.scale = scale
-
-    def sample(self, size=None):
-        return stats.halfcauchy.rvs(loc=self.loc, scale=self.scale, size=size)
+        self._fast = type(self.loc) in _REAL_TYPES and type(self.scale) in _REAL_TYPES and self.scale > 0
+        if self._fast:
+            self._lnorm = math.log(2 / (math.pi * self.scale))
+        self._dual = type(self.loc) is Dual or type(self.scale) is Dual
+
+    def sample(self, size=None, rng=None):
+        if rng is None:
+            rng = _rng()
+        if self._fast:
+            return self.loc + self.scale * np.abs(rng.standard_cauchy(size))
+        return stats.halfcauchy.rvs(loc=self.loc, scale=self.scale, size=size, random_state=rng)
 
     def _logprob(self, value):
+        if self._fast and type(value) in _REAL_TYPES and (value >= self.loc):
+            return self._lnorm - math.log1p(((value - self.loc) / self.scale) ** 2)
+        if self._dual or type(value) is Dual or self._fast and type(value) is np.ndarray:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return _where_support(value >= self.loc, np.log(2 / (np.pi * self.scale)) - np.log1p(((value - self.loc) / self.scale) ** 2))
         return stats.halfcauchy.logpdf(value, loc=self.loc, scale=self.scale)
 
     def __repr__(self):
@@ -152,11 +493,24 @@ class HalfNormal(Distribution):
     def __init__(self, loc, scale):
         self.loc = loc
         self.scale = scale
-
-    def sample(self, size=None):
-        return stats.halfnorm.rvs(loc=self.loc, scale=self.scale, size=size)
+        self._fast = type(self.loc) in _REAL_TYPES and type(self.scale) in _REAL_TYPES and self.scale > 0
+        if self._fast:
+            self._lnorm = 0.5 * math.log(2 / math.pi) - math.log(self.scale)
+        self._dual = type(self.loc) is Dual or type(self.scale) is Dual
+
+    def sample(self, size=None, rng=None):
+        if rng is None:
+            rng = _rng()
+        if self._fast:
+            return self.loc + self.scale * np.abs(rng.standard_normal(size))
+        return stats.halfnorm.rvs(loc=self.loc, scale=self.scale, size=size, random_state=rng)
 
     def _logprob(self, value):
+        if self._fast and type(value) in _REAL_TYPES and (value >= self.loc):
+            return self._lnorm - 0.5 * ((value - self.loc) / self.scale) ** 2
+        if self._dual or type(value) is Dual or self._fast and type(value) is np.ndarray:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return _where_support(value >= self.loc, 0.5 * np.log(2 / np.pi) - np.log(self.scale) - 0.5 * ((value - self.loc) / self.scale) ** 2)
         return stats.halfnorm.logpdf(value, loc=self.loc, scale=self.scale)
 
     def __repr__(self):
@@ -166,11 +520,24 @@ class InverseGamma(Distribution):
     def __init__(self, alpha, beta):
         self.a = alpha
         self.scale = beta
-
-    def sample(self, size=None):
-        return stats.invgamma.rvs(a=self.a, scale=self.scale, size=size)
+        self._fast = type(self.a) in _REAL_TYPES and type(self.scale) in _REAL_TYPES and self.a > 0 and self.scale > 0
+        if self._fast:
+            self._lnorm = self.a * math.log(self.scale) - math.lgamma(self.a)
+        self._dual = type(self.a) is Dual or type(self.scale) is Dual
+
+    def sample(self, size=None, rng=None):
+        if rng is None:
+            rng = _rng()
+        if self._fast:
+            return self.scale / rng.gamma(self.a, 1., size)
+        return stats.invgamma.rvs(a=self.a, scale=self.scale, size=size, random_state=rng)
 
     def _logprob(self, value):
+        if self._fast and type(value) in _REAL_TYPES and (value > 0):
+            return self._lnorm - (self.a + 1) * math.log(value) - self.scale / value
+        if self._dual or type(value) is Dual or self._fast and type(value) is np.ndarray:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return _where_support(value > 0, self.a * np.log(self.scale) - special.gammaln(self.a) - (self.a + 1) * np.log(value) - self.scale / value)
         return stats.invgamma.logpdf(value, a=self.a, scale=self.scale)
 
     def __repr__(self):
@@ -180,11 +547,23 @@ class Normal(Distribution):
     def __init__(self, loc, scale):
         self.loc = loc
         self.scale = scale
-
-    def sample(self, size=None):
-        return stats.norm.rvs(loc=self.loc, scale=self.scale, size=size)
+        self._fast = type(self.loc) in _REAL_TYPES and type(self.scale) in _REAL_TYPES and self.scale > 0
+        if self._fast:
+            self._lnorm = -math.log(self.scale) - 0.5 * math.log(2 * math.pi)
+        self._dual = type(self.loc) is Dual or type(self.scale) is Dual
+
+    def sample(self, size=None, rng=None):
+        if rng is None:
+            rng = _rng()
+        if self._fast:
+            return rng.normal(self.loc, self.scale, size)
+        return stats.norm.rvs(loc=self.loc, scale=self.scale, size=size, random_state=rng)
 
     def _logprob(self, value):
+        if self._fast and type(value) in _REAL_TYPES:
+            return self._lnorm - 0.5 * ((value - self.loc) / self.scale) ** 2
+        if self._dual or type(value) is Dual or self._fast and type(value) is np.ndarray:
+            return -np.log(self.scale) - 0.5 * np.log(2 * np.pi) - 0.5 * ((value - self.loc) / self.scale) ** 2
         return stats.norm.logpdf(value, loc=self.loc, scale=self.scale)
 
     def __repr__(self):
@@ -193,11 +572,23 @@ class Normal(Distribution):
 class StudentT(Distribution):
     def __init__(self, df):
         self.df = df
-
-    def sample(self, size=None):
-        return stats.t.rvs(df=self.df, size=size)
+        self._fast = type(self.df) in _REAL_TYPES and self.df > 0
+        if self._fast:
+            self._lnorm = math.lgamma((self.df + 1) / 2) - math.lgamma(self.df / 2) - 0.5 * math.log(self.df * math.pi)
+        self._dual = type(self.df) is Dual
+
+    def sample(self, size=None, rng=None):
+        if rng is None:
+            rng = _rng()
+        if self._fast:
+            return rng.standard_t(self.df, size)
+        return stats.t.rvs(df=self.df, size=size, random_state=rng)
 
     def _logprob(self, value):
+        if self._fast and type(value) in _REAL_TYPES:
+            return self._lnorm - (self.df + 1) / 2 * math.log1p(value ** 2 / self.df)
+        if self._dual or type(value) is Dual or self._fast and type(value) is np.ndarray:
+            return special.gammaln((self.df + 1) / 2) - special.gammaln(self.df / 2) - 0.5 * np.log(self.df * np.pi) - (self.df + 1) / 2 * np.log1p(value ** 2 / self.df)
         return stats.t.logpdf(value, df=self.df)
 
     def __repr__(self):
@@ -207,11 +598,24 @@ class Uniform(Distribution):
     def __init__(self, low, high):
         self.loc = low
         self.scale = high - low
-
-    def sample(self, size=None):
-        return stats.uniform.rvs(loc=self.loc, scale=self.scale, size=size)
+        self._fast = type(self.loc) in _REAL_TYPES and type(self.scale) in _REAL_TYPES and self.scale > 0
+        if self._fast:
+            self._lnorm = -math.log(self.scale)
+        self._dual = type(self.loc) is Dual or type(self.scale) is Dual
+
+    def sample(self, size=None, rng=None):
+        if rng is None:
+            rng = _rng()
+        if self._fast:
+            return rng.uniform(self.loc, self.loc + self.scale, size)
+        return stats.uniform.rvs(loc=self.loc, scale=self.scale, size=size, random_state=rng)
 
     def _logprob(self, value):
+        if self._fast and type(value) in _REAL_TYPES and (self.loc <= value <= self.loc + self.scale):
+            return self._lnorm
+        if self._dual or type(value) is Dual or self._fast and type(value) is np.ndarray:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return _where_support((value >= self.loc) & (value <= self.loc + self.scale), 0. * value - np.log(self.scale))
         return stats.uniform.logpdf(value, loc=self.loc, scale=self.scale)
 
     def __repr__(self):
@@ -220,13 +624,30 @@ class Uniform(Distribution):
 class Bernoulli(Distribution):
     def __init__(self, p):
         self.p = p
-
-    def sample(self, size=None):
-        return stats.bernoulli.rvs(p=self.p, size=size)
+        self._fast = type(self.p) in _REAL_TYPES and 0 < self.p < 1
+        if self._fast:
+            self._log_p = math.log(self.p)
+            self._log_q = math.log1p(-self.p)
+        self._dual = type(self.p) is Dual
+
+    def sample(self, size=None, rng=None):
+        if rng is None:
+            rng = _rng()
+        if self._fast:
+            return rng.binomial(1, self.p, size)
+        return stats.bernoulli.rvs(p=self.p, size=size, random_state=rng)
 
     def _logprob(self, value):
+        if self._fast and type(value) in _INT_TYPES and (value == 0 or value == 1):
+            return self._log_p if value else self._log_q
+        if self._dual or type(value) is Dual or self._fast and type(value) is np.ndarray:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return _where_support((value == 0) | (value == 1), value * np.log(self.p) + (1 - value) * np.log1p(-self.p))
         return stats.bernoulli.logpmf(value, p=self.p)
 
+    def enumerate_support(self):
+        return [0, 1]
+
     def __repr__(self):
         return "Bernoulli(" + f"p={self.p}" + ")"
 
@@ -234,13 +655,30 @@ class Binomial(Distribution):
     def __init__(self, n, p):
         self.n = n
         self.p = p
-
-    def sample(self, size=None):
-        return stats.binom.rvs(n=self.n, p=self.p, size=size)
+        self._fast = type(self.n) in _REAL_TYPES and type(self.p) in _REAL_TYPES and type(self.n) in _INT_TYPES and self.n >= 0 and 0 < self.p < 1
+        if self._fast:
+            self._log_p = math.log(self.p)
+            self._log_q = math.log1p(-self.p)
+        self._dual = type(self.n) is Dual or type(self.p) is Dual
+
+    def sample(self, size=None, rng=None):
+        if rng is None:
+            rng = _rng()
+        if self._fast:
+            return rng.binomial(self.n, self.p, size)
+        return stats.binom.rvs(n=self.n, p=self.p, size=size, random_state=rng)
 
     def _logprob(self, value):
+        if self._fast and type(value) in _INT_TYPES and (0 <= value <= self.n):
+            return _log_binom(self.n, value) + value * self._log_p + (self.n - value) * self._log_q
+        if self._dual or type(value) is Dual or self._fast and type(value) is np.ndarray:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return _where_support((value >= 0) & (value <= self.n) & (_primal(value) == np.floor(_primal(value))), special.gammaln(self.n + 1) - special.gammaln(value + 1) - special.gammaln(self.n - value + 1) + value * np.log(self.p) + (self.n - value) * np.log1p(-self.p))
         return stats.binom.logpmf(value, n=self.n, p=self.p)
 
+    def enumerate_support(self):
+        return list(range(int(self.n) + 1))
+
     def __repr__(self):
         return "Binomial(" + f"n={self.n}, p={self.p}" + ")"
 
@@ -248,24 +686,50 @@ class DiscreteUniform(Distribution):
     def __init__(self, low, high):
         self.low = low
         self.high = high + 1
+        self._fast = type(self.low) in _REAL_TYPES and type(self.high) in _REAL_TYPES and type(self.low) in _INT_TYPES and type(self.high) in _INT_TYPES and self.low < self.high
+        if self._fast:
+            self._lnorm = -math.log(self.high - self.low)
 
-    def sample(self, size=None):
-        return stats.randint.rvs(low=self.low, high=self.high, size=size)
+    def sample(self, size=None, rng=None):
+        if rng is None:
+            rng = _rng()
+        if self._fast:
+            return rng.integers(self.low, self.high, size)
+        return stats.randint.rvs(low=self.low, high=self.high, size=size, random_state=rng)
 
     def _logprob(self, value):
+        if self._fast and type(value) in _INT_TYPES and (self.low <= value < self.high):
+            return self._lnorm
         return stats.randint.logpmf(value, low=self.low, high=self.high)
 
+    def enumerate_support(self):
+        return list(range(int(self.low), int(self.high)))
+
     def __repr__(self):
         return "DiscreteUniform(" + f"low={self.low}, high={self.high}" + ")"
 
 class Geometric(Distribution):
     def __init__(self, p):
         self.p = p
-
-    def sample(self, size=None):
-        return stats.geom.rvs(p=self.p, size=size)
+        self._fast = type(self.p) in _REAL_TYPES and 0 < self.p < 1
+        if self._fast:
+            self._log_p = math.log(self.p)
+            self._log_q = math.log1p(-self.p)
+        self._dual = type(self.p) is Dual
+
+    def sample(self, size=None, rng=None):
+        if rng is None:
+            rng = _rng()
+        if self._fast:
+            return rng.geometric(self.p, size)
+        return stats.geom.rvs(p=self.p, size=size, random_state=rng)
 
     def _logprob(self, value):
+        if self._fast and type(value) in _INT_TYPES and (value >= 1):
+            return (value - 1) * self._log_q + self._log_p
+        if self._dual or type(value) is Dual or self._fast and type(value) is np.ndarray:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return _where_support((value >= 1) & (_primal(value) == np.floor(_primal(value))), (value - 1) * np.log1p(-self.p) + np.log(self.p))
         return stats.geom.logpmf(value, p=self.p)
 
     def __repr__(self):
@@ -276,51 +740,107 @@ class HyperGeometric(Distribution):
         self.M = M
         self.n = n
         self.N = N
+        self._fast = type(self.M) in _REAL_TYPES and type(self.n) in _REAL_TYPES and type(self.N) in _REAL_TYPES and type(self.M) in _INT_TYPES and type(self.n) in _INT_TYPES and type(self.N) in _INT_TYPES and 0 <= self.n <= self.M and 0 <= self.N <= self.M
+        if self._fast:
+            self._lnorm = -_log_binom(self.M, self.N)
 
-    def sample(self, size=None):
-        return stats.hypergeom.rvs(M=self.M, n=self.n, N=self.N, size=size)
+    def sample(self, size=None, rng=None):
+        if rng is None:
+            rng = _rng()
+        if self._fast:
+            return rng.hypergeometric(self.n, self.M - self.n, self.N, size)
+        return stats.hypergeom.rvs(M=self.M, n=self.n, N=self.N, size=size, random_state=rng)
 
     def _logprob(self, value):
+        if self._fast and type(value) in _INT_TYPES and (max(0, self.N - self.M + self.n) <= value <= min(self.n, self.N)):
+            return _log_binom(self.n, value) + _log_binom(self.M - self.n, self.N - value) + self._lnorm
         return stats.hypergeom.logpmf(value, M=self.M, n=self.n, N=self.N)
 
+    def enumerate_support(self):
+        return list(range(max(0, self.N - self.M + self.n), min(self.n, self.N) + 1))
+
     def __repr__(self):
         return "HyperGeometric(" + f"M={self.M}, n={self.n}, N={self.N}" + ")"
 
 class Poisson(Distribution):
     def __init__(self, rate):
         self.mu = rate
-
-    def sample(self, size=None):
-        return stats.poisson.rvs(mu=self.mu, size=size)
+        self._fast = type(self.mu) in _REAL_TYPES and self.mu > 0
+        if self._fast:
+            self._log_mu = math.log(self.mu)
+        self._dual = type(self.mu) is Dual
+
+    def sample(self, size=None, rng=None):
+        if rng is None:
+            rng = _rng()
+        if self._fast:
+            return rng.poisson(self.mu, size)
+        return stats.poisson.rvs(mu=self.mu, size=size, random_state=rng)
 
     def _logprob(self, value):
+        if self._fast and type(value) in _INT_TYPES and (value >= 0):
+            return value * self._log_mu - self.mu - math.lgamma(value + 1)
+        if self._dual or type(value) is Dual or self._fast and type(value) is np.ndarray:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return _where_support((value >= 0) & (_primal(value) == np.floor(_primal(value))), value * np.log(self.mu) - self.mu - special.gammaln(value + 1))
         return stats.poisson.logpmf(value, mu=self.mu)
 
     def __repr__(self):
         return "Poisson(" + f"mu={self.mu}" + ")"
 
 class Dirichlet(Distribution):
+    event_dim = 1
+
     def __init__(self, alpha):
         self.alpha = alpha
-
-    def sample(self, size=None):
-        return stats.dirichlet.rvs(alpha=self.alpha, size=size)
+        self._fast = type(self.alpha) is not Dual and np.ndim(self.alpha) == 1 and np.all(np.asarray(self.alpha) > 0)
+        if self._fast:
+            self._alpha = np.asarray(self.alpha, dtype=float)
+            self._lnorm = special.gammaln(self._alpha.sum()) - special.gammaln(self._alpha).sum()
+        self._dual = type(self.alpha) is Dual
+
+    def sample(self, size=None, rng=None):
+        if rng is None:
+            rng = _rng()
+        if self._fast:
+            return rng.dirichlet(self._alpha, size)
+        return stats.dirichlet.rvs(alpha=self.alpha, size=size, random_state=rng)
 
     def _logprob(self, value):
+        if self._fast and type(value) is not Dual and (np.shape(value)[-1:] == self._alpha.shape and _on_simplex(value)):
+            return np.log(value) @ (self._alpha - 1) + self._lnorm
+        if (self._dual or type(value) is Dual) and self._fast:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return _where_support(np.shape(value)[-1:] == self._alpha.shape and _on_simplex(_primal(value)), np.sum((self._alpha - 1) * np.log(value), axis=-1) + self._lnorm)
         return stats.dirichlet.logpdf(value, alpha=self.alpha)
 
     def __repr__(self):
         return "Dirichlet(" + f"alpha={self.alpha}" + ")"
 
 class MultivariateNormal(Distribution):
+    event_dim = 1
+
     def __init__(self, mean, cov):
         self.mean = mean
         self.cov = cov
-
-    def sample(self, size=None):
-        return stats.multivariate_normal.rvs(mean=self.mean, cov=self.cov, size=size)
+        self._fast = type(self.mean) is not Dual and type(self.cov) is not Dual and np.ndim(self.mean) == 1
+        if self._fast:
+            self._mean = np.asarray(self.mean, dtype=float)
+            self._chol = _cholesky(self.cov, len(self._mean))
+            self._lnorm = _mvn_lnorm(self._chol)
+        self._dual = type(self.mean) is Dual or type(self.cov) is Dual
+
+    def sample(self, size=None, rng=None):
+        if rng is None:
+            rng = _rng()
+        return stats.multivariate_normal.rvs(mean=self.mean, cov=self.cov, size=size, random_state=rng)
 
     def _logprob(self, value):
+        if self._fast and type(value) is not Dual and (self._chol is not None and np.shape(value)[-1:] == self._mean.shape):
+            return self._lnorm - 0.5 * _mahalanobis(self._chol, value - self._mean)
+        if self._dual or type(value) is Dual:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return _where_support(np.shape(value)[-1:] == np.shape(self.mean)[-1:], _mvn_logprob(self.mean, self.cov, value))
         return stats.multivariate_normal.logpdf(value, mean=self.mean, cov=self.cov)
 
     def __repr__(self):
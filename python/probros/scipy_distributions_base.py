@@ -1,52 +1,328 @@
+import contextlib
+import contextvars
+import itertools
+import math
+import operator
 import numpy as np
+import scipy.linalg as linalg
+import scipy.special as special
 import scipy.stats as stats
+from .dual import Dual, primal as _primal, where_support as _where_support
 
+# Random number generator used by all distributions (including the scipy
+# fallback). `set_rng(seed)` sets the process-wide default, `rng_scope(rng)`
+# overrides it for the current context (thread, asyncio task, or model run),
+# and all `sample` methods accept an explicit `rng` as well.
+_DEFAULT_RNG = np.random.default_rng()
+_RNG = contextvars.ContextVar("probros_rng", default=None)
+
+def _as_rng(rng) -> np.random.Generator:
+    return rng if isinstance(rng, np.random.Generator) else np.random.default_rng(rng)
+
+def set_rng(rng):
+    global _DEFAULT_RNG
+    _DEFAULT_RNG = _as_rng(rng)
+
+def _rng() -> np.random.Generator:
+    rng = _RNG.get()
+    return _DEFAULT_RNG if rng is None else rng
+
+# with rng_scope(seed): ... (rng=None keeps the current generator)
+@contextlib.contextmanager
+def rng_scope(rng):
+    if rng is None:
+        yield _rng()
+        return
+    token = _RNG.set(_as_rng(rng))
+    try:
+        yield _RNG.get()
+    finally:
+        _RNG.reset(token)
+
+# independent child streams, e.g. for parallel chains or particles
+def split_rng(rng, n: int) -> list:
+    return _as_rng(rng).spawn(n)
+
+# Parameter and value types for which the generated distributions take the
+# fast path (numpy sampling and closed-form log probabilities with `math`)
+# instead of going through scipy.stats.
+_REAL_TYPES = (float, int, np.float64, np.int64)
+_INT_TYPES = (int, bool, np.int64, np.bool_)
+
+def _log_binom(n, k):
+    return math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1)
+
+# all rows (last axis) of value lie on the simplex
+def _on_simplex(value) -> bool:
+    value = np.asarray(value)
+    return bool(np.all(value > 0)) and bool(np.all(np.abs(value.sum(axis=-1) - 1) < 1e-9))
+
+# lower Cholesky factor of a covariance given as scalar, diagonal, or matrix,
+# None if it is not positive definite
+def _cholesky(cov, d: int):
+    cov = np.asarray(cov, dtype=float)
+    if cov.ndim == 0:
+        cov = cov * np.eye(d)
+    elif cov.ndim == 1:
+        cov = np.diag(cov)
+    if cov.shape != (d, d):
+        return None
+    try:
+        return np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        return None
+
+# normalising constant -1/2 log det(2 pi cov) of a multivariate normal
+def _mvn_lnorm(chol):
+    if chol is None:
+        return None
+    return -np.log(np.diag(chol)).sum() - 0.5 * len(chol) * math.log(2 * math.pi)
+
+# squared Mahalanobis norm of x (..., d) with respect to cov = chol chol^T
+def _mahalanobis(chol, x):
+    x = np.asarray(x)
+    z = linalg.solve_triangular(chol, x.reshape(-1, len(chol)).T, lower=True)
+    return np.sum(z ** 2, axis=0).reshape(x.shape[:-1])
+
+# L^-1 x along the last axis of x, for Duals as well (as it is linear in x)
+def _solve_lower(chol, x):
+    if type(x) is Dual:
+        tangent = np.swapaxes(x.full_tangent(), -1, -2)
+        return Dual(_solve_lower(chol, x.value), np.swapaxes(_solve_lower(chol, tangent), -1, -2))
+    x = np.asarray(x)
+    return linalg.solve_triangular(chol, x.reshape(-1, len(chol)).T, lower=True).T.reshape(x.shape)
+
+# multivariate normal log density for a Dual value or mean (constant cov)
+def _mvn_logprob(mean, cov, value):
+    chol = _cholesky(cov, np.shape(mean)[-1])
+    if chol is None:
+        return -np.inf
+    return _mvn_lnorm(chol) - 0.5 * np.sum(_solve_lower(chol, value - mean) ** 2, axis=-1)
+
+# Per-particle values in batched execution (see Trace(batch_size=...)), i.e.
+# an ndarray whose leading axis is the particle axis. The draws of sample
+# statements are Batched, and so are the results of numpy operations on them,
+# e.g. mu + phi * y[t]. Values and parameters which are not Batched are shared
+# by all particles, e.g. observed data, whatever its shape.
+# Indexing selects from the value of each particle, i.e. the particle axis is
+# kept, e.g. beta[k] of a draw of IID(Normal(0, 1), K) is the k-th entry of
+# each particle. Batched integer indices select per particle, e.g. mu[z] with
+# mu of shape (n, K) and z of shape (n,), and so do Vectors and Arrays.
+# Numpy operations and functions take the whole arrays, i.e. broadcast with
+# the particle axis first.
+# Python control flow on per-particle values (if, while, and, or) and
+# indexing lists with them is not supported and raises a TypeError, e.g. use
+# np.where or a Vector instead.
+class Batched(np.ndarray):
+    def __getitem__(self, key):
+        if self.ndim == 0 or key is Ellipsis:
+            return super().__getitem__(key)
+        key = key if type(key) is tuple else (key,)
+        if self.ndim == 1 and key:
+            raise IndexError("A per-particle scalar value cannot be indexed.")
+        if not any(_is_batched(k) for k in key):
+            return super().__getitem__((slice(None),) + key)
+        key = tuple(_batched_index(k) if _is_batched(k) else k for k in key)
+        ndim = max(np.ndim(k) for k in key)
+        particles = np.arange(len(self)).reshape((-1,) + (1,) * (ndim - 1))
+        return super().__getitem__((particles,) + key)
+
+    # numpy functions, e.g. np.stack or np.where, take the whole arrays
+    def __array_function__(self, func, types, args, kwargs):
+        return _rewrap(func(*_unwrap(args), **_unwrap(kwargs)))
+
+    def __bool__(self):
+        if self.ndim == 0:
+            return bool(self.item())
+        raise TypeError("Python control flow on per-particle values is not supported in batched execution, e.g. use np.where.")
+
+    def __index__(self):
+        if self.ndim == 0:
+            return operator.index(self.item())
+        raise TypeError("Per-particle values can only index Vectors, Arrays, and arrays in batched execution.")
+
+    def __repr__(self) -> str:
+        return "Batched(" + np.array2string(self.view(np.ndarray), separator=", ") + ")"
+
+    def __str__(self) -> str:
+        return str(self.view(np.ndarray))
+
+def _is_batched(x) -> bool:
+    return isinstance(x, Batched) and x.ndim > 0
+
+def _unwrap(x):
+    if isinstance(x, Batched):
+        return x.view(np.ndarray)
+    if type(x) in (list, tuple):
+        return type(x)(_unwrap(v) for v in x)
+    if type(x) is dict:
+        return {k: _unwrap(v) for k, v in x.items()}
+    return x
+
+def _rewrap(x):
+    if type(x) is np.ndarray:
+        return x.view(Batched)
+    if type(x) in (list, tuple):
+        return type(x)(_rewrap(v) for v in x)
+    return x
+
+# per-particle index as an integer array, e.g. discrete draws stored in a float Vector
+def _batched_index(key) -> np.ndarray:
+    key = key.view(np.ndarray)
+    if key.dtype.kind == "f":
+        if not np.all(key == np.floor(key)):
+            raise IndexError("Per-particle indices are not integers.")
+        return key.astype(np.intp)
+    return key
+
+# lists, tuples, and other array-likes (e.g. Vector) as one ndarray, None if
+# they do not convert to a numeric array (e.g. ragged lists or lists of Duals).
+# With batched=True, entries which are Batched are stacked with the particle
+# axis first, i.e. into a Batched array of shape (n,) + shape of value + event
+# shape, shared entries are broadcast to all particles.
+def _as_array(value, batched: bool = False):
+    if batched and isinstance(value, (list, tuple)) and any(_is_batched(v) for v in value):
+        array = np.empty(len(value), object)
+        for i, v in enumerate(value):
+            array[i] = v
+    else:
+        array = np.asarray(value)
+    if array.dtype != object:
+        return array
+    try:
+        entries = array.ravel()
+        if batched and any(_is_batched(v) for v in entries):
+            shape = np.broadcast_shapes(*(np.shape(v) for v in entries))
+            stacked = np.stack([np.broadcast_to(v, shape) for v in entries], axis=1)
+            return stacked.reshape(shape[:1] + array.shape + shape[1:]).view(Batched)
+        # e.g. a Vector of Dirichlet draws
+        array = np.asarray(array.tolist())
+    except (ValueError, TypeError):
+        return None
+    return None if array.dtype == object else array
+
+# Shapes: the last `event_dim` axes of a value form one draw (e.g. the
+# k entries of a Dirichlet draw), all axes before are batch axes, which are
+# scored independently and broadcast against the parameters.
 class Distribution:
-    def sample(self, size=None):
+    event_dim = 0
+
+    def sample(self, size=None, rng=None):
         raise NotImplementedError
-    
+
+    # log probabilities of shape value.shape[:ndim - event_dim]
     def _logprob(self, value):
         raise NotImplementedError
 
+    # total log probability, lists and array-likes are converted once and
+    # scored in one vectorized call
     def logprob(self, value):
-        if isinstance(value, list):
-            return sum(self._logprob(v) for v in value)
-        elif isinstance(value, np.ndarray):
+        if isinstance(value, np.ndarray) or type(value) is Dual:
             return self._logprob(value).sum()
+        if isinstance(value, (list, tuple)) or hasattr(value, "__array__") and not np.isscalar(value):
+            array = _as_array(value)
+            if array is not None:
+                return self._logprob(array).sum()
+            return sum(self._logprob(v) for v in value)
+        return self._logprob(value)
+
+    # Batched execution: draws one value per particle, i.e. shape (n, ...)
+    def batch_sample(self, n: int, rng=None):
+        return self.sample(size=n, rng=rng)
+
+    # Per-particle log probabilities of shape (n,). If the value or a parameter
+    # is Batched, the leading axis of the log probabilities is the particle
+    # axis and all remaining axes are summed out. Otherwise the value is
+    # shared by all particles (e.g. an observed data set of any length).
+    def batch_logprob(self, value, n: int):
+        if isinstance(value, Batched):
+            batched = value.ndim > 0
+            value = value.view(np.ndarray)
         else:
-            return self._logprob(value)
+            if isinstance(value, (list, tuple)) or hasattr(value, "__array__") and not np.isscalar(value):
+                array = _as_array(value, batched=True)
+                value = np.asarray(value) if array is None else array
+            batched = _is_batched(value)
+            if batched:
+                value = value.view(np.ndarray)
+        batched = batched or self._batched()
+        lp = np.asarray(self._logprob(value))
+        if batched:
+            return lp.reshape(n, -1).sum(axis=1)
+        return np.full(n, lp.sum())
+
+    # some parameter is per-particle (see Batched)
+    def _batched(self) -> bool:
+        return any(_is_batched(v) or isinstance(v, Distribution) and v._batched() for v in vars(self).values())
+
+    # all values of a distribution with finite support, e.g. for enumeration
+    def enumerate_support(self) -> list:
+        raise ValueError(f"{self} does not have a finite support.")
         
+# n independent draws of base, stacked on the first axis of the value,
+# i.e. of shape (n, ...) + the event shape of base (see sample)
 class IID(Distribution):
     def __init__(self, base: Distribution, n: int) -> None:
         self.base = base
         self.n = n
+        self.event_dim = base.event_dim + 1
 
-    def sample(self, size=None):
+    def sample(self, size=None, rng=None):
         if size is not None:
             if isinstance(size, int):
-                return self.base.sample(size=(self.n,size))
+                return self.base.sample(size=(self.n,size), rng=rng)
             else:
                 assert isinstance(size, tuple)
-                return self.base.sample(size=(self.n,) + size)
+                return self.base.sample(size=(self.n,) + size, rng=rng)
         else:
-            return self.base.sample(size=self.n)
+            return self.base.sample(size=self.n, rng=rng)
     
+    def _logprob(self, value):
+        return self.base._logprob(value).sum(axis=0)
+
     def logprob(self, value) -> float:
-        if isinstance(value, np.ndarray):
-            return self.base.logprob(value).sum()
+        if not isinstance(value, np.ndarray) and type(value) is not Dual:
+            array = _as_array(value)
+            if array is None:
+                assert len(value) == self.n
+                return sum(self.base.logprob(value[i]) for i in range(self.n))
+            value = array
+        if len(value) != self.n:
+            raise ValueError(f"{self} expects {self.n} values, got {len(value)}.")
+        return self.base._logprob(value).sum()
+
+    def batch_sample(self, n: int, rng=None):
+        # base draws have shape (self.n, n, ...), particles go first
+        return np.swapaxes(self.base.sample(size=(self.n, n), rng=rng), 0, 1)
+
+    def batch_logprob(self, value, n: int):
+        # the iid axis goes first, then the particle axis (of length 1 if the
+        # value is shared), so that it broadcasts against per-particle
+        # parameters of the base distribution
+        if not isinstance(value, Batched):
+            array = _as_array(value, batched=True)
+            value = np.asarray(value) if array is None else array
+        if _is_batched(value):
+            value = np.swapaxes(value.view(np.ndarray), 0, 1)
         else:
-            assert isinstance(value, list) and len(value) == self.n
-            return sum(self.base.logprob(value[i]) for i in range(self.n))
+            value = np.asarray(value)[:, None]
+        lp = np.asarray(self.base._logprob(value)).sum(axis=0)
+        return np.broadcast_to(lp, (n,)).astype(float)
+
+    def enumerate_support(self) -> list:
+        return [np.array(v) for v in itertools.product(self.base.enumerate_support(), repeat=self.n)]
     
     def __repr__(self) -> str:
         return f"IID({self.base}, {self.n})"
     
+# base with array parameters, scored against a value of the broadcast shape
 class Broadcasted(Distribution):
     def __init__(self, base: Distribution) -> None:
         self.base = base
+        self.event_dim = base.event_dim
 
-    def sample(self, size=None):
-        return self.base.sample(size=size)
+    def sample(self, size=None, rng=None):
+        return self.base.sample(size=size, rng=rng)
     
     def _logprob(self, value):
         return self.base._logprob(value)
@@ -58,21 +334,22 @@ class Dirac(Distribution):
     def __init__(self, value):
         self.value = value
 
-    def sample(self, size=None):
+    def sample(self, size=None, rng=None):
         if size is None:
             return self.value
         return np.full(size, self.value)
 
     def _logprob(self, value):
-        if isinstance(value, np.ndarray):
-            lp = np.zeros(value.shape)
-            lp[value != self.value] = -np.inf
-            return lp
+        if isinstance(value, np.ndarray) or isinstance(self.value, np.ndarray):
+            return np.where(value == self.value, 0., -np.inf)
 
         if value == self.value:
             return 0.
         else:
             return -np.inf
+
+    def enumerate_support(self) -> list:
+        return [self.value]
         
     def __repr__(self):
         return f"Dirac(value={self.value})"
@@ -0,0 +1,44 @@
+# Per-call timings of the generated distributions, fast path vs. scipy.stats.
+# Run from the python directory with
+#   python -m probros.scipy_distributions_benchmark
+import copy
+import timeit
+import numpy as np
+from . import scipy_distributions as d
+
+# (distribution, value in its support)
+benchmarks = [
+    (d.Beta(2., 3.), 0.3),
+    (d.Cauchy(0., 1.), 0.3),
+    (d.Exponential(2.), 0.3),
+    (d.Gamma(2., 3.), 0.3),
+    (d.HalfCauchy(0., 1.), 0.3),
+    (d.HalfNormal(0., 1.), 0.3),
+    (d.InverseGamma(2., 3.), 0.3),
+    (d.Normal(0., 1.), 0.3),
+    (d.StudentT(3.), 0.3),
+    (d.Uniform(0., 1.), 0.3),
+    (d.Bernoulli(0.3), 1),
+    (d.Binomial(10, 0.3), 3),
+    (d.DiscreteUniform(1, 6), 3),
+    (d.Geometric(0.3), 3),
+    (d.HyperGeometric(20, 7, 12), 3),
+    (d.Poisson(3.), 3),
+    (d.Dirichlet([1., 2., 3.]), np.array([0.2, 0.3, 0.5])),
+    (d.MultivariateNormal([0., 0., 0.], np.eye(3)), np.array([0.1, 0.2, 0.3])),
+]
+
+def per_call_us(f, number: int) -> float:
+    return min(timeit.repeat(f, number=number, repeat=5)) / number * 1e6
+
+if __name__ == "__main__":
+    number = 2000
+    print(f"{'distribution':<16} {'sample scipy':>13} {'sample fast':>12} {'speedup':>8} {'logprob scipy':>14} {'logprob fast':>13} {'speedup':>8}")
+    for fast, value in benchmarks:
+        slow = copy.copy(fast)
+        slow._fast = False
+        s_slow = per_call_us(slow.sample, number)
+        s_fast = per_call_us(fast.sample, number)
+        l_slow = per_call_us(lambda: slow.logprob(value), number)
+        l_fast = per_call_us(lambda: fast.logprob(value), number)
+        print(f"{type(fast).__name__:<16} {s_slow:>11.2f}us {s_fast:>10.2f}us {s_slow / s_fast:>7.1f}x {l_slow:>12.2f}us {l_fast:>11.2f}us {l_slow / l_fast:>7.1f}x")
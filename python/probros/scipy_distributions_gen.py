@@ -131,25 +131,318 @@ distributions = [
     ]
 ]
 
+# Fast paths, in terms of the internal parameters:
+#   condition: parameters for which the fast path is valid (unless `array` is set,
+#              the parameters also have to be scalars, and never Duals)
+#   constants: parameter-only terms, computed once at construction (fast path only)
+#   sample:    draw with the numpy.random.Generator `rng` (optional)
+#   support:   values for which `logprob` is valid ("True" if unrestricted), others fall back to scipy
+#   logprob:   closed-form log density/mass of a `value` using `math` (scalars) or numpy (`array`)
+# Distributions without an entry always use scipy.
+fast_paths = {
+    "Beta": {
+        "condition": "self.a > 0 and self.b > 0",
+        "constants": {"_lnorm": "math.lgamma(self.a + self.b) - math.lgamma(self.a) - math.lgamma(self.b)"},
+        "sample": "rng.beta(self.a, self.b, size)",
+        "support": "0 < value < 1",
+        "logprob": "(self.a - 1) * math.log(value) + (self.b - 1) * math.log1p(-value) + self._lnorm",
+    },
+    "Cauchy": {
+        "condition": "self.scale > 0",
+        "constants": {"_lnorm": "-math.log(math.pi * self.scale)"},
+        "sample": "self.loc + self.scale * rng.standard_cauchy(size)",
+        "support": "True",
+        "logprob": "self._lnorm - math.log1p(((value - self.loc) / self.scale) ** 2)",
+    },
+    "Exponential": {
+        "condition": "self.scale > 0",
+        "constants": {"_lnorm": "-math.log(self.scale)"},
+        "sample": "rng.exponential(self.scale, size)",
+        "support": "value >= 0",
+        "logprob": "self._lnorm - value / self.scale",
+    },
+    "Gamma": {
+        "condition": "self.a > 0 and self.scale > 0",
+        "constants": {"_lnorm": "-math.lgamma(self.a) - self.a * math.log(self.scale)"},
+        "sample": "rng.gamma(self.a, self.scale, size)",
+        "support": "value > 0",
+        "logprob": "(self.a - 1) * math.log(value) - value / self.scale + self._lnorm",
+    },
+    "HalfCauchy": {
+        "condition": "self.scale > 0",
+        "constants": {"_lnorm": "math.log(2 / (math.pi * self.scale))"},
+        "sample": "self.loc + self.scale * np.abs(rng.standard_cauchy(size))",
+        "support": "value >= self.loc",
+        "logprob": "self._lnorm - math.log1p(((value - self.loc) / self.scale) ** 2)",
+    },
+    "HalfNormal": {
+        "condition": "self.scale > 0",
+        "constants": {"_lnorm": "0.5 * math.log(2 / math.pi) - math.log(self.scale)"},
+        "sample": "self.loc + self.scale * np.abs(rng.standard_normal(size))",
+        "support": "value >= self.loc",
+        "logprob": "self._lnorm - 0.5 * ((value - self.loc) / self.scale) ** 2",
+    },
+    "InverseGamma": {
+        "condition": "self.a > 0 and self.scale > 0",
+        "constants": {"_lnorm": "self.a * math.log(self.scale) - math.lgamma(self.a)"},
+        "sample": "self.scale / rng.gamma(self.a, 1., size)",
+        "support": "value > 0",
+        "logprob": "self._lnorm - (self.a + 1) * math.log(value) - self.scale / value",
+    },
+    "Normal": {
+        "condition": "self.scale > 0",
+        "constants": {"_lnorm": "-math.log(self.scale) - 0.5 * math.log(2 * math.pi)"},
+        "sample": "rng.normal(self.loc, self.scale, size)",
+        "support": "True",
+        "logprob": "self._lnorm - 0.5 * ((value - self.loc) / self.scale) ** 2",
+    },
+    "StudentT": {
+        "condition": "self.df > 0",
+        "constants": {"_lnorm": "math.lgamma((self.df + 1) / 2) - math.lgamma(self.df / 2) - 0.5 * math.log(self.df * math.pi)"},
+        "sample": "rng.standard_t(self.df, size)",
+        "support": "True",
+        "logprob": "self._lnorm - (self.df + 1) / 2 * math.log1p(value ** 2 / self.df)",
+    },
+    "Uniform": {
+        "condition": "self.scale > 0",
+        "constants": {"_lnorm": "-math.log(self.scale)"},
+        "sample": "rng.uniform(self.loc, self.loc + self.scale, size)",
+        "support": "self.loc <= value <= self.loc + self.scale",
+        "logprob": "self._lnorm",
+    },
+    "Bernoulli": {
+        "condition": "0 < self.p < 1",
+        "constants": {"_log_p": "math.log(self.p)", "_log_q": "math.log1p(-self.p)"},
+        "sample": "rng.binomial(1, self.p, size)",
+        "support": "value == 0 or value == 1",
+        "logprob": "self._log_p if value else self._log_q",
+    },
+    "Binomial": {
+        "condition": "type(self.n) in _INT_TYPES and self.n >= 0 and 0 < self.p < 1",
+        "constants": {"_log_p": "math.log(self.p)", "_log_q": "math.log1p(-self.p)"},
+        "sample": "rng.binomial(self.n, self.p, size)",
+        "support": "0 <= value <= self.n",
+        "logprob": "_log_binom(self.n, value) + value * self._log_p + (self.n - value) * self._log_q",
+    },
+    "DiscreteUniform": {
+        "condition": "type(self.low) in _INT_TYPES and type(self.high) in _INT_TYPES and self.low < self.high",
+        "constants": {"_lnorm": "-math.log(self.high - self.low)"},
+        "sample": "rng.integers(self.low, self.high, size)",
+        "support": "self.low <= value < self.high",
+        "logprob": "self._lnorm",
+    },
+    "Geometric": {
+        "condition": "0 < self.p < 1",
+        "constants": {"_log_p": "math.log(self.p)", "_log_q": "math.log1p(-self.p)"},
+        "sample": "rng.geometric(self.p, size)",
+        "support": "value >= 1",
+        "logprob": "(value - 1) * self._log_q + self._log_p",
+    },
+    "HyperGeometric": {
+        "condition": "type(self.M) in _INT_TYPES and type(self.n) in _INT_TYPES and type(self.N) in _INT_TYPES and 0 <= self.n <= self.M and 0 <= self.N <= self.M",
+        "constants": {"_lnorm": "-_log_binom(self.M, self.N)"},
+        "sample": "rng.hypergeometric(self.n, self.M - self.n, self.N, size)",
+        "support": "max(0, self.N - self.M + self.n) <= value <= min(self.n, self.N)",
+        "logprob": "_log_binom(self.n, value) + _log_binom(self.M - self.n, self.N - value) + self._lnorm",
+    },
+    "Poisson": {
+        "condition": "self.mu > 0",
+        "constants": {"_log_mu": "math.log(self.mu)"},
+        "sample": "rng.poisson(self.mu, size)",
+        "support": "value >= 0",
+        "logprob": "value * self._log_mu - self.mu - math.lgamma(value + 1)",
+    },
+    "Dirichlet": {
+        "array": True,
+        "condition": "np.ndim(self.alpha) == 1 and np.all(np.asarray(self.alpha) > 0)",
+        "constants": {
+            "_alpha": "np.asarray(self.alpha, dtype=float)",
+            "_lnorm": "special.gammaln(self._alpha.sum()) - special.gammaln(self._alpha).sum()",
+        },
+        "sample": "rng.dirichlet(self._alpha, size)",
+        "support": "np.shape(value)[-1:] == self._alpha.shape and _on_simplex(value)",
+        "logprob": "np.log(value) @ (self._alpha - 1) + self._lnorm",
+    },
+    "MultivariateNormal": {
+        "array": True,
+        "condition": "np.ndim(self.mean) == 1",
+        "constants": {
+            "_mean": "np.asarray(self.mean, dtype=float)",
+            "_chol": "_cholesky(self.cov, len(self._mean))",
+            "_lnorm": "_mvn_lnorm(self._chol)",
+        },
+        "support": "self._chol is not None and np.shape(value)[-1:] == self._mean.shape",
+        "logprob": "self._lnorm - 0.5 * _mahalanobis(self._chol, value - self._mean)",
+    },
+}
+
+# Vectorized log densities, in terms of the internal parameters, written with
+# numpy/scipy ufuncs only and elementwise (over the batch axes), so they hold
+# for arrays of values and parameters and for dual numbers (see Dual). Used
+# if a parameter or the value is a Dual, e.g. to differentiate the log joint
+# with respect to the sampled addresses, and for array values with fast path
+# parameters, which saves the overhead of scipy.stats:
+#   condition: parameters for which the vectorized path is valid (optional)
+#   support:   elementwise mask of the values with positive probability
+#   logprob:   log density/mass, only used where `support` holds
+# Distributions without an entry do not support dual numbers.
+vectorized_logprobs = {
+    "Beta": {
+        "support": "(value >= 0) & (value <= 1)",
+        "logprob": "special.xlogy(self.a - 1, value) + special.xlog1py(self.b - 1, -value) + special.gammaln(self.a + self.b) - special.gammaln(self.a) - special.gammaln(self.b)",
+    },
+    "Cauchy": {
+        "support": "True",
+        "logprob": "-np.log(np.pi * self.scale) - np.log1p(((value - self.loc) / self.scale) ** 2)",
+    },
+    "Exponential": {
+        "support": "value >= 0",
+        "logprob": "-np.log(self.scale) - value / self.scale",
+    },
+    "Gamma": {
+        "support": "value >= 0",
+        "logprob": "special.xlogy(self.a - 1, value) - value / self.scale - special.gammaln(self.a) - self.a * np.log(self.scale)",
+    },
+    "HalfCauchy": {
+        "support": "value >= self.loc",
+        "logprob": "np.log(2 / (np.pi * self.scale)) - np.log1p(((value - self.loc) / self.scale) ** 2)",
+    },
+    "HalfNormal": {
+        "support": "value >= self.loc",
+        "logprob": "0.5 * np.log(2 / np.pi) - np.log(self.scale) - 0.5 * ((value - self.loc) / self.scale) ** 2",
+    },
+    "InverseGamma": {
+        "support": "value > 0",
+        "logprob": "self.a * np.log(self.scale) - special.gammaln(self.a) - (self.a + 1) * np.log(value) - self.scale / value",
+    },
+    "Normal": {
+        "support": "True",
+        "logprob": "-np.log(self.scale) - 0.5 * np.log(2 * np.pi) - 0.5 * ((value - self.loc) / self.scale) ** 2",
+    },
+    "StudentT": {
+        "support": "True",
+        "logprob": "special.gammaln((self.df + 1) / 2) - special.gammaln(self.df / 2) - 0.5 * np.log(self.df * np.pi) - (self.df + 1) / 2 * np.log1p(value ** 2 / self.df)",
+    },
+    "Uniform": {
+        "support": "(value >= self.loc) & (value <= self.loc + self.scale)",
+        "logprob": "0. * value - np.log(self.scale)",
+    },
+    "Bernoulli": {
+        "support": "(value == 0) | (value == 1)",
+        "logprob": "value * np.log(self.p) + (1 - value) * np.log1p(-self.p)",
+    },
+    "Binomial": {
+        "support": "(value >= 0) & (value <= self.n) & (_primal(value) == np.floor(_primal(value)))",
+        "logprob": "special.gammaln(self.n + 1) - special.gammaln(value + 1) - special.gammaln(self.n - value + 1) + value * np.log(self.p) + (self.n - value) * np.log1p(-self.p)",
+    },
+    "Geometric": {
+        "support": "(value >= 1) & (_primal(value) == np.floor(_primal(value)))",
+        "logprob": "(value - 1) * np.log1p(-self.p) + np.log(self.p)",
+    },
+    "Poisson": {
+        "support": "(value >= 0) & (_primal(value) == np.floor(_primal(value)))",
+        "logprob": "value * np.log(self.mu) - self.mu - special.gammaln(value + 1)",
+    },
+    "Dirichlet": {
+        "condition": "self._fast",
+        "support": "np.shape(value)[-1:] == self._alpha.shape and _on_simplex(_primal(value))",
+        "logprob": "np.sum((self._alpha - 1) * np.log(value), axis=-1) + self._lnorm",
+    },
+    "MultivariateNormal": {
+        "support": "np.shape(value)[-1:] == np.shape(self.mean)[-1:]",
+        "logprob": "_mvn_logprob(self.mean, self.cov, value)",
+    },
+}
+
+# Number of trailing axes of a value that form one draw (see Distribution.event_dim),
+# 0 if not listed
+event_dims = {
+    "Dirichlet": 1,
+    "MultivariateNormal": 1,
+}
+
+# Finite supports (in terms of the internal parameters), see Distribution.enumerate_support
+finite_supports = {
+    "Bernoulli": "[0, 1]",
+    "Binomial": "list(range(int(self.n) + 1))",
+    "DiscreteUniform": "list(range(int(self.low), int(self.high)))",
+    "HyperGeometric": "list(range(max(0, self.N - self.M + self.n), min(self.n, self.N) + 1))",
+}
+
 def generate(name, scipy_stats_class, params, internal_param_map, t):
     tab = " "*4
     s = f"class {name}(Distribution):\n"
+    if name in event_dims:
+        s += f"{tab}event_dim = {event_dims[name]}\n\n"
     init_params = ", ".join(params)
     s += f"{tab}def __init__(self, {init_params}):\n"
     for p, expr in internal_param_map.items():
         s += f"{tab}{tab}self.{p} = {expr}\n"
 
+    fast = fast_paths.get(name)
+    if fast is not None:
+        condition = fast["condition"]
+        if not fast.get("array", False):
+            scalars = " and ".join(f"type(self.{k}) in _REAL_TYPES" for k in internal_param_map)
+            condition = f"{scalars} and {condition}"
+        else:
+            not_dual = " and ".join(f"type(self.{k}) is not Dual" for k in internal_param_map)
+            condition = f"{not_dual} and {condition}"
+        s += f"{tab}{tab}self._fast = {condition}\n"
+        s += f"{tab}{tab}if self._fast:\n"
+        for c, expr in fast["constants"].items():
+            s += f"{tab}{tab}{tab}self.{c} = {expr}\n"
+
+    vectorized = vectorized_logprobs.get(name)
+    if vectorized is not None:
+        params_dual = " or ".join(f"type(self.{k}) is Dual" for k in internal_param_map)
+        s += f"{tab}{tab}self._dual = {params_dual}\n"
+
     internal_params = ", ".join(k + "=self." + k for k,_ in internal_param_map.items())
     s += "\n"
-    s += f"{tab}def sample(self, size=None):\n"
-    s += f"{tab}{tab}return {scipy_stats_class}.rvs({internal_params}, size=size)\n"
+    s += f"{tab}def sample(self, size=None, rng=None):\n"
+    s += f"{tab}{tab}if rng is None:\n"
+    s += f"{tab}{tab}{tab}rng = _rng()\n"
+    if fast is not None and "sample" in fast:
+        s += f"{tab}{tab}if self._fast:\n"
+        s += f"{tab}{tab}{tab}return {fast['sample']}\n"
+    s += f"{tab}{tab}return {scipy_stats_class}.rvs({internal_params}, size=size, random_state=rng)\n"
 
     lp = "logpmf" if t == "discrete" else "logpdf" 
 
     s += "\n"
     s += f"{tab}def _logprob(self, value):\n"
+    if fast is not None:
+        value_types = "_INT_TYPES" if t == "discrete" else "_REAL_TYPES"
+        condition = "self._fast"
+        if not fast.get("array", False):
+            condition += f" and type(value) in {value_types}"
+        else:
+            condition += " and type(value) is not Dual"
+        if fast["support"] != "True":
+            condition += f" and ({fast['support']})"
+        s += f"{tab}{tab}if {condition}:\n"
+        s += f"{tab}{tab}{tab}return {fast['logprob']}\n"
+    if vectorized is not None:
+        condition = "self._dual or type(value) is Dual"
+        if fast is not None and not fast.get("array", False):
+            condition += " or self._fast and type(value) is np.ndarray"
+        if "condition" in vectorized:
+            condition = f"({condition}) and {vectorized['condition']}"
+        s += f"{tab}{tab}if {condition}:\n"
+        if vectorized["support"] == "True":
+            s += f"{tab}{tab}{tab}return {vectorized['logprob']}\n"
+        else:
+            s += f"{tab}{tab}{tab}with np.errstate(divide=\"ignore\", invalid=\"ignore\"):\n"
+            s += f"{tab}{tab}{tab}{tab}return _where_support({vectorized['support']}, {vectorized['logprob']})\n"
     s += f"{tab}{tab}return {scipy_stats_class}.{lp}(value, {internal_params})\n"
 
+    support = finite_supports.get(name)
+    if support is not None:
+        s += "\n"
+        s += f"{tab}def enumerate_support(self):\n"
+        s += f"{tab}{tab}return {support}\n"
+
     s += "\n"
     s += f"{tab}def __repr__(self):\n"
     fstr = "f\"" + ", ".join(k + "={self." + k + "}" for k,_ in internal_param_map.items()) + "\""
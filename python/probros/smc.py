@@ -0,0 +1,182 @@
+from .scipy_distributions import _rng, rng_scope
+from .sample import Trace, execute
+from .importance import RESAMPLING, WeightedSamples, _collect, _stack, effective_sample_size
+from .incremental import incremental_program
+from .marginalize import _run_top
+import numpy as np
+from scipy.special import logsumexp
+
+# Sequential Monte Carlo (bootstrap particle filter) with the observe
+# statements of the model as checkpoints.
+# Python frames cannot be copied, so a particle can not be paused and forked
+# at an observe statement. Instead, in round k every particle re-executes the
+# model up to its k-th observe statement (see Trace(checkpoint=k)), replaying
+# the choices of its ancestor, so that only the addresses after the previous
+# checkpoint are drawn from the prior. The weight increment is the likelihood
+# of the observe (and factor) statements since the previous checkpoint.
+# Particles are resampled when the effective sample size drops below
+# ess_threshold * n_particles. The rounds end when all runs have finished.
+# As round k re-executes the model up to observe k, a model with T observe
+# statements costs O(T^2 * n_particles) statement executions.
+# Models whose loops have independent iterations (see incremental_program),
+# e.g. mixture models, are resumed instead of re-executed: the statements
+# outside of the loops are the first round, and each loop iteration is one
+# round, in which only the loop body of each particle runs, i.e. O(T * n_particles).
+# Loops whose iterations depend on the previous one (e.g. state space models)
+# are re-executed, as the state of a particle cannot be copied at resampling.
+#   batched:    run all particles of a round as one batched model run (see
+#               Trace(batch_size=...)), the model has to support batched execution
+#   resampling: "systematic", "stratified", or "multinomial"
+#   incremental: resume particles per loop iteration if the model's loops
+#               have independent iterations, instead of re-executing it
+# The result holds the weighted choices of the final particles (and their
+# traces if re-executed), and its log_marginal_likelihood is the SMC estimate
+# of the log evidence.
+# e.g.
+#   posterior = SequentialMonteCarlo(model, 1_000).run(y)
+#   posterior.log_marginal_likelihood, posterior.mean(IndexedAddress("s", 9))
+class SequentialMonteCarlo:
+    def __init__(self, model, n_particles: int, ess_threshold: float = 0.5, resampling: str = "systematic", batched: bool = False, seed=None, incremental: bool = True) -> None:
+        self.model = model
+        self.n_particles = n_particles
+        self.ess_threshold = ess_threshold
+        self.resampling = resampling
+        self.batched = batched
+        self.seed = seed
+        self.incremental = incremental
+
+    # runs all particles up to the k-th observe statement,
+    # returns the traces and the log likelihoods of the particles
+    def _round(self, k: int, replay, args, kwargs) -> tuple:
+        if self.batched:
+            trace = Trace(batch_size=self.n_particles, keep_distributions=False, replay=replay, checkpoint=k)
+            execute(self.model, trace, *args, **kwargs)
+            return [trace], np.asarray(trace.log_likelihood, dtype=float)
+        traces = []
+        for choices in replay:
+            trace = Trace(keep_distributions=False, replay=choices, checkpoint=k)
+            execute(self.model, trace, *args, **kwargs)
+            traces.append(trace)
+        return traces, np.array([t.log_likelihood for t in traces])
+
+    # resamples if the effective sample size is too low, returns the
+    # ancestor indices (or None) and the new log weights
+    def _resample(self, log_weights) -> tuple:
+        n = self.n_particles
+        if effective_sample_size(log_weights) >= self.ess_threshold * n:
+            return None, log_weights
+        weights = np.exp(log_weights - logsumexp(log_weights))
+        index = RESAMPLING[self.resampling](weights, n, _rng())
+        return index, np.full(n, logsumexp(log_weights) - np.log(n))
+
+    # SMC over the loop iterations of an incremental program. The loop bodies
+    # only assign temporaries and per-iteration entries, which are not read by
+    # other iterations, so the descendants of a particle share its loop bodies
+    # (unbatched), or the top level is run again with the resampled choices
+    # to get new loop bodies (batched).
+    # The rounds of each particle, a list of choices (unbatched) or one dict
+    # of per-particle choices (batched) per round, and the ancestor indices of
+    # each resampling are kept to collect the choices at the end.
+    def _run_loops(self, program, args, kwargs) -> WeightedSamples:
+        n = self.n_particles
+        history = []
+        if self.batched:
+            top = Trace(batch_size=n, keep_distributions=False)
+            segments = _run_top(program, top, args, kwargs)
+            log_weights = np.asarray(top.log_likelihood, dtype=float)
+            rounds = [(loop, i) for loop in sorted(segments.iterations) for i in segments.iterations[loop]]
+            for loop, i in rounds:
+                if np.all(log_weights == -np.inf):
+                    break
+                index, log_weights = self._resample(log_weights)
+                if index is not None:
+                    history.append(index)
+                    choices = {address: np.asarray(values)[index] for address, values in top.choices().items()}
+                    top = Trace(batch_size=n, keep_distributions=False, replay=choices)
+                    segments = _run_top(program, top, args, kwargs)
+                trace = Trace(batch_size=n, keep_distributions=False)
+                execute(segments.bodies[loop], trace, i)
+                history.append(trace.choices())
+                log_weights = log_weights + trace.log_likelihood
+            final = top.choices()
+        else:
+            tops = []
+            for _ in range(n):
+                top = Trace(keep_distributions=False)
+                segments = _run_top(program, top, args, kwargs)
+                rounds = [(loop, i) for loop in sorted(segments.iterations) for i in segments.iterations[loop]]
+                tops.append((top, segments.bodies, rounds))
+            log_weights = np.array([top.log_likelihood for top, _, _ in tops])
+            for k in range(max(len(rounds) for _, _, rounds in tops)):
+                if np.all(log_weights == -np.inf):
+                    break
+                index, log_weights = self._resample(log_weights)
+                if index is not None:
+                    history.append(index)
+                    tops = [tops[j] for j in index]
+                choices = []
+                for p, (top, bodies, rounds) in enumerate(tops):
+                    if k >= len(rounds):
+                        choices.append({})
+                        continue
+                    loop, i = rounds[k]
+                    trace = Trace(keep_distributions=False)
+                    execute(bodies[loop], trace, i)
+                    choices.append(trace.choices())
+                    log_weights[p] += trace.log_likelihood
+                history.append(choices)
+            final = [top.choices() for top, _, _ in tops]
+
+        # the choices of the ancestors of the final particles, latest first
+        ancestors = np.arange(n)
+        blocks = {}
+        for entry in reversed(history + [final]):
+            if isinstance(entry, np.ndarray):
+                ancestors = entry[ancestors]
+            elif isinstance(entry, dict):
+                for address, values in entry.items():
+                    blocks.setdefault(address, []).append((0, n, np.asarray(values)[ancestors]))
+            else:
+                for p, j in enumerate(ancestors):
+                    for address, value in entry[j].items():
+                        blocks.setdefault(address, []).append((p, 1, np.asarray(value)[None]))
+        samples = {address: _stack(b, n) for address, b in blocks.items()}
+        return WeightedSamples(log_weights, samples)
+
+    def run(self, *args, **kwargs):
+        program = incremental_program(self.model) if self.incremental else None
+        if program is not None:
+            with rng_scope(self.seed):
+                return self._run_loops(program, args, kwargs)
+        n = self.n_particles
+        replay = {} if self.batched else [{}] * n
+        log_likelihood = np.zeros(n)
+        log_weights = np.zeros(n)
+        k = 0
+        with rng_scope(self.seed):
+            while True:
+                k += 1
+                traces, new_log_likelihood = self._round(k, replay, args, kwargs)
+                log_weights = log_weights + new_log_likelihood - log_likelihood
+                log_likelihood = new_log_likelihood
+                if all(t.n_observes < k for t in traces) or np.all(log_weights == -np.inf):
+                    break
+
+                if self.batched:
+                    replay = traces[0].choices()
+                else:
+                    replay = [t.choices() for t in traces]
+                if effective_sample_size(log_weights) < self.ess_threshold * n:
+                    weights = np.exp(log_weights - logsumexp(log_weights))
+                    index = RESAMPLING[self.resampling](weights, n, _rng())
+                    if self.batched:
+                        replay = {address: np.asarray(values)[index] for address, values in replay.items()}
+                    else:
+                        replay = [replay[i] for i in index]
+                    log_likelihood = log_likelihood[index]
+                    log_weights = np.full(n, logsumexp(log_weights) - np.log(n))
+
+        result = _collect(traces)
+        result.log_weights = log_weights
+        result.traces = traces
+        return result
@@ -0,0 +1,33 @@
+from .sample import probabilistic_program
+from .incremental import _SUBSAMPLE, _Subsample, incremental_program
+
+# Returns a program which executes every loop with independent iterations
+# (see incremental_program), e.g.
+#   for i in range(len(x)):
+#       observe(y[i], IndexedAddress("y", i), Normal(slope * x[i] + intercept, sigma))
+# on a random mini-batch of batch_size iterations, drawn uniformly without
+# replacement in each run. The log probabilities of these iterations are scaled
+# by the inverse inclusion probability n / batch_size, so the log joint of a run
+# is an unbiased estimate of the full log joint at O(batch_size) cost, e.g. for
+# likelihood weighting or stochastic variational inference:
+#   MeanFieldVI(subsample(linear_regression, 1_000), 2_000).run(x, y)
+# With batched execution all particles of a run share the mini-batch (so the
+# finite differences of MeanFieldVI are taken on the same data). Statements
+# outside of such loops are executed as usual.
+def subsample(model, batch_size: int):
+    program = incremental_program(model)
+    if program is None:
+        name = getattr(model, "__name__", model)
+        raise ValueError(f"{name} has no loop with independent iterations to subsample.")
+    func = getattr(model, "__wrapped__", model)
+
+    def subsampled(*args, **kwargs):
+        token = _SUBSAMPLE.set(_Subsample(batch_size))
+        try:
+            return program(*args, **kwargs)
+        finally:
+            _SUBSAMPLE.reset(token)
+
+    # not functools.wraps, as execute would run __wrapped__
+    subsampled.__name__ = subsampled.__qualname__ = func.__name__
+    return probabilistic_program(subsampled)
@@ -0,0 +1,185 @@
+import numpy as np
+import pytest
+from scipy.stats import norm
+
+import probros as pr
+
+@pr.probabilistic_program
+def shared(y):
+    pr.observe(y, "y", pr.Normal(0., 1.))
+
+@pr.probabilistic_program
+def location(y):
+    mu = pr.sample("mu", pr.Normal(0., 1.))
+    pr.observe(y, "y", pr.Normal(mu, 1.))
+    return mu
+
+def test_shared_observation_does_not_depend_on_batch_size():
+    y = np.array([0.5, 1., 2., 3.])
+    expected = norm.logpdf(y).sum()
+    for n in (3, 4, 5):
+        r, trace = pr.execute(shared, pr.Trace(batch_size=n), y)
+        assert np.allclose(trace.log_joint, expected)
+
+def test_draws_are_batched():
+    r, trace = pr.execute(location, pr.Trace(batch_size=4), 1.)
+    assert isinstance(r, pr.Batched) and r.shape == (4,)
+    assert np.allclose(trace.log_likelihood, norm.logpdf(1., r, 1.))
+    assert np.allclose(trace.log_prior, norm.logpdf(r))
+
+def test_replayed_values_are_per_particle():
+    mu = np.array([0., 1., 2., 3.])
+    r, trace = pr.execute(location, pr.Trace(batch_size=4, replay={"mu": mu}), 1.)
+    assert np.allclose(trace.log_joint, norm.logpdf(mu) + norm.logpdf(1., mu, 1.))
+
+def test_batched_matches_unbatched():
+    mu = np.array([-0.5, 0.2, 1.5])
+    r, batched = pr.execute(location, pr.Trace(batch_size=3, replay={"mu": mu}), 0.3)
+    for i in range(3):
+        r, trace = pr.execute(location, pr.Trace(replay={"mu": mu[i]}), 0.3)
+        assert np.isclose(batched.log_joint[i], trace.log_joint)
+
+@pr.probabilistic_program
+def residuals(y):
+    mu = pr.sample("mu", pr.Normal(0., 1.))
+    r = pr.Vector(len(y), t=float)
+    for t in range(len(y)):
+        r[t] = y[t] - mu
+    pr.observe(r, "r", pr.Normal(0., 1.))
+    return mu
+
+@pr.probabilistic_program
+def transitions(K):
+    T = pr.Array((K, K))
+    for i in range(K):
+        T[i] = pr.sample(pr.IndexedAddress("T", i), pr.Dirichlet(np.full(K, 1.)))
+    pr.observe(T, "T", pr.Broadcasted(pr.Dirichlet(np.full(K, 2.))))
+    return T
+
+def test_vector_of_batched_values_is_scored_per_particle():
+    y = np.array([0.5, 1., -0.3, 2.])
+    mu, trace = pr.execute(residuals, pr.Trace(batch_size=4), y)
+    expected = norm.logpdf(y[None] - np.asarray(mu)[:, None]).sum(axis=1)
+    assert np.allclose(trace.log_likelihood, expected)
+
+def test_array_of_batched_rows_is_scored_per_particle():
+    T, trace = pr.execute(transitions, pr.Trace(batch_size=5), 3)
+    rows = np.stack([trace[i]["value"] for i in range(3)], axis=1)
+    expected = pr.Dirichlet(np.full(3, 2.))._logprob(rows).sum(axis=1)
+    assert np.allclose(trace.log_likelihood, expected)
+
+@pr.probabilistic_program
+def autoregressive_moving_average(y):
+    nu = pr.Vector(len(y), fill=0, t=float)
+    err = pr.Vector(len(y), fill=0, t=float)
+    mu = pr.sample("mu", pr.Normal(0, 10))
+    phi = pr.sample("phi", pr.Normal(0, 10))
+    theta = pr.sample("theta", pr.Normal(0, 10))
+    sigma = pr.sample("sigma", pr.HalfCauchy(0., 2.5))
+    nu[0] = mu + phi * mu
+    err[0] = y[0] - nu[0]
+    for t in range(1, len(y)):
+        nu[t] = mu + phi * y[t - 1] + theta * err[t - 1]
+        err[t] = y[t] - nu[t]
+    pr.observe(err, "err", pr.IID(pr.Normal(0, sigma), len(y)))
+
+def test_iid_of_batched_vector():
+    y = np.array([0.1, -0.2, 0.3, 0.05, 0.2])
+    params = {
+        "mu": np.array([0.1, 0., -0.1, 0.2]), "phi": np.array([0.5, 0.2, -0.3, 0.]),
+        "theta": np.array([0.3, 0., 0.1, -0.2]), "sigma": np.array([0.5, 1., 2., 0.3]),
+    }
+    r, batched = pr.execute(autoregressive_moving_average, pr.Trace(batch_size=4, replay=params), y)
+    for i in range(4):
+        r, trace = pr.execute(autoregressive_moving_average, pr.Trace(replay={a: v[i] for a, v in params.items()}), y)
+        assert np.isclose(batched.log_joint[i], trace.log_joint)
+
+@pr.probabilistic_program
+def iid(y):
+    pr.observe(y, "y", pr.IID(pr.Normal(0., 1.), len(y)))
+
+def test_shared_iid_observation():
+    y = np.array([0.5, 1., 2.])
+    r, trace = pr.execute(iid, pr.Trace(batch_size=3), y)
+    assert np.allclose(trace.log_joint, norm.logpdf(y).sum())
+
+# log joints of the particles of a batched run, each replayed unbatched
+def replayed(model, batched, *args):
+    choices = batched.choices()
+    return [pr.execute(model, pr.Trace(replay={a: np.asarray(v)[p] for a, v in choices.items()}), *args)[1].log_joint
+            for p in range(batched.batch_size)]
+
+@pr.probabilistic_program
+def autoregressive(y, K):
+    alpha = pr.sample("alpha", pr.Normal(0., 1.))
+    beta = pr.sample("beta", pr.IID(pr.Normal(0., 1.), K))
+    for t in range(K, len(y)):
+        mu = alpha
+        for k in range(K):
+            mu = mu + beta[k] * y[t - k - 1]
+        pr.observe(y[t], pr.IndexedAddress("y", t), pr.Normal(mu, 1.))
+
+@pr.probabilistic_program
+def mixture(data):
+    p = pr.sample("p", pr.Uniform(0., 1.))
+    mu = pr.Vector(2, t=float)
+    for k in range(2):
+        mu[k] = pr.sample(pr.IndexedAddress("mu", k), pr.Normal(0., 3.))
+    z = pr.Vector(len(data), t=float)
+    for i in range(len(data)):
+        z[i] = pr.sample(pr.IndexedAddress("z", i), pr.Bernoulli(p))
+        pr.observe(data[i], pr.IndexedAddress("data", i), pr.Normal(mu[z[i]], 1.))
+
+@pr.probabilistic_program
+def chain(y):
+    T = pr.Array((2, 2))
+    for k in range(2):
+        T[k] = pr.sample(pr.IndexedAddress("T", k), pr.Dirichlet(np.ones(2)))
+    means = pr.sample("means", pr.IID(pr.Normal(0., 3.), 2))
+    s = pr.sample(pr.IndexedAddress("s", 0), pr.Bernoulli(0.5))
+    for t in range(len(y)):
+        if t > 0:
+            s = pr.sample(pr.IndexedAddress("s", t), pr.Bernoulli(T[s][1]))
+        pr.observe(y[t], pr.IndexedAddress("y", t), pr.Normal(means[s], 1.))
+
+def test_indexed_draws_match_replay():
+    y = np.array([0.3, -0.5, 1.2, 0.8, -0.1, 0.4])
+    for model, args in ((autoregressive, (y, 1)), (autoregressive, (y, 3)), (mixture, (y,)), (chain, (y,))):
+        with pr.rng_scope(0):
+            r, batched = pr.execute(model, pr.Trace(batch_size=5), *args)
+        assert np.allclose(batched.log_joint, replayed(model, batched, *args))
+
+def test_indexing_keeps_the_particle_axis():
+    r, trace = pr.execute(autoregressive, pr.Trace(batch_size=4), np.zeros(3), 2)
+    beta = trace.choices()["beta"]
+    assert isinstance(beta, pr.Batched) and beta.shape == (4, 2)
+    assert np.array_equal(beta[1], np.asarray(beta)[:, 1])
+    assert np.array_equal(beta[beta[0] * 0 + 1], np.asarray(beta)[:, 1])
+    assert np.stack([beta[0], beta[1]], axis=1).shape == (4, 2)
+
+@pr.probabilistic_program
+def branching():
+    c = pr.sample("c", pr.Bernoulli(0.5))
+    if c == 1:
+        pr.sample("x", pr.Normal(0., 1.))
+
+@pr.probabilistic_program
+def list_index():
+    mu = [0., 1.]
+    z = pr.sample("z", pr.Bernoulli(0.5))
+    pr.observe(0., "y", pr.Normal(mu[z], 1.))
+
+def test_control_flow_on_draws_raises():
+    with pytest.raises(TypeError):
+        pr.execute(branching, pr.Trace(batch_size=3))
+    with pytest.raises(TypeError):
+        pr.execute(list_index, pr.Trace(batch_size=3))
+
+@pr.probabilistic_program
+def called():
+    c = pr.sample("c", pr.Bernoulli(0.5))
+    pr.observe(1, "called", pr.Dirac(c))
+
+def test_dirac_of_per_particle_value():
+    r, trace = pr.execute(called, pr.Trace(batch_size=4, replay={"c": np.array([0, 1, 1, 0])}))
+    assert np.array_equal(trace.log_likelihood, [-np.inf, 0., 0., -np.inf])
@@ -0,0 +1,131 @@
+import numpy as np
+import pytest
+from scipy import stats
+
+import probros as pr
+
+# the vectorized ndarray path against scipy
+@pytest.mark.parametrize("distribution, reference, value", [
+    (pr.Normal(0.5, 2.), stats.norm(0.5, 2.), [-1., 0., 3.]),
+    (pr.Gamma(2., 3.), stats.gamma(2., scale=1 / 3.), [0.1, 1., 4.]),
+    (pr.Beta(2., 3.), stats.beta(2., 3.), [0.1, 0.5, 0.9]),
+    (pr.Poisson(2.), stats.poisson(2.), [0., 1., 5.]),
+    (pr.Binomial(5, 0.3), stats.binom(5, 0.3), [0., 2., 5.]),
+    (pr.Geometric(0.3), stats.geom(0.3), [1., 2., 7.]),
+])
+def test_vectorized_logprob(distribution, reference, value):
+    value = np.array(value)
+    logpdf = reference.logpmf if hasattr(reference, "logpmf") else reference.logpdf
+    assert np.isclose(distribution.logprob(value), logpdf(value).sum())
+    assert np.isclose(distribution.logprob(value), sum(distribution.logprob(float(v)) for v in value))
+
+@pytest.mark.parametrize("distribution", [pr.Poisson(2.), pr.Binomial(3, 0.4), pr.Geometric(0.3)])
+def test_discrete_support_is_integral(distribution):
+    assert distribution.logprob(np.array([1.5, 2.])) == -np.inf
+    assert distribution.logprob(np.array([1., 2.])) > -np.inf
+
+def draws(n=5):
+    return [pr.Normal(0., 1.).sample() for _ in range(n)]
+
+def test_rng_scope_is_reproducible():
+    with pr.rng_scope(3):
+        first = draws()
+    with pr.rng_scope(np.random.default_rng(3)):
+        second = draws()
+    with pr.rng_scope(4):
+        other = draws()
+    assert first == second and first != other
+
+def test_rng_scope_restores_the_outer_generator():
+    with pr.rng_scope(0):
+        outer = draws(2)
+        with pr.rng_scope(1):
+            draws()
+        outer += draws(3)
+        # rng=None keeps the current generator
+        with pr.rng_scope(None):
+            outer += draws(1)
+    with pr.rng_scope(0):
+        assert outer == draws(6)
+
+def test_split_rng():
+    streams = pr.split_rng(0, 3)
+    again = pr.split_rng(0, 3)
+    values = [rng.normal(size=4) for rng in streams]
+    assert all(np.array_equal(v, rng.normal(size=4)) for v, rng in zip(values, again))
+    assert not np.array_equal(values[0], values[1])
+
+@pr.probabilistic_program
+def noisy():
+    x = pr.sample("x", pr.Normal(0., 1.))
+    return pr.sample("y", pr.Normal(x, 1.))
+
+def test_trace_rng():
+    r1, t1 = pr.execute(noisy, pr.Trace(rng=5))
+    r2, t2 = pr.execute(noisy, pr.Trace(rng=np.random.default_rng(5)))
+    assert r1 == r2 and t1.log_joint == t2.log_joint
+    # the trace's generator does not consume draws of the current one
+    with pr.rng_scope(0):
+        pr.execute(noisy, pr.Trace(rng=5))
+        after = draws()
+    with pr.rng_scope(0):
+        assert after == draws()
+    r3, t3 = pr.execute(noisy, pr.Trace(batch_size=4, rng=5))
+    r4, t4 = pr.execute(noisy, pr.Trace(batch_size=4, rng=5))
+    assert np.array_equal(r3, r4)
+
+# the fast path with cached parameter-only terms against scipy
+@pytest.mark.parametrize("distribution, reference, values", [
+    (pr.Beta(2., 3.), stats.beta(2., 3.), [0.1, 0.5, 0.9]),
+    (pr.Cauchy(0.5, 2.), stats.cauchy(0.5, 2.), [-3., 0.5, 4.]),
+    (pr.Exponential(2.), stats.expon(scale=0.5), [0., 0.3, 2.]),
+    (pr.Gamma(2., 3.), stats.gamma(2., scale=1 / 3.), [0.1, 1., 4.]),
+    (pr.HalfCauchy(0., 2.), stats.halfcauchy(0., 2.), [0., 1., 5.]),
+    (pr.HalfNormal(0., 2.), stats.halfnorm(0., 2.), [0., 1., 5.]),
+    (pr.InverseGamma(3., 2.), stats.invgamma(3., scale=2.), [0.2, 1., 3.]),
+    (pr.Normal(0.5, 2.), stats.norm(0.5, 2.), [-1., 0., 3.]),
+    (pr.StudentT(3.), stats.t(3.), [-2., 0., 1.5]),
+    (pr.Uniform(-1., 2.), stats.uniform(-1., 3.), [-0.5, 0., 1.9]),
+    (pr.Bernoulli(0.3), stats.bernoulli(0.3), [0, 1]),
+    (pr.Binomial(5, 0.3), stats.binom(5, 0.3), [0, 2, 5]),
+    (pr.DiscreteUniform(1, 6), stats.randint(1, 7), [1, 3, 6]),
+    (pr.Geometric(0.3), stats.geom(0.3), [1, 2, 7]),
+    (pr.HyperGeometric(20, 7, 12), stats.hypergeom(20, 7, 12), [0, 4, 7]),
+    (pr.Poisson(2.), stats.poisson(2.), [0, 1, 5]),
+])
+def test_cached_constants(distribution, reference, values):
+    logpdf = reference.logpmf if hasattr(reference, "logpmf") else reference.logpdf
+    for value in values:
+        assert np.isclose(distribution.logprob(value), logpdf(value))
+
+@pytest.mark.parametrize("cov", [
+    2.,
+    np.array([0.5, 2., 1.]),
+    np.array([[2., 0.5, 0.], [0.5, 1., 0.3], [0., 0.3, 1.5]]),
+])
+def test_multivariate_normal_cholesky(cov):
+    mean = np.array([0.5, -1., 0.])
+    reference = stats.multivariate_normal(mean, np.diag(cov) if np.ndim(cov) == 1 else cov)
+    distribution = pr.MultivariateNormal(mean, cov)
+    values = np.array([[0., 0., 0.], [1., -2., 0.5]])
+    assert np.isclose(distribution.logprob(values[1]), reference.logpdf(values[1]))
+    assert np.isclose(distribution.logprob(values), reference.logpdf(values).sum())
+
+def test_singular_multivariate_normal_uses_scipy():
+    distribution = pr.MultivariateNormal(np.zeros(2), np.ones((2, 2)))
+    assert distribution._chol is None
+    with pytest.raises(np.linalg.LinAlgError):
+        stats.multivariate_normal.logpdf(np.ones(2), np.zeros(2), np.ones((2, 2)))
+    with pytest.raises(np.linalg.LinAlgError):
+        distribution.logprob(np.ones(2))
+
+# densities at the boundary of the support, e.g. Gamma(1, rate) at 0 is log(rate)
+@pytest.mark.parametrize("distribution, reference, value", [
+    (pr.Gamma(1., 2.), stats.gamma(1., scale=0.5), [0., 1.]),
+    (pr.Gamma(2., 2.), stats.gamma(2., scale=0.5), [0., 1.]),
+    (pr.Beta(1., 2.), stats.beta(1., 2.), [0., 0.5]),
+    (pr.Beta(2., 1.), stats.beta(2., 1.), [0.5, 1.]),
+])
+def test_vectorized_logprob_at_boundary(distribution, reference, value):
+    assert np.isclose(distribution.logprob(np.array(value)), reference.logpdf(value).sum())
+    assert np.isclose(distribution.logprob(value[0]), reference.logpdf(value[0]))
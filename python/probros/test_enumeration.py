@@ -0,0 +1,62 @@
+import itertools
+import numpy as np
+import pytest
+from scipy.special import logsumexp
+from scipy.stats import norm
+
+import probros as pr
+from probros import Bernoulli, observe, probabilistic_program, sample
+
+# hidden Markov model with fixed emission means
+@probabilistic_program
+def hmm(y):
+    s = sample(pr.IndexedAddress("s", 0), Bernoulli(0.5))
+    observe(y[0], pr.IndexedAddress("y", 0), pr.Normal(3. * s, 1.))
+    for i in range(1, len(y)):
+        s = sample(pr.IndexedAddress("s", i), Bernoulli(0.9 if s == 1 else 0.2))
+        observe(y[i], pr.IndexedAddress("y", i), pr.Normal(3. * s, 1.))
+
+Y = [0.1, 2.5, 3.3, 2.9, -0.4, 0.2]
+
+def hmm_brute_force(y):
+    log_joint = []
+    for s in itertools.product([0, 1], repeat=len(y)):
+        lp = np.log(0.5)
+        for i in range(len(y)):
+            if i > 0:
+                p = 0.9 if s[i - 1] == 1 else 0.2
+                lp += np.log(p if s[i] else 1 - p)
+            lp += norm.logpdf(y[i], 3. * s[i], 1.)
+        log_joint.append(lp)
+    return np.array(log_joint)
+
+def test_burglary(burglary):
+    model, log_evidence, p_burglary = burglary
+    posterior = pr.Enumeration().run(model, True)
+    assert np.isclose(posterior.log_evidence, log_evidence)
+    assert np.isclose(posterior.marginal("burglary")[1], p_burglary)
+
+def test_hmm():
+    log_joint = hmm_brute_force(Y)
+    posterior = pr.Enumeration().run(hmm, Y)
+    assert len(posterior) == 2 ** len(Y)
+    assert np.isclose(posterior.log_evidence, logsumexp(log_joint))
+    paths = np.array(list(itertools.product([0, 1], repeat=len(Y))))
+    expected = np.exp(log_joint - logsumexp(log_joint)) @ paths[:, 2]
+    assert np.isclose(posterior.mean("s[2]"), expected)
+
+@probabilistic_program
+def geometric():
+    n = 0
+    while sample(pr.IndexedAddress("t", n), Bernoulli(0.5)) == 0:
+        n += 1
+
+@probabilistic_program
+def continuous():
+    sample("x", pr.Normal(0., 1.))
+
+def test_unbounded_and_continuous_models_raise():
+    with pytest.raises(RuntimeError):
+        pr.Enumeration(max_paths=100).run(geometric)
+    with pytest.raises(ValueError):
+        pr.Enumeration().run(continuous)
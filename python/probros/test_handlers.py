@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import numpy as np
+from scipy.stats import norm
+
+import probros as pr
+
+@pr.probabilistic_program
+def location(y):
+    mu = pr.sample("mu", pr.Normal(0., 1.))
+    sigma = pr.sample("sigma", pr.HalfNormal(0., 1.))
+    pr.observe(y, "y", pr.Normal(mu, sigma))
+    return mu
+
+def test_replay():
+    with pr.Replay({"mu": 0.5}):
+        mu, trace = pr.execute(location, pr.Trace(), 1.)
+    assert mu == 0.5 and trace.choices()["mu"] == 0.5
+    assert np.isclose(trace[0]["logprob"], norm.logpdf(0.5))
+
+def test_inner_handler_takes_precedence():
+    with pr.Replay({"mu": 0.5}), pr.Replay({"mu": 2.}):
+        mu, trace = pr.execute(location, pr.Trace(), 1.)
+    assert mu == 2.
+
+def test_condition():
+    conditioned = pr.Condition({"sigma": 1.})(location)
+    mu, trace = pr.execute(conditioned, pr.Trace(), 1.)
+    assert "sigma" not in trace.choices()
+    assert np.isclose(trace.log_likelihood, norm.logpdf(1., mu, 1.) + pr.HalfNormal(0., 1.).logprob(1.))
+
+def test_block():
+    with pr.Block(hide=["y"]):
+        mu, trace = pr.execute(location, pr.Trace(), 1.)
+    assert [entry["address"] for entry in trace] == ["mu", "sigma"]
+    with pr.Block(expose=["mu"]):
+        mu, trace = pr.execute(location, pr.Trace(), 1.)
+    assert [entry["address"] for entry in trace] == ["mu"]
+
+def test_scale():
+    choices = {"mu": 0.5, "sigma": 2.}
+    full = pr.score(location, choices, 1.)
+    with pr.Scale(3.):
+        scaled = pr.score(location, choices, 1.)
+    assert np.isclose(scaled.log_joint, 3 * full.log_joint)
+
+def test_seed():
+    draws = []
+    for _ in range(2):
+        with pr.Seed(0):
+            draws.append(pr.execute(location, pr.Trace(), 1.)[0])
+    assert draws[0] == draws[1]
+
+def test_score_of_partial_choices():
+    trace = pr.score(location, {"mu": 0.5}, 1.)
+    sigma = trace.choices()["sigma"]
+    assert np.isclose(trace.log_joint, norm.logpdf(0.5) + pr.HalfNormal(0., 1.).logprob(sigma) + norm.logpdf(1., 0.5, sigma))
+
+def test_replay_batched():
+    mu = np.array([0., 1., 2.])
+    with pr.Replay({"mu": mu}), pr.Replay({"sigma": np.ones(3)}):
+        r, trace = pr.execute(location, pr.Trace(batch_size=3), 1.)
+    assert np.array_equal(r, mu)
+    assert np.allclose(trace.log_joint, norm.logpdf(mu) + pr.HalfNormal(0., 1.).logprob(1.) + norm.logpdf(1., mu, 1.))
+    expected = [pr.score(location, {"mu": m, "sigma": 1.}, 1.).log_joint for m in mu]
+    assert np.allclose(trace.log_joint, expected)
+
+# handlers keep no state of a `with` block, so that a handled program can run in several threads
+def test_handlers_in_threads():
+    conditioned = pr.Condition({"sigma": 1.})(location)
+    seeded = pr.Seed(0)(location)
+
+    def run(k):
+        results = []
+        for _ in range(200):
+            mu, trace = pr.execute(conditioned, pr.Trace(), float(k))
+            results.append(np.isclose(trace.log_likelihood, norm.logpdf(k, mu, 1.) + pr.HalfNormal(0., 1.).logprob(1.)))
+            results.append(pr.execute(seeded, pr.Trace(), 1.)[0] == first)
+        return all(results)
+
+    first = pr.execute(seeded, pr.Trace(), 1.)[0]
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(8) as executor:
+            assert all(executor.map(run, range(8)))
+    finally:
+        sys.setswitchinterval(interval)
@@ -0,0 +1,16 @@
+import numpy as np
+import pytest
+
+import probros as pr
+
+@pytest.mark.parametrize("engine, gradient", [(pr.HMC, "central"), (pr.NUTS, "central"), (pr.NUTS, "dual")])
+def test_posterior(regression, engine, gradient):
+    model, x, y, mean, std = regression
+    chain = engine(model, 300, burn_in=150, seed=0, gradient=gradient).run(x, y)
+    for k, address in enumerate(("slope", "intercept")):
+        assert abs(chain.mean(address) - mean[k]) < 0.3 * std[k]
+        assert abs(np.sqrt(chain.variance(address)) / std[k] - 1.) < 0.3
+
+def test_unknown_gradient(regression):
+    with pytest.raises(ValueError):
+        pr.HMC(regression[0], 10, gradient="forward")
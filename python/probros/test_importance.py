@@ -0,0 +1,29 @@
+import numpy as np
+
+import probros as pr
+
+def test_burglary(burglary):
+    model, log_evidence, p_burglary = burglary
+    posterior = pr.ImportanceSampler(model, 20_000, seed=0).run(True)
+    assert abs(posterior.log_marginal_likelihood - log_evidence) < 0.05
+    assert abs(posterior.mean("burglary") - p_burglary) < 0.02
+
+def test_location(location):
+    model, y, log_evidence, mean, variance = location
+    for batch_size in (None, 1_000):
+        posterior = pr.ImportanceSampler(model, 5_000, batch_size=batch_size, seed=0).run(y)
+        assert abs(posterior.log_marginal_likelihood - log_evidence) < 0.05
+        assert abs(posterior.mean("mu") - mean) < 0.05
+
+def test_resample_preserves_evidence(location):
+    model, y = location[:2]
+    posterior = pr.ImportanceSampler(model, 1_000, seed=0).run(y)
+    resampled = posterior.resample(500, rng=np.random.default_rng(0))
+    assert len(resampled) == 500
+    assert np.isclose(resampled.log_marginal_likelihood, posterior.log_marginal_likelihood)
+
+def test_resampling_schemes():
+    weights = np.array([0.1, 0.6, 0.3])
+    for resample in (pr.systematic_resample, pr.stratified_resample, pr.multinomial_resample):
+        index = resample(weights, 30_000, np.random.default_rng(0))
+        assert np.allclose(np.bincount(index, minlength=3) / 30_000, weights, atol=0.01)
@@ -0,0 +1,112 @@
+import itertools
+import numpy as np
+import pytest
+from scipy.special import logsumexp
+from scipy.stats import norm
+
+import probros as pr
+from probros.incremental import incremental_program
+
+@pr.probabilistic_program
+def mixture(data):
+    p = pr.sample("p", pr.Uniform(0., 1.))
+    mu = [pr.sample(pr.IndexedAddress("mu", k), pr.Normal(0., 3.)) for k in range(2)]
+    for i in range(len(data)):
+        z = pr.sample(pr.IndexedAddress("z", i), pr.Bernoulli(p))
+        pr.observe(data[i], pr.IndexedAddress("data", i), pr.Normal(mu[z], 0.5))
+
+# the loop mutates xs, which is read after the loop
+@pr.probabilistic_program
+def appended(y):
+    xs = []
+    for i in range(3):
+        xs.append(pr.sample(pr.IndexedAddress("x", i), pr.Normal(0., 1.)))
+    pr.observe(y, "y", pr.Normal(sum(xs), 0.1))
+
+@pr.probabilistic_program
+def appended_discrete(y):
+    zs = []
+    for i in range(3):
+        zs.append(pr.sample(pr.IndexedAddress("z", i), pr.Bernoulli(0.5)))
+    pr.observe(y, "y", pr.Normal(sum(zs), 0.5))
+
+class Box:
+    total = 0.
+
+@pr.probabilistic_program
+def attribute_store(y):
+    box = Box()
+    for i in range(3):
+        box.total = box.total + pr.sample(pr.IndexedAddress("x", i), pr.Normal(0., 1.))
+    pr.observe(y, "y", pr.Normal(box.total, 0.1))
+
+def push(xs, x):
+    xs.append(x)
+
+# the loop mutates xs through functions
+@pr.probabilistic_program
+def pushed(y):
+    xs = []
+    for i in range(3):
+        push(xs, pr.sample(pr.IndexedAddress("x", i), pr.Normal(0., 1.)))
+    pr.observe(y, "y", pr.Normal(sum(xs), 0.1))
+
+@pr.probabilistic_program
+def copied(y):
+    xs = np.zeros(3)
+    for i in range(3):
+        np.copyto(xs[i:i + 1], pr.sample(pr.IndexedAddress("x", i), pr.Normal(0., 1.)))
+    pr.observe(y, "y", pr.Normal(xs.sum(), 0.1))
+
+# model variables are only passed to functions which do not mutate them
+@pr.probabilistic_program
+def log_scale(data):
+    log_sigma = pr.sample("log_sigma", pr.Normal(0., 1.))
+    for i in range(len(data)):
+        pr.observe(data[i], pr.IndexedAddress("data", i), pr.Normal(0., np.exp(log_sigma) + abs(data[0]) * 0))
+
+def data():
+    rng = np.random.default_rng(0)
+    return np.concatenate([rng.normal(-2., 0.5, 15), rng.normal(2., 0.5, 10)])
+
+def test_independent_loop_is_transformed():
+    assert incremental_program(mixture) is not None
+    assert incremental_program(log_scale) is not None
+
+def test_mutating_loops_are_not_transformed():
+    assert incremental_program(appended) is None
+    assert incremental_program(appended_discrete, markov=True) is None
+    assert incremental_program(attribute_store) is None
+    assert incremental_program(pushed) is None
+    assert incremental_program(copied) is None
+
+@pytest.mark.parametrize("model", [pushed, copied])
+def test_loop_mutating_through_functions_matches_full_reexecution(model):
+    full = pr.MetropolisHastings(model, 5_000, seed=0, incremental=False).run(3.)
+    chain = pr.MetropolisHastings(model, 5_000, seed=0).run(3.)
+    assert np.allclose(full.log_joint, chain.log_joint)
+    chain = pr.MetropolisHastings(model, 20_000, burn_in=2_000, seed=0).run(3.)
+    total = sum(chain[f"x[{i}]"] for i in range(3))
+    assert abs(np.mean(total) - 3.) < 0.2
+
+def test_incremental_chain_matches_full_reexecution():
+    full = pr.MetropolisHastings(mixture, 300, seed=1, incremental=False).run(data())
+    incremental = pr.MetropolisHastings(mixture, 300, seed=1).run(data())
+    assert np.allclose(full.log_joint, incremental.log_joint)
+    for address in ("p", "mu[0]", "mu[1]", "z[3]"):
+        assert np.allclose(full[address], incremental[address])
+
+def test_mutating_loop_rescores_downstream_observe():
+    chain = pr.MetropolisHastings(appended, 20_000, burn_in=2_000, seed=0).run(3.)
+    assert chain.acceptance_rate < 0.5
+    total = sum(chain[f"x[{i}]"] for i in range(3))
+    assert abs(np.mean(total) - 3.) < 0.2
+
+def test_marginalize_mutating_loop():
+    r, trace = pr.marginalize(appended_discrete)(1.)
+    expected = logsumexp([3 * np.log(0.5) + norm.logpdf(1., sum(z), 0.5) for z in itertools.product([0, 1], repeat=3)])
+    assert np.isclose(trace.log_joint, expected)
+
+def test_subsample_requires_independent_loop():
+    with pytest.raises(ValueError):
+        pr.subsample(appended, 1)
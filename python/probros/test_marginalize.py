@@ -0,0 +1,103 @@
+import itertools
+import numpy as np
+from scipy.special import logsumexp
+from scipy.stats import norm
+
+import probros as pr
+from probros.incremental import incremental_program
+from probros.marginalize import log_marginal
+
+# the states only depend on the previous one through s[i - 1]
+@pr.probabilistic_program
+def hmm(y):
+    m = [pr.sample(pr.IndexedAddress("m", k), pr.Normal(3. * k, 1.)) for k in range(2)]
+    s = pr.Vector(len(y), t=int)
+    s[0] = pr.sample(pr.IndexedAddress("s", 0), pr.Bernoulli(0.5))
+    pr.observe(y[0], pr.IndexedAddress("y", 0), pr.Normal(m[s[0]], 1.))
+    for i in range(1, len(y)):
+        s[i] = pr.sample(pr.IndexedAddress("s", i), pr.Bernoulli(0.9 if s[i - 1] == 1 else 0.2))
+        pr.observe(y[i], pr.IndexedAddress("y", i), pr.Normal(m[s[i]], 1.))
+
+@pr.probabilistic_program
+def mixture(y):
+    p = pr.sample("p", pr.Uniform(0., 1.))
+    mu = [pr.sample(pr.IndexedAddress("mu", k), pr.Normal(0., 3.)) for k in range(2)]
+    for i in range(len(y)):
+        z = pr.sample(pr.IndexedAddress("z", i), pr.Bernoulli(p))
+        pr.observe(y[i], pr.IndexedAddress("y", i), pr.Normal(mu[z], 1.))
+
+Y = [0.1, 2.5, 3.3, 2.9, -0.4, 0.2]
+MEANS = {"m[0]": 0.2, "m[1]": 2.8}
+
+# sums over all 2^len(y) state sequences
+def hmm_brute_force(y, means):
+    terms = []
+    for s in itertools.product([0, 1], repeat=len(y)):
+        lp = norm.logpdf(means["m[0]"], 0., 1.) + norm.logpdf(means["m[1]"], 3., 1.) + np.log(0.5)
+        for i in range(len(y)):
+            if i > 0:
+                p = 0.9 if s[i - 1] == 1 else 0.2
+                lp += np.log(p if s[i] else 1 - p)
+            lp += norm.logpdf(y[i], means[f"m[{s[i]}]"], 1.)
+        terms.append(lp)
+    return logsumexp(terms)
+
+def test_forward_algorithm():
+    program = incremental_program(hmm, markov=True)
+    assert program.markov_loops
+    assert np.isclose(log_marginal(program, MEANS, (Y,), {}), hmm_brute_force(Y, MEANS))
+
+def test_independent_iterations():
+    y = np.concatenate([np.random.default_rng(0).normal(-2., 1., 30), np.random.default_rng(1).normal(2., 1., 20)])
+    values = {"p": 0.4, "mu[0]": -2., "mu[1]": 2.}
+    expected = norm.logpdf(-2., 0., 3.) + norm.logpdf(2., 0., 3.) + np.logaddexp(
+        np.log(0.6) + norm.logpdf(y, -2., 1.), np.log(0.4) + norm.logpdf(y, 2., 1.)).sum()
+    assert np.isclose(log_marginal(incremental_program(mixture, markov=True), values, (y,), {}), expected)
+
+def test_marginalized_program():
+    r, trace = pr.execute(pr.marginalize(hmm), pr.Trace(replay=MEANS), Y)
+    assert [entry["address"] for entry in trace] == ["m[0]", "m[1]", "marginal"]
+    assert np.isclose(trace.log_joint, hmm_brute_force(Y, MEANS))
+
+# x[i] is continuous and stays sampled, z[i] is summed out
+@pr.probabilistic_program
+def noisy_mixture(y):
+    mu = pr.sample("mu", pr.Normal(0., 3.))
+    for i in range(len(y)):
+        x = pr.sample(pr.IndexedAddress("x", i), pr.Normal(mu, 1.))
+        z = pr.sample(pr.IndexedAddress("z", i), pr.Bernoulli(0.3))
+        pr.observe(y[i], pr.IndexedAddress("y", i), pr.Normal(x + 2. * z, 0.5))
+
+@pr.probabilistic_program
+def noisy_hmm(y):
+    s = pr.Vector(len(y), t=int)
+    s[0] = pr.sample(pr.IndexedAddress("s", 0), pr.Bernoulli(0.5))
+    pr.observe(y[0], pr.IndexedAddress("y", 0), pr.Normal(3. * s[0], 1.))
+    for i in range(1, len(y)):
+        e = pr.sample(pr.IndexedAddress("e", i), pr.Normal(0., 1.))
+        s[i] = pr.sample(pr.IndexedAddress("s", i), pr.Bernoulli(0.9 if s[i - 1] == 1 else 0.2))
+        pr.observe(y[i], pr.IndexedAddress("y", i), pr.Normal(3. * s[i] + e, 1.))
+
+def test_continuous_sites_in_independent_loop():
+    values = {"mu": 0.5, **{f"x[{i}]": x for i, x in enumerate([0.3, 1., 1.2, 0.8, -0.1, 0.])}}
+    r, trace = pr.execute(pr.marginalize(noisy_mixture), pr.Trace(replay=values), Y)
+    assert [entry["address"] for entry in trace] == list(values) + ["marginal"]
+    x = np.array(list(values.values())[1:])
+    expected = norm.logpdf(0.5, 0., 3.) + norm.logpdf(x, 0.5, 1.).sum() + np.logaddexp(
+        np.log(0.7) + norm.logpdf(Y, x, 0.5), np.log(0.3) + norm.logpdf(Y, x + 2., 0.5)).sum()
+    assert np.isclose(trace.log_joint, expected)
+    # fresh draws of the continuous sites
+    r, trace = pr.execute(pr.marginalize(noisy_mixture), pr.Trace(), Y)
+    assert set(trace.choices()) == set(values)
+
+def test_continuous_sites_in_markov_loop():
+    e = {f"e[{i}]": 0.1 * i for i in range(1, len(Y))}
+    r, trace = pr.execute(pr.marginalize(noisy_hmm), pr.Trace(replay=e), Y)
+    terms = []
+    for s in itertools.product([0, 1], repeat=len(Y)):
+        lp = np.log(0.5) + norm.logpdf(Y[0], 3. * s[0], 1.)
+        for i in range(1, len(Y)):
+            p = 0.9 if s[i - 1] == 1 else 0.2
+            lp += norm.logpdf(e[f"e[{i}]"], 0., 1.) + np.log(p if s[i] else 1 - p) + norm.logpdf(Y[i], 3. * s[i] + e[f"e[{i}]"], 1.)
+        terms.append(lp)
+    assert np.isclose(trace.log_joint, logsumexp(terms))
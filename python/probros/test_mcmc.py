@@ -0,0 +1,16 @@
+import numpy as np
+
+import probros as pr
+
+def test_posterior_mean(location):
+    model, y, log_evidence, mean, variance = location
+    chain = pr.MetropolisHastings(model, 5_000, burn_in=500, seed=0).run(y)
+    assert 0. < chain.acceptance_rate < 1.
+    assert abs(chain.mean("mu") - mean) < 0.05
+    assert abs(chain.variance("mu") - variance) < 0.03
+
+def test_seed_reproduces_chain(location):
+    model, y = location[:2]
+    first = pr.MetropolisHastings(model, 200, seed=3).run(y)
+    second = pr.MetropolisHastings(model, 200, seed=3).run(y)
+    assert np.array_equal(first["mu"], second["mu"])
@@ -0,0 +1,17 @@
+import numpy as np
+
+import probros as pr
+
+def test_map_is_posterior_mode(regression):
+    model, x, y, mean, std = regression
+    for gradient in ("central", "dual"):
+        estimate = pr.MAP(model, gradient=gradient, seed=0).run(x, y)
+        assert estimate.success
+        assert np.allclose([estimate["slope"], estimate["intercept"]], mean, atol=1e-4)
+
+def test_maximum_likelihood_is_least_squares(regression):
+    model, x, y = regression[:3]
+    X = np.stack([x, np.ones_like(x)], axis=1)
+    expected = np.linalg.lstsq(X, y, rcond=None)[0]
+    estimate = pr.MAP(model, maximum_likelihood=True, seed=0).run(x, y)
+    assert np.allclose([estimate["slope"], estimate["intercept"]], expected, atol=1e-4)
@@ -0,0 +1,286 @@
+import asyncio
+import importlib
+import pickle
+import sys
+import time
+import numpy as np
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+
+import probros as pr
+
+# the module, probros.sample is the sample statement
+sample_module = importlib.import_module("probros.sample")
+
+def test_indexed_address():
+    address = pr.IndexedAddress("y", 17)
+    assert address == "y[17]" and {"y[17]": 1}[address] == 1
+    assert (address.base, address.index, address.key) == ("y", (17,), ("y", 17))
+    assert address is pr.IndexedAddress("y", 17)
+    assert pickle.loads(pickle.dumps(address)) == address
+    assert pr.IndexedAddress("T", 1, 2) == "T[1,2]"
+
+def test_indexed_address_does_not_depend_on_call_history():
+    assert pr.IndexedAddress("h", 1.0) == "h[1.0]"
+    assert pr.IndexedAddress("h", 1) == "h[1]"
+    assert pr.IndexedAddress("h", True) == "h[True]"
+
+    assert pr.IndexedAddress("h", 1, 1) == "h[1,1]"
+    assert pr.IndexedAddress("h", 1, True) == "h[1,True]"
+
+# addresses beyond the bound are not cached, and do not evict cached ones
+def test_indexed_address_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(sample_module, "_ADDRESSES", {})
+    monkeypatch.setattr(sample_module, "_n_addresses", 0)
+    monkeypatch.setattr(sample_module, "_MAX_ADDRESSES", 10)
+    first = pr.IndexedAddress("bounded", 0)
+    for i in range(100):
+        assert pr.IndexedAddress("bounded", i) == f"bounded[{i}]"
+    assert sum(map(len, sample_module._ADDRESSES.values())) == 10
+    assert pr.IndexedAddress("bounded", 0) is first
+
+@pr.probabilistic_program
+def indexed(y):
+    mu = pr.sample("mu", pr.Normal(0., 1.))
+    for i in range(len(y)):
+        pr.observe(y[i], pr.IndexedAddress("y", i), pr.Normal(mu, 1.))
+
+def test_trace_indexed():
+    y = np.array([0.5, -1., 2.])
+    r, trace = indexed(y)
+    index, values = trace.indexed("y")
+    assert np.array_equal(index, [0, 1, 2]) and np.array_equal(values, y)
+    assert np.isclose(trace.indexed("y", "logprob")[1].sum(), trace.log_likelihood)
+    assert trace.entries_by_address()["y[1]"]["value"] == y[1]
+
+def test_vector_dtypes():
+    assert pr.Vector(3, t=int).array.dtype == np.int64
+    assert pr.Vector(3, t=bool).array.dtype == np.bool_
+    v = pr.Vector(3, fill=0)
+    v[0] = 1.5
+    assert v.array.dtype == np.float64 and v[0] == 1.5
+    v = pr.Vector(3, t=int)
+    v[0] = 2.
+    assert v[0] == 2 and v.array.dtype == np.int64
+    with pytest.raises(ValueError):
+        v[1] = 2.7
+    with pytest.raises(ValueError):
+        v[:] = np.array([1., 2.5, 3.])
+
+def test_vector_keeps_bools_and_strings():
+    v = pr.Vector(3)
+    v[0] = True
+    v[1] = "a"
+    assert v[0] is True and v[1] == "a"
+    v = pr.Vector(2, fill=False)
+    v[0] = 3
+    assert v[0] == 3 and v[1] is False
+
+def test_vector_float_index():
+    v = pr.Vector(3, t=float)
+    v[1] = 5.
+    assert v[np.float64(1.)] == 5.
+    with pytest.raises(IndexError):
+        v[0.7]
+
+def test_vector_and_array_share_their_buffer():
+    v = pr.Vector(4, t=float)
+    assert np.shares_memory(np.asarray(v), v.array)
+    a = pr.Array((2, 3))
+    a[0] = np.array([0.2, 0.3, 0.5])
+    assert len(a) == 2 and a.array.dtype == np.float64
+    assert np.shares_memory(np.asarray(a), a.array)
+
+# the buffer protocol of Python classes (__buffer__) requires Python 3.12
+@pytest.mark.skipif(sys.version_info < (3, 12), reason="requires Python 3.12")
+def test_buffer_protocol():
+    a = pr.Array((2, 3), t=float)
+    a[0] = np.array([0.2, 0.3, 0.5])
+    view = memoryview(a)
+    assert view.shape == (2, 3) and view.format == "d"
+    assert view[0, 1] == 0.3
+    a[1, 2] = 4.
+    assert view[1, 2] == 4.
+
+@pr.probabilistic_program
+def mixed(y):
+    p = pr.sample("p", pr.Beta(2., 2.))
+    k = pr.sample("k", pr.Binomial(3, p))
+    w = pr.sample("w", pr.Dirichlet(np.ones(3)))
+    pr.observe(y, "y", pr.Normal(k * w[0], 1.))
+    pr.factor(-0.5, "penalty")
+    return k
+
+def test_trace_columns():
+    r, trace = mixed(0.5)
+    assert len(trace) == 5
+    assert [entry["address"] for entry in trace] == ["p", "k", "w", "y", "penalty"]
+    assert [entry["kind"] for entry in trace] == ["sample", "sample", "sample", "observe", "factor"]
+    assert np.array_equal(trace.kinds(), [pr.SAMPLE, pr.SAMPLE, pr.SAMPLE, pr.OBSERVE, pr.FACTOR])
+    assert trace[0]["value"] == trace.choices()["p"] and trace[1]["value"] == r
+    assert trace[2]["value"].shape == (3,) and trace[-2]["value"] == 0.5
+    assert set(trace[-1]) == {"address", "kind", "logprob"}
+    assert [entry["address"] for entry in trace[1:3]] == ["k", "w"]
+    assert np.isclose(trace.logprobs()[:3].sum(), trace.log_prior)
+    assert np.isclose(trace.logprobs()[3:].sum(), trace.log_likelihood)
+    assert np.isclose(trace[0]["logprob"], trace[0]["distribution"].logprob(trace[0]["value"]))
+    with pytest.raises(IndexError):
+        trace[5]
+
+def test_trace_grows():
+    y = np.linspace(-1., 1., 100)
+    r, trace = pr.execute(indexed, pr.Trace(capacity=1), y)
+    assert len(trace) == 101 and trace.addresses()[-1] == "y[99]"
+    assert np.array_equal(trace.indexed("y")[1], y)
+    assert np.isclose(trace.logprobs().sum(), trace.log_joint)
+
+def test_trace_without_distributions():
+    r, trace = pr.execute(mixed, pr.Trace(keep_distributions=False), 0.5)
+    assert "distribution" not in trace[0] and set(trace[0]) == {"address", "kind", "value", "logprob"}
+    with pytest.raises(KeyError):
+        trace[0]["distribution"]
+    with pr.rng_scope(0):
+        kept = mixed(0.5)[1]
+    with pr.rng_scope(0):
+        dropped = pr.execute(mixed, pr.Trace(keep_distributions=False), 0.5)[1]
+    assert np.array_equal(kept.logprobs(), dropped.logprobs())
+
+@pr.probabilistic_program
+def impossible(y):
+    c = pr.sample("c", pr.Bernoulli(0.5))
+    pr.observe(y, "y", pr.Dirac(c))
+    return pr.sample("x", pr.Normal(0., 1.))
+
+def test_log_probabilities_are_accumulated():
+    r, trace = mixed(0.5)
+    assert np.isclose(trace.log_joint, trace.log_prior + trace.log_likelihood)
+    assert np.isclose(trace.log_likelihood, trace[3]["logprob"] - 0.5)
+
+def test_early_exit():
+    replay = {"c": 0}
+    r, trace = pr.execute(impossible, pr.Trace(replay=replay, early_exit=True), 1)
+    assert r is None and len(trace) == 2 and trace.log_joint == -np.inf
+    r, trace = pr.execute(impossible, pr.Trace(replay=replay), 1)
+    assert r is not None and len(trace) == 3 and trace.log_joint == -np.inf
+    # batched runs stop only if all particles have probability zero
+    r, trace = pr.execute(impossible, pr.Trace(batch_size=3, replay={"c": np.array([0, 1, 0])}, early_exit=True), 1)
+    assert r is not None and len(trace) == 3
+    r, trace = pr.execute(impossible, pr.Trace(batch_size=3, replay={"c": np.zeros(3, int)}, early_exit=True), 1)
+    assert r is None and len(trace) == 2
+
+@pr.probabilistic_program
+def inner(k):
+    return pr.sample("inner", pr.Normal(k, 1.))
+
+@pr.probabilistic_program
+def outer(k):
+    x = pr.sample("outer", pr.Normal(0., 1.))
+    r, trace = inner(k)
+    pr.observe(r, "r", pr.Normal(x, 1.))
+    return trace
+
+def test_nested_runs_restore_the_outer_trace():
+    inner_trace, trace = outer(3.)
+    assert [entry["address"] for entry in trace] == ["outer", "r"]
+    assert [entry["address"] for entry in inner_trace] == ["inner"]
+    with pytest.raises(RuntimeError):
+        pr.sample("x", pr.Normal(0., 1.))
+
+@pr.probabilistic_program
+def slow(k):
+    for i in range(20):
+        pr.observe(float(k), pr.IndexedAddress(f"y{k}", i), pr.Normal(0., 1.))
+        time.sleep(0.0005)
+    return k
+
+def test_threads_keep_their_traces():
+    with ThreadPoolExecutor(8) as executor:
+        runs = list(executor.map(slow, range(16)))
+    for k, (r, trace) in enumerate(runs):
+        assert r == k and len(trace) == 20
+        assert all(address.startswith(f"y{k}[") for address in trace.addresses())
+
+@pr.probabilistic_program
+async def interleaved(k):
+    for i in range(10):
+        pr.observe(float(k), pr.IndexedAddress(f"y{k}", i), pr.Normal(0., 1.))
+        await asyncio.sleep(0)
+    return k
+
+def test_tasks_keep_their_traces():
+    async def main():
+        return await asyncio.gather(*(asyncio.create_task(run(k)) for k in range(5)))
+
+    async def run(k):
+        trace = pr.Trace()
+        token = sample_module._TRACE.set(trace)
+        try:
+            await interleaved.__wrapped__(k)
+        finally:
+            sample_module._TRACE.reset(token)
+        return trace
+
+    for k, trace in enumerate(asyncio.run(main())):
+        assert len(trace) == 10 and all(address.startswith(f"y{k}[") for address in trace.addresses())
+
+@pr.probabilistic_program
+def conjugate(y):
+    mu = pr.sample("mu", pr.Normal(0., 1.))
+    pr.observe(y, "y", pr.Normal(mu, 1.))
+
+def test_parallel_moments_are_reproducible():
+    first = pr.estimate_moments_parallel(2, 7, 2_000, 3, conjugate, 1.)
+    second = pr.estimate_moments_parallel(2, 7, 2_000, 3, conjugate, 1.)
+    other = pr.estimate_moments_parallel(2, 8, 2_000, 3, conjugate, 1.)
+    assert first.n_iter == 2_000
+    assert first["mu"] == second["mu"] and first.log_evidence == second.log_evidence
+    assert first["mu"] != other["mu"]
+    # posterior N(0.5, 0.5)
+    assert abs(first.mean("mu") - 0.5) < 0.1 and abs(first.variance("mu") - 0.5) < 0.1
+
+@pr.probabilistic_program
+def skewed(y):
+    s = pr.sample("s", pr.Gamma(2., 1.))
+    v = pr.sample("v", pr.IID(pr.Normal(0., 1.), 2))
+    pr.observe(y, "y", pr.Normal(s + v[0], 1.))
+
+# weighted central moments of the stored runs
+def direct_moments(log_weights, values, K):
+    w = np.exp(log_weights - log_weights.max())
+    w = (w / w.sum()).reshape((-1,) + (1,) * (values.ndim - 1))
+    mean = (w * values).sum(axis=0)
+    return [mean] + [(w * (values - mean) ** p).sum(axis=0) for p in range(2, K + 1)]
+
+def test_streaming_moments_match_direct_moments():
+    first, second = sample_module._StreamingMoments(4), sample_module._StreamingMoments(4)
+    first.BLOCK_SIZE = 100
+    log_weights, values = [], {"s": [], "v": []}
+    with pr.rng_scope(0):
+        for i in range(2_000):
+            r, trace = skewed(1.5)
+            (first if i < 1_000 else second).add(trace.log_likelihood, trace)
+            log_weights.append(trace.log_likelihood)
+            for address in values:
+                values[address].append(trace.choices()[address])
+    first.merge(second)
+    result = first.result()
+    log_weights = np.array(log_weights)
+    assert result.n_iter == 2_000
+    assert np.isclose(result.log_evidence, np.log(np.mean(np.exp(log_weights))))
+    for address in values:
+        expected = direct_moments(log_weights, np.array(values[address]), 4)
+        for moment, value in zip(result[address], expected):
+            assert np.allclose(moment, value)
+
+def test_estimate_moments_of_batched_runs():
+    moments = sample_module._StreamingMoments(2)
+    with pr.rng_scope(0):
+        r, trace = pr.execute(skewed, pr.Trace(batch_size=5_000), 1.5)
+    moments.add(trace.log_likelihood, trace)
+    expected = direct_moments(trace.log_likelihood, np.asarray(trace.choices()["v"]), 2)
+    assert np.allclose(moments.result()["v"], expected)
+
+def test_estimate_moments():
+    with pr.rng_scope(0):
+        result = pr.estimate_moments(5_000, 2, conjugate, 1.)
+    assert abs(result.mean("mu") - 0.5) < 0.05 and abs(result.variance("mu") - 0.5) < 0.05
@@ -0,0 +1,85 @@
+import numpy as np
+from scipy.special import logsumexp
+from scipy.stats import norm
+
+import probros as pr
+from probros.incremental import incremental_program
+
+# the iterations of the loop are independent given c
+@pr.probabilistic_program
+def clusters(y):
+    c = pr.sample("c", pr.Bernoulli(0.5))
+    for i in range(len(y)):
+        x = pr.sample(pr.IndexedAddress("x", i), pr.Normal(2. * c, 1.))
+        pr.observe(y[i], pr.IndexedAddress("y", i), pr.Normal(x, 1.))
+
+# x[t] depends on x[t - 1], so the rounds re-execute the model
+@pr.probabilistic_program
+def ssm(y):
+    x = pr.sample(pr.IndexedAddress("x", 0), pr.Normal(0., 1.))
+    pr.observe(y[0], pr.IndexedAddress("y", 0), pr.Normal(x, 0.5))
+    for t in range(1, len(y)):
+        x = pr.sample(pr.IndexedAddress("x", t), pr.Normal(0.9 * x, 0.5))
+        pr.observe(y[t], pr.IndexedAddress("y", t), pr.Normal(x, 0.5))
+    return x
+
+def kalman(y):
+    m, P, log_evidence = 0., 1., 0.
+    for t, yt in enumerate(y):
+        if t > 0:
+            m, P = 0.9 * m, 0.81 * P + 0.25
+        S = P + 0.25
+        log_evidence += norm.logpdf(yt, m, np.sqrt(S))
+        K = P / S
+        m, P = m + K * (yt - m), (1 - K) * P
+    return log_evidence, m
+
+def series(T):
+    rng = np.random.default_rng(1)
+    x, y = 0., []
+    for t in range(T):
+        x = 0.9 * x + 0.5 * rng.normal() if t else rng.normal()
+        y.append(x + 0.5 * rng.normal())
+    return y
+
+Y = [2.1, 1.4, 2.8, 1.9, 2.5, 0.7]
+
+def clusters_evidence(y):
+    return logsumexp([np.log(0.5) + norm.logpdf(y, 2. * c, np.sqrt(2.)).sum() for c in (0, 1)])
+
+def test_independent_loop_is_resumed():
+    assert incremental_program(clusters) is not None
+    assert incremental_program(ssm) is None
+
+def test_resumed_evidence():
+    estimates = [pr.SequentialMonteCarlo(clusters, 500, seed=s).run(Y).log_marginal_likelihood for s in range(3)]
+    assert abs(np.mean(estimates) - clusters_evidence(Y)) < 0.1
+
+# the resumed and re-executed particle filters target the same evidence
+def test_resumed_evidence_matches_reexecution():
+    resumed = [pr.SequentialMonteCarlo(clusters, 200, seed=s).run(Y).log_marginal_likelihood for s in range(10)]
+    reexecuted = [pr.SequentialMonteCarlo(clusters, 200, seed=s, incremental=False).run(Y).log_marginal_likelihood for s in range(10, 20)]
+    error = np.sqrt((np.var(resumed) + np.var(reexecuted)) / 10)
+    assert abs(np.mean(resumed) - np.mean(reexecuted)) < 4 * error + 0.01
+    assert abs(np.mean(reexecuted) - clusters_evidence(Y)) < 0.1
+
+def test_resumed_batched_evidence():
+    result = pr.SequentialMonteCarlo(clusters, 5_000, batched=True, seed=0).run(Y)
+    assert abs(result.log_marginal_likelihood - clusters_evidence(Y)) < 0.05
+    assert abs(result.mean("c") - 1.) < 0.02
+
+def test_resumed_particles_keep_their_history():
+    result = pr.SequentialMonteCarlo(clusters, 2_000, seed=0).run(Y)
+    # x[0] of the final particles is shrunk towards 2 c
+    x, c = np.asarray(result["x[0]"]), np.asarray(result["c"])
+    assert abs(result.mean("x[0]") - (Y[0] + 2.) / 2) < 0.1
+    assert np.all(np.isfinite(x)) and set(np.unique(c)) <= {0, 1}
+
+def test_reexecuted_evidence():
+    y = series(20)
+    expected, m = kalman(y)
+    result = pr.SequentialMonteCarlo(ssm, 1_000, seed=0).run(y)
+    assert abs(result.log_marginal_likelihood - expected) < 0.5
+    assert abs(result.mean("x[19]") - m) < 0.1
+    result = pr.SequentialMonteCarlo(ssm, 2_000, batched=True, seed=0).run(y)
+    assert abs(result.log_marginal_likelihood - expected) < 0.5
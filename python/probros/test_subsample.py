@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+import probros as pr
+
+def data():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=2_000)
+    return x, 2. * x - 1. + 0.5 * rng.normal(size=2_000)
+
+CHOICES = {"slope": 1.9, "intercept": -1.}
+
+def test_log_joint_is_unbiased(regression):
+    regression = regression[0]
+    x, y = data()
+    r, full = pr.execute(regression, pr.Trace(replay=CHOICES), x, y)
+    minibatch = pr.subsample(regression, 100)
+    estimates = []
+    with pr.rng_scope(0):
+        for _ in range(500):
+            r, trace = pr.execute(minibatch, pr.Trace(replay=CHOICES), x, y)
+            estimates.append(trace.log_joint)
+    assert len(trace) == 2 + 100
+    assert abs(np.mean(estimates) - full.log_joint) < 3 * np.std(estimates) / np.sqrt(len(estimates))
+
+def test_full_batch_is_exact(regression):
+    regression = regression[0]
+    x, y = data()
+    r, full = pr.execute(regression, pr.Trace(replay=CHOICES), x[:50], y[:50])
+    r, trace = pr.execute(pr.subsample(regression, 50), pr.Trace(replay=CHOICES), x[:50], y[:50])
+    assert np.isclose(trace.log_joint, full.log_joint)
+
+@pr.probabilistic_program
+def no_loop(y):
+    mu = pr.sample("mu", pr.Normal(0., 1.))
+    pr.observe(y, "y", pr.Normal(mu, 1.))
+
+def test_model_without_loop_raises():
+    with pytest.raises(ValueError):
+        pr.subsample(no_loop, 10)
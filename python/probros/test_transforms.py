@@ -0,0 +1,49 @@
+import warnings
+import numpy as np
+
+import probros as pr
+from probros.transforms import ParameterSpace
+
+@pr.probabilistic_program
+def linear_regression(x, y):
+    slope = pr.sample("slope", pr.Normal(0., 3.))
+    intercept = pr.sample("intercept", pr.Normal(0., 3.))
+    sigma = pr.sample("sigma", pr.HalfCauchy(0., 2.))
+    for i in range(len(x)):
+        pr.observe(y[i], pr.IndexedAddress("y", i), pr.Normal(slope * x[i] + intercept, sigma))
+
+@pr.probabilistic_program
+def vectorized(x, y):
+    slope = pr.sample("slope", pr.Normal(0., 3.))
+    sigma = pr.sample("sigma", pr.Gamma(2., 1.))
+    p = pr.sample("p", pr.Beta(2., 2.))
+    w = pr.sample("w", pr.IID(pr.Normal(0., 1.), 3))
+    pr.observe(y, "y", pr.Broadcasted(pr.Normal(slope * x, sigma)))
+    pr.observe(3, "k", pr.Binomial(10, p))
+    pr.observe(np.array([0.1, 0.2, -0.3]), "w", pr.MultivariateNormal(w, np.diag([1., 2., 3.])))
+
+def data():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=20)
+    return x, 2 * x - 1 + 0.5 * rng.normal(size=20)
+
+def space(model, args):
+    with pr.rng_scope(0):
+        return ParameterSpace.from_model(model, args, {})
+
+def test_dual_gradient_matches_central_differences():
+    args = data()
+    for model in (linear_regression, vectorized):
+        s = space(model, args)
+        u = s.initial + 0.1
+        value, gradient = s.value_and_gradient(model, u, args, {})
+        assert np.isclose(value, s.log_density(model, u, args, {}))
+        assert np.allclose(gradient, s.gradient(model, u, args, {}), rtol=1e-5, atol=1e-5)
+
+def test_dual_gradient_at_zero_scale():
+    args = data()
+    s = space(linear_regression, args)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        value, gradient = s.value_and_gradient(linear_regression, np.array([0., 0., -800.]), args, {})
+    assert value == -np.inf and np.all(gradient == 0.)
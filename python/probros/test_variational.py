@@ -0,0 +1,17 @@
+import numpy as np
+
+import probros as pr
+
+def test_reparameterized(regression):
+    model, x, y, mean, std = regression
+    q = pr.MeanFieldVI(model, 1_000, seed=0).run(x, y)
+    for k, address in enumerate(("slope", "intercept")):
+        assert abs(q.median()[address] - mean[k]) < 0.5 * std[k]
+    # the posterior correlation is small, so the mean field scales are close
+    assert np.allclose(q.scale, std, rtol=0.3)
+
+def test_score(regression):
+    model, x, y, mean, std = regression
+    q = pr.MeanFieldVI(model, 1_000, n_draws=50, learning_rate=0.02, gradient="score", seed=0).run(x, y)
+    for k, address in enumerate(("slope", "intercept")):
+        assert abs(q.median()[address] - mean[k]) < std[k]
@@ -0,0 +1,232 @@
+from .scipy_distributions import (
+    IID, Broadcasted, Beta, Cauchy, Dirichlet, Exponential, Gamma, HalfCauchy, HalfNormal,
+    InverseGamma, MultivariateNormal, Normal, StudentT, Uniform,
+)
+from .sample import Trace, execute, SAMPLE
+from .dual import Dual
+import numpy as np
+import scipy.special as special
+
+# Bijections from unconstrained reals to the support of a distribution,
+# applied elementwise (except StickBreakingTransform):
+#   forward(u) = x, inverse(x) = u, log_abs_det_jacobian(u) = log |dx/du|
+#   unconstrained_size(shape): length of u for a value of the given shape
+class IdentityTransform:
+    def forward(self, u):
+        return u
+
+    def inverse(self, x):
+        return x
+
+    def log_abs_det_jacobian(self, u):
+        return np.zeros(np.shape(u))
+
+    def unconstrained_size(self, shape: tuple) -> int:
+        return int(np.prod(shape))
+
+    def __repr__(self) -> str:
+        return "IdentityTransform()"
+
+# (low, inf)
+class ExpTransform:
+    def __init__(self, low=0.) -> None:
+        self.low = low
+
+    def forward(self, u):
+        with np.errstate(over="ignore"):
+            return self.low + np.exp(u)
+
+    def inverse(self, x):
+        return np.log(x - self.low)
+
+    def log_abs_det_jacobian(self, u):
+        return u
+
+    def unconstrained_size(self, shape: tuple) -> int:
+        return int(np.prod(shape))
+
+    def __repr__(self) -> str:
+        return f"ExpTransform(low={self.low})"
+
+# (low, high)
+class SigmoidTransform:
+    def __init__(self, low=0., high=1.) -> None:
+        self.low = low
+        self.high = high
+
+    def forward(self, u):
+        return self.low + (self.high - self.low) * special.expit(u)
+
+    def inverse(self, x):
+        return special.logit((x - self.low) / (self.high - self.low))
+
+    def log_abs_det_jacobian(self, u):
+        return np.log(self.high - self.low) + special.log_expit(u) + special.log_expit(-u)
+
+    def unconstrained_size(self, shape: tuple) -> int:
+        return int(np.prod(shape))
+
+    def __repr__(self) -> str:
+        return f"SigmoidTransform(low={self.low}, high={self.high})"
+
+# Simplex of dimension k (last axis of the value) by stick-breaking: the i-th
+# coordinate takes the fraction expit(u_i - log(k - 1 - i)) of the remaining
+# stick, so u = 0 is the center of the simplex. u is flat, k - 1 entries per simplex.
+# Only for numpy arrays, not for Duals.
+class StickBreakingTransform:
+    def __init__(self, k: int) -> None:
+        self.k = k
+        self._offset = np.log(np.arange(k - 1, 0, -1))
+
+    # z, log of the remaining stick before each break, for u of shape (..., m, k - 1)
+    def _breaks(self, u) -> tuple:
+        v = u - self._offset
+        log_rest = np.cumsum(special.log_expit(-v), axis=-1)
+        log_rest = np.concatenate([np.zeros(log_rest.shape[:-1] + (1,)), log_rest], axis=-1)
+        return v, log_rest
+
+    def forward(self, u):
+        u = np.asarray(u, dtype=float)
+        v, log_rest = self._breaks(u.reshape(u.shape[:-1] + (-1, self.k - 1)))
+        x = np.exp(log_rest) * np.concatenate([special.expit(v), np.ones(v.shape[:-1] + (1,))], axis=-1)
+        return x.reshape(u.shape[:-1] + (-1,))
+
+    def inverse(self, x):
+        x = np.asarray(x, dtype=float)
+        rest = 1 - np.cumsum(x[..., :-2], axis=-1)
+        rest = np.concatenate([np.ones(x.shape[:-1] + (1,)), rest], axis=-1)
+        return special.logit(x[..., :-1] / rest) + self._offset
+
+    def log_abs_det_jacobian(self, u):
+        u = np.asarray(u, dtype=float)
+        v, log_rest = self._breaks(u.reshape(u.shape[:-1] + (-1, self.k - 1)))
+        lad = special.log_expit(v) + special.log_expit(-v) + log_rest[..., :-1]
+        return lad.reshape(u.shape)
+
+    def unconstrained_size(self, shape: tuple) -> int:
+        return int(np.prod(shape[:-1])) * (self.k - 1)
+
+    def __repr__(self) -> str:
+        return f"StickBreakingTransform(k={self.k})"
+
+# Transform from unconstrained reals to the support of a continuous distribution.
+def support_transform(distribution):
+    if isinstance(distribution, (IID, Broadcasted)):
+        return support_transform(distribution.base)
+    if isinstance(distribution, (Normal, Cauchy, StudentT, MultivariateNormal)):
+        return IdentityTransform()
+    if isinstance(distribution, (Exponential, Gamma, InverseGamma)):
+        return ExpTransform(0.)
+    if isinstance(distribution, (HalfCauchy, HalfNormal)):
+        return ExpTransform(distribution.loc)
+    if isinstance(distribution, Beta):
+        return SigmoidTransform(0., 1.)
+    if isinstance(distribution, Uniform):
+        return SigmoidTransform(distribution.loc, distribution.loc + distribution.scale)
+    if isinstance(distribution, Dirichlet):
+        return StickBreakingTransform(np.shape(distribution.alpha)[-1])
+    raise ValueError(f"No transform to the support of {distribution}.")
+
+
+# The sample addresses of a model as one flat vector of unconstrained reals.
+# The layout (addresses, shapes, and transforms) is taken from a trace, so the
+# model must visit the same continuous addresses in every run, and the
+# supports must not depend on other addresses.
+# Vectors can be batched, i.e. of shape (n, size), and are then evaluated in a
+# single batched model run if batched=True (see Trace(batch_size=...)).
+class ParameterSpace:
+    def __init__(self, trace: Trace) -> None:
+        self.sites = []
+        offset = 0
+        for i in np.flatnonzero(trace.kinds() == SAMPLE):
+            entry = trace[i]
+            shape = np.shape(entry['value'])
+            transform = support_transform(entry['distribution'])
+            size = transform.unconstrained_size(shape)
+            self.sites.append((entry['address'], shape, transform, offset, size))
+            offset += size
+        self.size = offset
+        # the values of the trace
+        self.initial = self.unconstrained(trace.choices())
+
+    # Runs the model with the prior until it has positive probability.
+    @staticmethod
+    def from_model(model, args, kwargs, max_tries: int = 10_000) -> "ParameterSpace":
+        for _ in range(max_tries):
+            trace = Trace()
+            execute(model, trace, *args, **kwargs)
+            if trace.log_joint > -np.inf:
+                return ParameterSpace(trace)
+        raise RuntimeError(f"Could not find a trace with positive probability in {max_tries} tries.")
+
+    def unconstrained(self, choices: dict) -> np.ndarray:
+        u = np.empty(self.size)
+        for address, shape, transform, offset, size in self.sites:
+            u[offset:offset + size] = np.ravel(transform.inverse(np.asarray(choices[address], dtype=float)))
+        return u
+
+    # address -> value, and the log |det| of the Jacobian (per vector if batched)
+    def constrained(self, u: np.ndarray) -> tuple:
+        batch = u.shape[:-1]
+        choices = {}
+        log_det = np.zeros(batch)
+        for address, shape, transform, offset, size in self.sites:
+            v = u[..., offset:offset + size]
+            x = transform.forward(v).reshape(batch + shape)
+            choices[address] = float(x) if x.ndim == 0 and type(x) is not Dual else x
+            log_det = log_det + transform.log_abs_det_jacobian(v).sum(axis=-1)
+        return choices, log_det
+
+    # log density of the unconstrained vector(s) u, where target is
+    #   "density":    the log density of u, i.e. log joint + log |det| of the Jacobian
+    #   "joint":      the log joint of the constrained values, e.g. for MAP estimates
+    #   "likelihood": the log likelihood of the constrained values
+    def log_density(self, model, u: np.ndarray, args, kwargs, batched: bool = False, target: str = "density"):
+        if u.ndim == 1:
+            return float(self._log_joint(model, u, args, kwargs, None, target))
+        if batched:
+            return self._log_joint(model, u, args, kwargs, len(u), target)
+        return np.array([self._log_joint(model, v, args, kwargs, None, target) for v in u])
+
+    def _log_joint(self, model, u, args, kwargs, batch_size, target="density"):
+        choices, log_det = self.constrained(u)
+        trace = Trace(batch_size=batch_size, keep_distributions=False, replay=choices)
+        execute(model, trace, *args, **kwargs)
+        if len(trace.sample_sites()) != len(self.sites):
+            raise ValueError("The model visits addresses that are not in the parameter space, e.g. discrete ones.")
+        if target == "density":
+            return trace.log_joint + log_det
+        if target == "joint":
+            return trace.log_joint
+        if target == "likelihood":
+            return trace.log_likelihood
+        raise ValueError(f"Unknown target {target}, expected 'density', 'joint', or 'likelihood'.")
+
+    # log density and its gradient at u from a single model run, in which the
+    # values are dual numbers (see Dual), so the model has to use numpy
+    # instead of `math` on them, and all its distributions need dual log densities.
+    # Each operation also propagates size derivatives, so this is slower than
+    # gradient(method="central") unless size is large and the model vectorized.
+    def value_and_gradient(self, model, u: np.ndarray, args, kwargs, target: str = "density") -> tuple:
+        # overflowing values, e.g. of diverging trajectories, give infinite log densities
+        with np.errstate(over="ignore", divide="ignore", invalid="ignore"):
+            lp = self._log_joint(model, Dual.variables(u), args, kwargs, None, target)
+        if type(lp) is not Dual:
+            return float(lp), np.zeros(self.size)
+        # e.g. log(0) - log(0) at a zero scale
+        if not lp.value > -np.inf:
+            return -np.inf, np.zeros(self.size)
+        return float(lp.value), np.array(np.broadcast_to(lp.tangent, (self.size,)))
+
+    # gradient of the log density by central differences, all 2 * size
+    # evaluations form one batch, or with method="dual" by forward mode (see value_and_gradient)
+    def gradient(self, model, u: np.ndarray, args, kwargs, batched: bool = False, method: str = "central",
+                 target: str = "density") -> np.ndarray:
+        if method == "dual":
+            return self.value_and_gradient(model, u, args, kwargs, target)[1]
+        if method != "central":
+            raise ValueError(f"Unknown gradient method {method}, expected 'central' or 'dual'.")
+        h = np.cbrt(np.finfo(float).eps) * np.maximum(1., np.abs(u))
+        steps = np.diag(h)
+        lp = self.log_density(model, np.concatenate([u + steps, u - steps]), args, kwargs, batched, target)
+        return (lp[:self.size] - lp[self.size:]) / (2 * h)
@@ -0,0 +1,126 @@
+from .scipy_distributions import _rng, rng_scope
+from .transforms import ParameterSpace
+import numpy as np
+
+# Mean-field Gaussian approximation q(u) = prod_i N(u_i; loc_i, scale_i) of the
+# posterior over the unconstrained sample addresses of a model (see ParameterSpace).
+class MeanFieldPosterior:
+    def __init__(self, space: ParameterSpace, loc: np.ndarray, log_scale: np.ndarray, elbo: list) -> None:
+        self.space = space
+        self.loc = loc
+        self.log_scale = log_scale
+        # ELBO estimate of each step
+        self.elbo = np.asarray(elbo, dtype=float)
+
+    @property
+    def scale(self) -> np.ndarray:
+        return np.exp(self.log_scale)
+
+    # address -> n draws from q, i.e. shape (n, ...)
+    def sample(self, n: int, rng=None) -> dict:
+        if rng is None:
+            rng = _rng()
+        u = self.loc + self.scale * rng.standard_normal((n, self.space.size))
+        return self.space.constrained(u)[0]
+
+    # address -> value at the mode of q in the unconstrained space (the
+    # median of each scalar address, as the transforms are monotone)
+    def median(self) -> dict:
+        return self.space.constrained(self.loc)[0]
+
+    def mean(self, address, n: int = 1_000):
+        return np.mean(self.sample(n)[address], axis=0)
+
+    def __repr__(self) -> str:
+        elbo = self.elbo[-1] if len(self.elbo) else None
+        return f"MeanFieldPosterior(elbo={elbo}, addresses={[site[0] for site in self.space.sites]})"
+
+
+# Automatic differentiation variational inference (Kucukelbir et al., 2017)
+# without automatic differentiation: a mean-field Gaussian over the
+# unconstrained sample addresses (see ParameterSpace, positive addresses are
+# log-transformed, simplices are stick-broken, ...) is fitted by maximizing the
+# ELBO with Adam. Each step estimates the ELBO from n_draws reparameterized
+# draws u = loc + scale * eps, which are evaluated in one batched model run.
+#   gradient: "reparameterized", i.e. the gradient of the log density at each
+#             draw by central differences (n_draws * (2 * d + 1) points per step),
+#             or "score", i.e. the score function estimator with the mean as
+#             baseline (n_draws points per step, but noisier)
+#   batched:  evaluate all points of a step in one batched model run (see
+#             Trace(batch_size=...)), otherwise the model is run per point
+#   init_scale: initial scale of q, loc starts at a draw from the prior
+# e.g.
+#   q = MeanFieldVI(linear_regression, 2_000).run(x, y)
+#   q.mean("slope"), q.sample(1_000)["sigma"]
+class MeanFieldVI:
+    def __init__(self, model, n_steps: int, n_draws: int = 10, learning_rate: float = 0.05,
+                 gradient: str = "reparameterized", batched: bool = True, init_scale: float = 0.1, seed=None) -> None:
+        if gradient not in ("reparameterized", "score"):
+            raise ValueError(f"Unknown gradient estimator {gradient}, expected 'reparameterized' or 'score'.")
+        self.model = model
+        self.n_steps = n_steps
+        self.n_draws = n_draws
+        self.learning_rate = learning_rate
+        self.gradient = gradient
+        self.batched = batched
+        self.init_scale = init_scale
+        self.seed = seed
+
+    def _log_density(self, u: np.ndarray) -> np.ndarray:
+        lp = self.space.log_density(self.model, u, self.args, self.kwargs, self.batched)
+        return np.broadcast_to(lp, (len(u),))
+
+    # ELBO estimate and its gradients with respect to loc and log_scale
+    def _elbo_gradient(self, loc, log_scale, eps) -> tuple:
+        scale = np.exp(log_scale)
+        u = loc + scale * eps
+        n, d = u.shape
+        entropy = log_scale.sum() + 0.5 * d * (1 + np.log(2 * np.pi))
+
+        if self.gradient == "score":
+            lp = self._log_density(u)
+            log_q = -0.5 * (eps ** 2).sum(axis=1) - log_scale.sum() - 0.5 * d * np.log(2 * np.pi)
+            ok = np.isfinite(lp)
+            if not ok.any():
+                return -np.inf, np.zeros(d), np.zeros(d)
+            f = lp[ok] - log_q[ok]
+            w = (f - f.mean())[:, None]
+            grad_loc = np.mean(w * eps[ok] / scale, axis=0)
+            grad_log_scale = np.mean(w * (eps[ok] ** 2 - 1), axis=0)
+            return f.mean(), grad_loc, grad_log_scale
+
+        # central differences of the log density at all draws, in one batch
+        h = np.cbrt(np.finfo(float).eps) * np.maximum(1., np.abs(u))
+        steps = h[:, :, None] * np.eye(d)
+        points = np.concatenate([u, (u[:, None, :] + steps).reshape(-1, d), (u[:, None, :] - steps).reshape(-1, d)])
+        with np.errstate(invalid="ignore"):
+            lp = self._log_density(points)
+            grads = (lp[n:n + n * d] - lp[n + n * d:]).reshape(n, d) / (2 * h)
+        ok = np.isfinite(lp[:n]) & np.all(np.isfinite(grads), axis=1)
+        if not ok.any():
+            return -np.inf, np.zeros(d), np.zeros(d)
+        grad_loc = grads[ok].mean(axis=0)
+        grad_log_scale = np.mean(grads[ok] * eps[ok] * scale, axis=0) + 1
+        return lp[:n][ok].mean() + entropy, grad_loc, grad_log_scale
+
+    def run(self, *args, **kwargs) -> MeanFieldPosterior:
+        self.args, self.kwargs = args, kwargs
+        with rng_scope(self.seed):
+            rng = _rng()
+            self.space = ParameterSpace.from_model(self.model, args, kwargs)
+            d = self.space.size
+            params = np.concatenate([self.space.initial, np.full(d, np.log(self.init_scale))])
+
+            # Adam (Kingma & Ba, 2015), ascending the ELBO
+            beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+            m, v = np.zeros(2 * d), np.zeros(2 * d)
+            elbo = []
+            for t in range(1, self.n_steps + 1):
+                eps = rng.standard_normal((self.n_draws, d))
+                value, grad_loc, grad_log_scale = self._elbo_gradient(params[:d], params[d:], eps)
+                grad = np.concatenate([grad_loc, grad_log_scale])
+                m = beta1 * m + (1 - beta1) * grad
+                v = beta2 * v + (1 - beta2) * grad ** 2
+                params = params + self.learning_rate * (m / (1 - beta1 ** t)) / (np.sqrt(v / (1 - beta2 ** t)) + epsilon)
+                elbo.append(value)
+        return MeanFieldPosterior(self.space, params[:d], params[d:], elbo)